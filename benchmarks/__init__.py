@@ -0,0 +1,15 @@
+"""
+Load testing for the API and analysis pipeline.
+
+``manage.py benchmark`` seeds doctors and patients, serves the app and a
+``FakeInferenceServer`` in-process, drives concurrent traffic at them and
+reports throughput and latency percentiles per scenario. See
+``benchmarks.load`` for the scenarios.
+
+Seeded rows are deleted afterwards unless ``--keep-data`` is given. SQLite
+serializes writes, so concurrent upload numbers are only meaningful on the
+PostgreSQL database used in production.
+
+``manage.py startup_profile`` reports the import time and memory of the app
+and of the heavy optional dependencies; see ``benchmarks.startup``.
+"""
@@ -0,0 +1,115 @@
+"""
+A stand-in for the EF prediction service.
+
+Speaks the same multipart protocol as the real model server, reading every
+uploaded byte, but sleeps for a configurable latency instead of running a
+model. Benchmarks of the upload and analysis flow then measure the app, not
+the model host.
+"""
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_SIZE = 64 * 1024
+
+
+def _form_fields(content_type, body):
+    """Return the non-file fields of a multipart/form-data body."""
+    message = BytesParser().parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+    return {
+        part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+        for part in message.get_payload()
+        if not part.get_filename()
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeInference/1.0'
+
+    def do_POST(self):
+        server = self.server.fake
+        length = int(self.headers.get('Content-Length', 0))
+        body = bytearray()
+        while len(body) < length:
+            chunk = self.rfile.read(min(READ_SIZE, length - len(body)))
+            if not chunk:
+                break
+            body.extend(chunk)
+
+        time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+        if random.random() < server.error_rate:
+            return self._reply(503, {'detail': 'Injected failure'})
+
+        if self.path.rstrip('/').endswith('/batch'):
+            items = json.loads(_form_fields(self.headers['Content-Type'], bytes(body)).get('items', '[]'))
+            server.count(len(items))
+            return self._reply(200, {'predictions': [{'ef_prediction': server.prediction()} for _ in items]})
+
+        server.count(1)
+        self._reply(200, {'ef_prediction': server.prediction()})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeInferenceServer:
+    """
+    A threaded HTTP server answering ``POST /predict`` and
+    ``POST /predict/batch`` after ``latency`` seconds (normally distributed
+    with ``jitter``), failing ``error_rate`` of the requests with a 503.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.0, error_rate=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.predictions = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/predict'
+
+    @property
+    def batch_url(self):
+        return self.url + '/batch'
+
+    def prediction(self):
+        return round(random.uniform(20, 75), 1)
+
+    def count(self, predictions):
+        with self._lock:
+            self.predictions += predictions
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-inference', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
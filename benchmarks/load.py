@@ -0,0 +1,256 @@
+"""
+Seeding, traffic and reporting for ``manage.py benchmark``.
+
+Each scenario calls one endpoint ``requests`` times from ``concurrency``
+threads over real HTTP and records the latency of every call:
+
+``signup``
+    POST /api/signup/ with a new email each time.
+``login``
+    POST /api/login/ as a seeded doctor.
+``patient_list``
+    GET /api/patients/ as a seeded doctor.
+``diagnosis_list``
+    GET /api/patients/<id>/diagnoses/ for a seeded patient.
+``diagnosis_upload``
+    POST /api/patients/<id>/diagnoses/ with a random echo of ``echo_size``
+    bytes, which stores it and queues an analysis job.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import requests
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+from django.db.models import Q
+
+from accounts.models import Profile
+from patients.models import AnalysisJob, Diagnosis, Patient
+
+SCENARIOS = ['signup', 'login', 'patient_list', 'diagnosis_list', 'diagnosis_upload']
+PASSWORD = 'benchmark-password'
+EMAIL_DOMAIN = 'benchmark.invalid'
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of ``values``, ``p`` between 0 and 100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    elapsed: float
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'scenario': self.name,
+            'requests': self.requests,
+            'errors': self.errors,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 2),
+            **{f'p{p}_ms': round(percentile(self.latencies, p) * 1000, 1) for p in (50, 90, 99)},
+            'max_ms': round(max(self.latencies, default=0) * 1000, 1),
+        }
+
+
+def run_scenario(name, action, count, concurrency):
+    """Call ``action(i)`` for i in ``range(count)`` on ``concurrency`` threads; it returns success."""
+    def call(i):
+        start = time.perf_counter()
+        try:
+            ok = action(i)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'bench-{name}') as pool:
+        calls = list(pool.map(call, range(count)))
+    result = ScenarioResult(name, time.perf_counter() - start)
+    for latency, ok in calls:
+        result.latencies.append(latency)
+        result.errors += not ok
+    return result
+
+
+@dataclass
+class Doctor:
+    email: str
+    patient_ids: list
+
+
+def seed(run_id, doctors, patients_per_doctor):
+    """Create doctors, all with ``PASSWORD``, each with their own patients."""
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    users = User.objects.bulk_create([
+        User(email=f'doctor-{run_id}-{i}@{EMAIL_DOMAIN}', password=password) for i in range(doctors)
+    ])
+    users = list(User.objects.filter(email__in=[user.email for user in users]).order_by('id'))
+    profiles = Profile.objects.bulk_create([
+        Profile(user=user, full_name=f'Dr. Benchmark {i}') for i, user in enumerate(users)
+    ])
+    profiles = list(Profile.objects.filter(user__in=users).order_by('user_id'))
+    Patient.objects.bulk_create([
+        Patient(doctor=profile, full_name=f'Patient {j}', gender='MF'[j % 2])
+        for profile in profiles for j in range(patients_per_doctor)
+    ], batch_size=1000)
+
+    patients = {}
+    for patient_id, doctor_id in Patient.objects.filter(doctor__in=profiles).values_list('id', 'doctor_id'):
+        patients.setdefault(doctor_id, []).append(patient_id)
+    return [Doctor(user.email, patients.get(profile.id, [])) for user, profile in zip(users, profiles)]
+
+
+def cleanup(run_id):
+    """Delete everything a run created, including stored echoes."""
+    users = get_user_model().objects.filter(
+        Q(email__startswith=f'doctor-{run_id}-') | Q(email__startswith=f'signup-{run_id}-'))
+    for patient in Patient.objects.filter(doctor__user__in=users):
+        # One by one so that diagnoses release their echoes
+        patient.delete()
+    users.delete()
+
+
+def analysis_result(run_id, started, timeout, poll_interval=0.5):
+    """
+    Wait for the analyses queued by a run and return their end-to-end
+    latency (queued to finished) and throughput.
+    """
+    jobs = AnalysisJob.objects.filter(
+        kind=AnalysisJob.KIND_ANALYSIS, diagnosis__patient__doctor__user__email__startswith=f'doctor-{run_id}-')
+    deadline = time.monotonic() + timeout
+    while jobs.exclude(status__in=[Diagnosis.ANALYSIS_COMPLETED, Diagnosis.ANALYSIS_FAILED]).exists():
+        if time.monotonic() > deadline:
+            break
+        time.sleep(poll_interval)
+
+    finished = list(jobs.filter(finished_at__isnull=False).values_list('created_at', 'finished_at', 'status'))
+    result = ScenarioResult('analysis', time.monotonic() - started)
+    for created_at, finished_at, status in finished:
+        result.latencies.append((finished_at - created_at).total_seconds())
+        result.errors += status != Diagnosis.ANALYSIS_COMPLETED
+    result.errors += jobs.count() - len(finished)
+    return result
+
+
+class LoadDriver:
+    """Sends the scenario requests to ``base_url`` as the seeded doctors."""
+
+    def __init__(self, base_url, run_id, doctors, echo_size):
+        self.base_url = base_url.rstrip('/')
+        self.run_id = run_id
+        self.doctors = doctors
+        self.echo_size = echo_size
+        self._echo = os.urandom(echo_size)
+        self._local = threading.local()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def token(self, doctor):
+        with self._lock:
+            token = self._tokens.get(doctor.email)
+        if token is None:
+            response = self.session.post(f'{self.base_url}/api/login/', json={'email': doctor.email,
+                                                                             'password': PASSWORD})
+            response.raise_for_status()
+            token = response.json()['access']
+            with self._lock:
+                self._tokens[doctor.email] = token
+        return token
+
+    def _doctor(self, i):
+        return self.doctors[i % len(self.doctors)]
+
+    def _get(self, i, path):
+        doctor = self._doctor(i)
+        headers = {'Authorization': f'Bearer {self.token(doctor)}'}
+        return self.session.get(self.base_url + path.format(patient=self._patient(i)), headers=headers)
+
+    def _patient(self, i):
+        patient_ids = self._doctor(i).patient_ids
+        return patient_ids[(i // len(self.doctors)) % len(patient_ids)]
+
+    def signup(self, i):
+        response = self.session.post(f'{self.base_url}/api/signup/', json={
+            'email': f'signup-{self.run_id}-{i}@{EMAIL_DOMAIN}', 'password': PASSWORD, 'full_name': 'Dr. Signup',
+        })
+        return response.ok
+
+    def login(self, i):
+        response = self.session.post(f'{self.base_url}/api/login/', json={'email': self._doctor(i).email,
+                                                                         'password': PASSWORD})
+        return response.ok
+
+    def patient_list(self, i):
+        return self._get(i, '/api/patients/').ok
+
+    def diagnosis_list(self, i):
+        return self._get(i, '/api/patients/{patient}/diagnoses/').ok
+
+    def diagnosis_upload(self, i):
+        doctor = self._doctor(i)
+        # A unique prefix so that every upload is a new echo, not a deduplicated one
+        echo = i.to_bytes(8, 'big') + self._echo[8:]
+        response = self.session.post(
+            f'{self.base_url}/api/patients/{self._patient(i)}/diagnoses/',
+            headers={'Authorization': f'Bearer {self.token(doctor)}'},
+            data={'symptoms': 'Benchmark', 'view_type': 'a4c'},
+            files={'echocardiogram': (f'echo-{i}.avi', echo, 'video/x-msvideo')},
+        )
+        return response.ok
+
+    def warm_up(self):
+        """Log every doctor in once so scenarios do not pay for it."""
+        for doctor in self.doctors:
+            self.token(doctor)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_app(host='127.0.0.1', port=0):
+    """Serve the Django app on a threaded WSGI server and yield its base URL."""
+    httpd = ThreadedWSGIServer((host, port), _QuietRequestHandler, allow_reuse_address=True)
+    httpd.set_app(WSGIHandler())
+    thread = threading.Thread(target=httpd.serve_forever, name='benchmark-app', daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{httpd.server_address[1]}'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+        connections.close_all()
@@ -0,0 +1,120 @@
+import json
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from benchmarks.fake_inference import FakeInferenceServer
+from benchmarks.load import SCENARIOS, LoadDriver, analysis_result, cleanup, percentile, run_scenario, seed, \
+    serve_app
+from patients.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Drive concurrent API traffic at the app and report throughput and latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+                            help='Scenarios to run, in order (default: all)')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent clients')
+        parser.add_argument('--doctors', type=int, default=10, help='Doctors to seed')
+        parser.add_argument('--patients', type=int, default=50, help='Patients seeded per doctor')
+        parser.add_argument('--echo-size', type=int, default=256 * 1024, help='Bytes per uploaded echo')
+        parser.add_argument('--inference-latency', type=float, default=0.2,
+                            help='Seconds the fake inference server takes per request')
+        parser.add_argument('--inference-jitter', type=float, default=0.05,
+                            help='Standard deviation of the inference latency')
+        parser.add_argument('--inference-error-rate', type=float, default=0.0,
+                            help='Fraction of inference requests answered with a 503')
+        parser.add_argument('--worker-concurrency', type=int, default=None,
+                            help='Analysis worker threads (defaults to ANALYSIS_WORKER_CONCURRENCY)')
+        parser.add_argument('--analysis-timeout', type=float, default=300,
+                            help='Seconds to wait for queued analyses to finish')
+        parser.add_argument('--url', help='Benchmark an already running server at this base URL instead; '
+                                          'it must use the same database. No analysis worker is started.')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the seeded and created rows')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['doctors'] < 1 \
+                or options['patients'] < 1:
+            raise CommandError('--requests, --concurrency, --doctors and --patients must be positive')
+
+        run_id = uuid.uuid4().hex[:8]
+        doctors = seed(run_id, options['doctors'], options['patients'])
+        self.stdout.write(f'Run {run_id}: seeded {len(doctors)} doctor(s) with {options["patients"]} patient(s) each')
+
+        try:
+            with ExitStack() as stack:
+                base_url = options['url'] or self.start_services(stack, options)
+                results = self.run(base_url, run_id, doctors, options)
+        finally:
+            if not options['keep_data']:
+                cleanup(run_id)
+
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'run': run_id, 'options': {key: options[key] for key in (
+                    'requests', 'concurrency', 'doctors', 'patients', 'echo_size', 'inference_latency')},
+                    'results': [result.as_dict() for result in results]}, f, indent=2)
+
+    def start_services(self, stack, options):
+        """Serve the app, a fake inference server and an analysis worker in this process."""
+        fake = stack.enter_context(FakeInferenceServer(
+            latency=options['inference_latency'],
+            jitter=options['inference_jitter'],
+            error_rate=options['inference_error_rate'],
+        ))
+        stack.enter_context(override_settings(
+            INFERENCE_SERVICE={**settings.INFERENCE_SERVICE, 'BACKEND': 'remote', 'URL': fake.url,
+                               'BATCH_URL': fake.batch_url},
+            MEDIA_ROOT=stack.enter_context(tempfile.TemporaryDirectory(prefix='benchmark-media-')),
+        ))
+
+        if 'diagnosis_upload' in options['scenarios']:
+            worker = Worker(concurrency=options['worker_concurrency'], poll_interval=0.1)
+            thread = threading.Thread(target=worker.run, name='benchmark-worker', daemon=True)
+            thread.start()
+            stack.callback(thread.join)
+            stack.callback(worker.stop)
+
+        base_url = stack.enter_context(serve_app())
+        self.stdout.write(f'Serving the app at {base_url}, fake inference at {fake.url}')
+        return base_url
+
+    def run(self, base_url, run_id, doctors, options):
+        driver = LoadDriver(base_url, run_id, doctors, options['echo_size'])
+        driver.warm_up()
+
+        results = []
+        uploads_started = None
+        for name in options['scenarios']:
+            if name == 'diagnosis_upload':
+                uploads_started = time.monotonic()
+            result = run_scenario(name, getattr(driver, name), options['requests'], options['concurrency'])
+            results.append(result)
+            self.stdout.write(f'  {name}: {result.throughput:.1f} req/s, {result.errors} error(s)')
+
+        if uploads_started is not None and not options['url']:
+            self.stdout.write('Waiting for the queued analyses...')
+            results.append(analysis_result(run_id, uploads_started, options['analysis_timeout']))
+        return results
+
+    def report(self, results):
+        header = f'{"scenario":<18}{"requests":>9}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p90 ms":>9}' \
+                 f'{"p99 ms":>9}{"max ms":>9}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            p50, p90, p99 = (percentile(result.latencies, p) * 1000 for p in (50, 90, 99))
+            self.stdout.write(
+                f'{result.name:<18}{result.requests:>9}{result.errors:>8}{result.throughput:>9.1f}'
+                f'{p50:>9.1f}{p90:>9.1f}{p99:>9.1f}{max(result.latencies, default=0) * 1000:>9.1f}'
+            )
@@ -0,0 +1,58 @@
+import json
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.startup import MODULE_GROUPS, profile
+
+
+class Command(BaseCommand):
+    help = 'Report the import time and memory of the app and of each heavy dependency group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', nargs='+', choices=MODULE_GROUPS, default=list(MODULE_GROUPS),
+                            help='Module groups to measure (default: all)')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Fresh interpreters per group; the median time is reported')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+
+        try:
+            results = [self.measure(group, options['repeat']) for group in options['groups']]
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'results': results}, f, indent=2)
+
+        app = next((result for result in results if result['group'] == 'app'), None)
+        if app and app['heavy']:
+            self.stderr.write(self.style.WARNING(
+                f'Serving the app imports {", ".join(app["heavy"])}; import them where they are used instead'))
+
+    def measure(self, group, repeat):
+        runs = [profile(group, settings.SETTINGS_MODULE) for _ in range(repeat)]
+        result = runs[-1]
+        result['seconds'] = statistics.median(run['seconds'] for run in runs)
+        return result
+
+    def report(self, results):
+        header = f'{"group":<16}{"import ms":>10}{"RSS MB":>9}{"modules":>9}  notes'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for result in results:
+            if result['group'] == 'app':
+                notes = f'on a {result["baseline_rss"] / 1024 ** 2:.1f} MB interpreter'
+            else:
+                notes = result['error'] or ', '.join(result['modules'])
+            self.stdout.write(
+                f'{result["group"]:<16}{result["seconds"] * 1000:>10.1f}{result["rss"] / 1024 ** 2:>9.1f}'
+                f'{result["loaded_modules"]:>9}  {notes}'
+            )
+        self.stdout.write('Groups other than app are measured on top of it')
@@ -0,0 +1,92 @@
+"""
+Import cost of the app and of its optional heavy dependencies, for
+``manage.py startup_profile``.
+
+Every group is measured in a fresh interpreter (``python -m
+benchmarks.startup <group>``), so earlier imports do not hide its cost.
+The ``app`` group is what a web worker loads before serving its first
+request: Django setup and the URLconf with every view. The other groups are
+imported on top of it and report what they would add to such a worker.
+
+Only the standard library may be imported at module level here, or it
+would be counted as part of the baseline.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODULE_GROUPS = {
+    'app': [],
+    'inference-http': ['httpx'],
+    'storage-s3': ['boto3'],
+    'video': ['numpy', 'cv2'],
+    'model': ['keras'],
+    'data': ['pandas', 'h5py'],
+}
+
+# Top-level packages a web worker must not load until a request needs them
+HEAVY_MODULES = ['boto3', 'cv2', 'h5py', 'httpx', 'jax', 'keras', 'numpy', 'pandas', 'tensorflow', 'torch']
+
+
+def rss_bytes():
+    """Resident set size of this process; the peak where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_app():
+    import django
+    from django.conf import settings
+    from django.urls import get_resolver
+
+    django.setup()
+    get_resolver(settings.ROOT_URLCONF).url_patterns
+
+
+def measure(group):
+    """Import ``group`` in this process and return its cost."""
+    result = {'group': group, 'modules': MODULE_GROUPS[group], 'error': None}
+    baseline = rss_bytes()
+    start = time.perf_counter()
+    load_app()
+    app_seconds = time.perf_counter() - start
+    app_rss = rss_bytes()
+
+    if group == 'app':
+        result.update(seconds=app_seconds, rss=app_rss - baseline, baseline_rss=baseline)
+    else:
+        start = time.perf_counter()
+        try:
+            for module in MODULE_GROUPS[group]:
+                __import__(module)
+        except ImportError as e:
+            result['error'] = f'not installed ({e.name})'
+        result.update(seconds=time.perf_counter() - start, rss=rss_bytes() - app_rss, baseline_rss=app_rss)
+
+    result['loaded_modules'] = len(sys.modules)
+    result['heavy'] = sorted(module for module in HEAVY_MODULES if module in sys.modules)
+    return result
+
+
+def profile(group, settings_module):
+    """Measure ``group`` in a fresh interpreter."""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', group], env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if completed.returncode:
+        raise RuntimeError(f'Profiling {group} failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    print(json.dumps(measure(sys.argv[1])))
@@ -0,0 +1,154 @@
+"""
+Shared fixtures for checking what endpoints cost.
+
+``query_budget`` asserts an upper bound on SQL queries and wall time, as a
+context manager or a decorator. ``seeded_dataset`` runs a test once per
+dataset size so a list endpoint can be shown to run the same number of
+queries for 10 rows as for 10,000. The 10k dataset is marked ``slow``;
+deselect it locally with ``-m "not slow"``.
+
+Every test starts with empty caches, so cached responses and predictions
+never leak between tests that reuse the same row ids. On SQLite the test
+database is a temporary file rather than in memory and transactions take
+the write lock up front, so that tests serving the app on several threads
+wait for locks instead of failing.
+"""
+import os
+import tempfile
+import time
+from contextlib import ContextDecorator
+from dataclasses import dataclass
+from datetime import date
+
+import pytest
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+DATASET_SIZES = [10, 1_000, pytest.param(10_000, marks=pytest.mark.slow)]
+INTERPRETATIONS_PER_DIAGNOSIS = 3
+SEED_BATCH_SIZE = 2_000
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    from django.conf import settings
+
+    for db_settings in settings.DATABASES.values():
+        if db_settings['ENGINE'] != 'django.db.backends.sqlite3':
+            continue
+        # The shared-cache in-memory database fails concurrent writes with "table is locked"
+        if not db_settings['TEST'].get('NAME'):
+            db_settings['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), f'test_fyp_{os.getpid()}.sqlite3')
+        # A deferred transaction that reads before writing fails at once rather than waiting
+        db_settings.setdefault('OPTIONS', {}).setdefault('transaction_mode', 'IMMEDIATE')
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty caches"""
+    for cache in caches.all():
+        cache.clear()
+    yield
+
+
+class QueryBudget(ContextDecorator):
+    """
+    Fail the test if the wrapped block runs more than ``queries`` SQL
+    queries or takes longer than ``seconds``. The failure lists the queries
+    so an N+1 can be spotted straight from the CI log.
+    """
+
+    def __init__(self, queries, seconds=None, using=DEFAULT_DB_ALIAS):
+        self.queries = queries
+        self.seconds = seconds
+        self.using = using
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+
+        executed = len(self.context.captured_queries)
+        if executed > self.queries:
+            statements = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(self.context.captured_queries, start=1))
+            pytest.fail(f'{executed} queries executed, the budget is {self.queries}:\n{statements}', pytrace=False)
+        if self.seconds is not None and self.elapsed > self.seconds:
+            pytest.fail(f'Took {self.elapsed:.3f}s, the budget is {self.seconds}s', pytrace=False)
+        return False
+
+    @property
+    def executed(self):
+        return len(self.context.captured_queries)
+
+
+@pytest.fixture
+def query_budget():
+    """``QueryBudget``: ``with query_budget(5, seconds=0.5): ...`` or ``@query_budget(5)``"""
+    return QueryBudget
+
+
+@dataclass
+class SeededDataset:
+    size: int
+    client: APIClient
+    profile: object
+    patient: object
+    diagnosis: object
+
+
+@pytest.fixture(params=DATASET_SIZES, ids=lambda size: f'{size}-rows')
+def seeded_dataset(request, db):
+    """
+    A doctor with ``size`` patients, one of whom has ``size`` diagnoses, each
+    with a stored echo, a rendered poster and several interpretation notes.
+    Rows are bulk inserted; no media files are written.
+    """
+    from accounts.admin import User
+    from accounts.models import Profile
+    from patients.models import Diagnosis, EchoBlob, Interpretation, Patient
+
+    size = request.param
+
+    user = User.objects.create_user(email='doctor@test.com', password='testpass123')
+    profile = Profile.objects.create(user=user, full_name='Dr. Test Doctor', phone_number='+1234567890',
+                                     specialization='Cardiology')
+    Patient.objects.bulk_create(
+        [Patient(doctor=profile, full_name=f'Patient {i}', gender='MF'[i % 2], date_of_birth=date(1960, 1, 1))
+         for i in range(size)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    patient = Patient.objects.filter(doctor=profile).order_by('id').first()
+
+    blobs = EchoBlob.objects.bulk_create(
+        [EchoBlob(sha256=f'{i:064x}', file=f'echos/sha256/{i:064x}.avi', size=1024, ref_count=1,
+                  poster=f'previews/{i:064x}_poster.jpg') for i in range(size)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    Diagnosis.objects.bulk_create(
+        [Diagnosis(patient=patient, echo_blob=blob, echocardiogram=blob.file.name, symptoms='Chest pain',
+                   ejection_fraction=55, analysis_status=Diagnosis.ANALYSIS_COMPLETED) for blob in blobs],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    diagnosis_ids = Diagnosis.objects.filter(patient=patient).values_list('id', flat=True)
+    Interpretation.objects.bulk_create(
+        [Interpretation(diagnosis_id=diagnosis_id, note=f'Note {n}', rule_version='2025.1')
+         for diagnosis_id in diagnosis_ids for n in range(INTERPRETATIONS_PER_DIAGNOSIS)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    # A real token, so requests pay for authentication as they do in production
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    return SeededDataset(size=size, client=client, profile=profile, patient=patient,
+                         diagnosis=Diagnosis.objects.filter(patient=patient).latest('id'))
@@ -0,0 +1,171 @@
+"""
+Authenticated media serving.
+
+Replaces ``django.conf.urls.static.static`` for MEDIA_URL. Files are only
+served to doctors allowed to see them, or for a URL signed by
+``fyp_backend.storage``. Single byte ranges are supported so echo players
+can seek without downloading the whole video, and conditional requests
+are answered with 304 using the file's ETag and Last-Modified.
+
+With MEDIA_OFFLOAD set, the view only authorizes the request and tells the
+front proxy (nginx ``X-Accel-Redirect`` or Apache/lighttpd ``X-Sendfile``)
+to send the file, ranges included. With bucket storage it redirects to a
+presigned URL instead.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+from accounts.models import Profile
+from fyp_backend.storage import check_media_signature
+from patients.models import Diagnosis
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+
+
+def can_access_echo(user, name):
+    profile = getattr(user, 'profile', None)
+    if profile is None:
+        return False
+    return Diagnosis.objects.filter(patient__doctor=profile).filter(
+        Q(echocardiogram=name) | Q(echo_blob__poster=name) | Q(echo_blob__preview=name)
+    ).exists()
+
+
+def can_access_profile_picture(user, name):
+    """Own pictures and the shared default avatar; staff may see every picture."""
+    if user.is_staff or name == Profile._meta.get_field('profile_picture').default:
+        return True
+    profile = getattr(user, 'profile', None)
+    return profile is not None and profile.profile_picture.name == name
+
+
+# Media prefixes that may be served, and who may see them. Anything else,
+# e.g. preprocessed tensors, is never served.
+ACCESS_RULES = {
+    'echos/': can_access_echo,
+    'previews/': can_access_echo,
+    'profiles/': can_access_profile_picture,
+}
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` for a single-range ``Range`` header, ``None`` to
+    send the whole file, or raise ``ValueError`` if it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        # Multiple or non-byte ranges: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+class MediaView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, path):
+        rule = next((check for prefix, check in ACCESS_RULES.items() if path.startswith(prefix)), None)
+        if rule is None:
+            raise Http404
+
+        signed = check_media_signature(path, request.GET.get('expires'), request.GET.get('signature'))
+        if not signed:
+            if not request.user.is_authenticated:
+                self.permission_denied(request)
+            if not rule(request.user, path):
+                raise Http404
+
+        if not isinstance(default_storage, FileSystemStorage):
+            # Bucket storage serves ranges itself; hand out a presigned URL
+            return HttpResponseRedirect(default_storage.url(path))
+
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+            stat = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            raise Http404
+        if not os.path.isfile(full_path):
+            raise Http404
+
+        etag = quote_etag(f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+        last_modified = int(stat.st_mtime)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.file_response(request, path, full_path, stat.st_size, etag)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        patch_cache_control(response, private=True, max_age=settings.MEDIA_URL_TTL)
+        return response
+
+    def file_response(self, request, path, full_path, size, etag):
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+        offload = settings.MEDIA_OFFLOAD
+        if offload:
+            response = HttpResponse(content_type=content_type)
+            if offload == 'x-accel-redirect':
+                response['X-Accel-Redirect'] = settings.MEDIA_OFFLOAD_PREFIX.rstrip('/') + '/' + path
+            else:
+                response['X-Sendfile'] = full_path
+            return response
+
+        byte_range = None
+        range_header = request.headers.get('Range')
+        # If-Range: only honour the range if the client's copy is current
+        if range_header and request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+            response['Content-Length'] = size
+            return response
+
+        if byte_range is None:
+            return FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(full_path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
@@ -0,0 +1,140 @@
+"""
+In-process metrics registry.
+
+Metrics are kept per process and labelled by name/value pairs. They are
+cheap enough to update on every request or inference call. ``exposition()``
+renders every registered metric in the Prometheus text format.
+"""
+import math
+import threading
+from bisect import bisect_left
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+# Seconds; suits request and inference latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative ``le`` buckets, with their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, amount)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts, with a final slot for +Inf, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            state[0][index] += 1
+            state[1] += amount
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def sum(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': _number(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+def _register(metric_class, name, *args, **kwargs):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = metric_class(name, *args, **kwargs)
+        return _registry[name]
+
+
+def counter(name, documentation, labelnames=()):
+    """Return the process-wide counter called ``name``, creating it on first use."""
+    return _register(Counter, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Return the process-wide histogram called ``name``, creating it on first use."""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def all_metrics():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def _number(value):
+    return '+Inf' if value == math.inf else repr(value)
+
+
+def _escape(value, quote=True):
+    value = value.replace('\\', r'\\').replace('\n', r'\n')
+    return value.replace('"', r'\"') if quote else value
+
+
+def exposition():
+    """Return all metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda metric: metric.name):
+        lines.append(f'# HELP {metric.name} {_escape(metric.documentation, quote=False)}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{label}="{_escape(str(v))}"' for label, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {_number(value)}' if label_text else f'{name} {_number(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,203 @@
+"""
+Per-request performance instrumentation.
+
+``PerformanceMiddleware`` records, for every request, the latency, number of
+SQL queries and time spent in them, request and response sizes, and time
+spent in inference calls, labelled by the view that handled it. The
+metrics are served by ``metrics_view`` in the Prometheus text format.
+Requests slower than ``PERFORMANCE['SLOW_REQUEST_SECONDS']`` are logged
+with their slowest SQL statements.
+
+Metrics are per process: with several server workers each scrape reports
+the worker that answered it, so scrape every worker or aggregate with
+``sum by``.
+"""
+import heapq
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from fyp_backend import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+request_duration = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce a response', ['view', 'method'])
+requests_total = metrics.counter(
+    'http_requests_total', 'Requests answered', ['view', 'method', 'status'])
+request_queries = metrics.histogram(
+    'http_request_db_queries', 'SQL queries run per request', ['view', 'method'], buckets=QUERY_BUCKETS)
+request_db_duration = metrics.histogram(
+    'http_request_db_duration_seconds', 'Time spent in SQL queries per request', ['view', 'method'])
+request_inference_duration = metrics.histogram(
+    'http_request_inference_duration_seconds', 'Time spent in inference calls per request', ['view', 'method'])
+request_bytes = metrics.histogram(
+    'http_request_size_bytes', 'Request body sizes', ['view', 'method'], buckets=SIZE_BUCKETS)
+response_bytes = metrics.histogram(
+    'http_response_size_bytes', 'Response body sizes, where known', ['view', 'method'], buckets=SIZE_BUCKETS)
+inference_duration = metrics.histogram(
+    'inference_duration_seconds', 'Time spent in inference backend calls', ['operation'])
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self, keep_queries):
+        self.queries = 0
+        self.db_time = 0.0
+        self.inference_time = 0.0
+        self.keep_queries = keep_queries
+        self.statements = []
+
+    def record_query(self, sql, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        if self.keep_queries:
+            self.statements.append((elapsed, sql))
+
+
+def _record_query(execute, sql, params, many, context):
+    # Installed on every connection; async views run their queries on other
+    # threads, which inherit the request's context
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+@contextmanager
+def inference_timer(operation):
+    """Time an inference backend call, counting it towards the current request if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        inference_duration.observe(elapsed, operation=operation)
+        stats = _current.get()
+        if stats is not None:
+            stats.inference_time += elapsed
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    return view_class.__name__ if view_class else match.func.__name__
+
+
+def _body_size(response):
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    if not response.streaming:
+        return len(response.content)
+    return None
+
+
+class PerformanceMiddleware:
+    """Records per-view latency, SQL, size and inference metrics for every request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        stats = RequestStats(keep_queries=bool(settings.PERFORMANCE['SLOW_REQUEST_SECONDS']))
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(keep_queries=bool(settings.PERFORMANCE['SLOW_REQUEST_SECONDS']))
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, stats, duration):
+        config = settings.PERFORMANCE
+
+        labels = {'view': view_name(request), 'method': request.method}
+        request_duration.observe(duration, **labels)
+        requests_total.inc(status=response.status_code, **labels)
+        request_queries.observe(stats.queries, **labels)
+        request_db_duration.observe(stats.db_time, **labels)
+        if stats.inference_time:
+            request_inference_duration.observe(stats.inference_time, **labels)
+        request_bytes.observe(int(request.META.get('CONTENT_LENGTH') or 0), **labels)
+        size = _body_size(response)
+        if size is not None:
+            response_bytes.observe(size, **labels)
+
+        threshold = config['SLOW_REQUEST_SECONDS']
+        if threshold and duration >= threshold:
+            self.log_slow_request(request, labels['view'], response, duration, stats, config['LOGGED_QUERIES'])
+
+    def log_slow_request(self, request, view, response, duration, stats, logged_queries):
+        slowest = heapq.nlargest(logged_queries, stats.statements, key=lambda statement: statement[0])
+        logger.warning(
+            "Slow request %s %s (%s) returned %s in %.0f ms: %s queries in %.0f ms, inference %.0f ms%s",
+            request.method, request.path, view, response.status_code, duration * 1000,
+            stats.queries, stats.db_time * 1000, stats.inference_time * 1000,
+            ''.join(f'\n  {elapsed * 1000:.1f} ms: {sql}' for elapsed, sql in slowest),
+        )
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Requires ``Authorization: Bearer
+    <METRICS_TOKEN>`` when a token is configured, otherwise a staff session.
+    """
+    token = settings.PERFORMANCE['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if token:
+        allowed = constant_time_compare(authorization, f'Bearer {token}')
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
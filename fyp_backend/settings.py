@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 import dj_database_url
 
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     # LOCAL
     'accounts',
     'patients',
+    'benchmarks',
 
     # THIRD PARTY
     'rest_framework',
@@ -53,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times everything below it
+    'fyp_backend.monitoring.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -115,6 +119,43 @@ DATABASES = {
     )
 }
 
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The 'inference' cache stores EF predictions keyed by echo hash, view and
+# demographics. Use django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.db.DatabaseCache (after `manage.py createcachetable`)
+# to share results between processes.
+# The 'responses' cache holds the data of patient and diagnosis GET responses per
+# doctor, see patients.response_cache. Its invalidations only reach processes
+# sharing it, so a per-process LocMemCache would keep serving what the analysis
+# worker has since changed. The default is a directory shared by runserver and
+# `manage.py run_analysis_worker` on one machine; the production settings use
+# DatabaseCache, or set django.core.cache.backends.redis.RedisCache. Responses
+# contain signed media URLs, so keep its TIMEOUT well below MEDIA_URL_TTL and
+# S3_URL_EXPIRY.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'inference': {
+        'BACKEND': os.environ.get('INFERENCE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('INFERENCE_CACHE_LOCATION', 'inference-results'),
+        'TIMEOUT': int(os.environ.get('INFERENCE_CACHE_TIMEOUT', 60 * 60 * 24 * 7)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('INFERENCE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'responses': {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'fyp_backend_responses')),
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 5 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -153,6 +194,146 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is served by fyp_backend.media.MediaView to authorized users or for
+# signed URLs, which stay valid for one to two MEDIA_URL_TTL windows (seconds).
+# MEDIA_STORAGE 'local' keeps media under MEDIA_ROOT; 's3' stores it in the
+# S3_STORAGE bucket (AWS or an S3-compatible service such as MinIO) so that
+# several app nodes can share it.
+MEDIA_STORAGE_BACKENDS = {
+    'local': 'fyp_backend.storage.SignedFileSystemStorage',
+    's3': 'fyp_backend.storage.S3Storage',
+}
+STORAGES = {
+    'default': {'BACKEND': MEDIA_STORAGE_BACKENDS[os.environ.get('MEDIA_STORAGE', 'local')]},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+S3_STORAGE = {
+    'BUCKET': os.environ.get('S3_BUCKET', 'fyp-media'),
+    # Key prefix inside the bucket
+    'LOCATION': os.environ.get('S3_LOCATION', 'media'),
+    'REGION': os.environ.get('S3_REGION'),
+    # e.g. http://minio:9000; None for AWS
+    'ENDPOINT_URL': os.environ.get('S3_ENDPOINT_URL'),
+    'ACCESS_KEY': os.environ.get('S3_ACCESS_KEY_ID'),
+    'SECRET_KEY': os.environ.get('S3_SECRET_ACCESS_KEY'),
+    'ADDRESSING_STYLE': os.environ.get('S3_ADDRESSING_STYLE', 'auto'),
+    # Lifetime of presigned download and upload URLs in seconds
+    'URL_EXPIRY': int(os.environ.get('S3_URL_EXPIRY', 60 * 60)),
+    'MULTIPART_THRESHOLD': int(os.environ.get('S3_MULTIPART_THRESHOLD', 16 * 1024 ** 2)),
+    'MULTIPART_CHUNK_SIZE': int(os.environ.get('S3_MULTIPART_CHUNK_SIZE', 16 * 1024 ** 2)),
+    'MAX_CONCURRENCY': int(os.environ.get('S3_MAX_CONCURRENCY', 4)),
+}
+MEDIA_URL_TTL = int(os.environ.get('MEDIA_URL_TTL', 60 * 60))
+# Let the front proxy send the file: None, 'x-accel-redirect' (nginx) or 'x-sendfile'
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD') or None
+# nginx `internal` location aliased to MEDIA_ROOT, used with x-accel-redirect
+MEDIA_OFFLOAD_PREFIX = os.environ.get('MEDIA_OFFLOAD_PREFIX', '/protected-media/')
+
+# EF inference service
+# BACKEND is 'remote' (HTTP model server at URL) or 'local' (in-process worker pool).
+# Timeouts are in seconds; retries back off exponentially up to BACKOFF_MAX and
+# the circuit breaker opens after CIRCUIT_BREAKER_THRESHOLD consecutive failures.
+
+INFERENCE_SERVICE = {
+    'BACKEND': os.environ.get('INFERENCE_BACKEND', 'remote'),
+    'URL': os.environ.get('INFERENCE_URL', 'https://fe60-124-13-17-173.ngrok-free.app/predict'),
+    # Defaults to URL + '/batch'
+    'BATCH_URL': os.environ.get('INFERENCE_BATCH_URL'),
+    'CONNECT_TIMEOUT': float(os.environ.get('INFERENCE_CONNECT_TIMEOUT', 5)),
+    'READ_TIMEOUT': float(os.environ.get('INFERENCE_READ_TIMEOUT', 120)),
+    'MAX_RETRIES': int(os.environ.get('INFERENCE_MAX_RETRIES', 3)),
+    'BACKOFF_FACTOR': float(os.environ.get('INFERENCE_BACKOFF_FACTOR', 0.5)),
+    'BACKOFF_MAX': float(os.environ.get('INFERENCE_BACKOFF_MAX', 10)),
+    'POOL_SIZE': int(os.environ.get('INFERENCE_POOL_SIZE', 10)),
+    'CIRCUIT_BREAKER_THRESHOLD': int(os.environ.get('INFERENCE_CIRCUIT_BREAKER_THRESHOLD', 5)),
+    'CIRCUIT_BREAKER_RESET_TIMEOUT': float(os.environ.get('INFERENCE_CIRCUIT_BREAKER_RESET_TIMEOUT', 30)),
+    # Async views: connections per event loop, and how long a request awaits
+    # its analysis before leaving it to the job worker
+    'ASYNC_POOL_SIZE': int(os.environ.get('INFERENCE_ASYNC_POOL_SIZE', 100)),
+    'ASYNC_WAIT': float(os.environ.get('INFERENCE_ASYNC_WAIT', 30)),
+    # Part of the result cache key; bump when the deployed model changes
+    'MODEL_VERSION': os.environ.get('INFERENCE_MODEL_VERSION', '1'),
+    # Local backend: keras model file, '{view}' is replaced by a4c/psax
+    'LOCAL_MODEL_PATH': os.environ.get('INFERENCE_LOCAL_MODEL_PATH', os.path.join(BASE_DIR, 'models', 'ef_{view}.keras')),
+    # Defaults to one process per CPU core
+    'LOCAL_WORKERS': int(os.environ.get('INFERENCE_LOCAL_WORKERS', 0)) or None,
+    # Predictions queued or running at once; defaults to twice LOCAL_WORKERS
+    'LOCAL_MAX_PENDING': int(os.environ.get('INFERENCE_LOCAL_MAX_PENDING', 0)) or None,
+    'LOCAL_QUEUE_TIMEOUT': float(os.environ.get('INFERENCE_LOCAL_QUEUE_TIMEOUT', 30)),
+    'LOCAL_FRAMES': int(os.environ.get('INFERENCE_LOCAL_FRAMES', 32)),
+    'LOCAL_FRAME_SIZE': int(os.environ.get('INFERENCE_LOCAL_FRAME_SIZE', 112)),
+}
+
+# Push of finished analyses to the SSE and long-poll diagnosis endpoints.
+# BACKEND 'postgres' uses LISTEN/NOTIFY and sees analyses finished by any
+# process; 'local' only those finished in the same process, e.g. by the async
+# upload view; 'auto' picks postgres on PostgreSQL. Waiters also recheck the
+# database every RECHECK_INTERVAL seconds. Times are in seconds.
+
+ANALYSIS_NOTIFICATIONS = {
+    'BACKEND': os.environ.get('ANALYSIS_NOTIFICATIONS_BACKEND', 'auto'),
+    'RECHECK_INTERVAL': float(os.environ.get('ANALYSIS_NOTIFICATIONS_RECHECK_INTERVAL', 5)),
+    # Longest wait of a long-poll request
+    'LONG_POLL_TIMEOUT': float(os.environ.get('ANALYSIS_LONG_POLL_TIMEOUT', 25)),
+    # An event stream is closed after this long and the client reconnects
+    'STREAM_TIMEOUT': float(os.environ.get('ANALYSIS_STREAM_TIMEOUT', 300)),
+    # Comment lines sent on an idle stream so that proxies keep it open
+    'KEEPALIVE_INTERVAL': float(os.environ.get('ANALYSIS_STREAM_KEEPALIVE_INTERVAL', 15)),
+}
+
+# Per-request metrics, served at /metrics in the Prometheus text format.
+# Requests slower than SLOW_REQUEST_SECONDS (0 disables) are logged with their
+# LOGGED_QUERIES slowest SQL statements. Scrapes need METRICS_TOKEN as a bearer
+# token, or a staff session if it is empty.
+
+PERFORMANCE = {
+    'SLOW_REQUEST_SECONDS': float(os.environ.get('SLOW_REQUEST_SECONDS', 1)),
+    'LOGGED_QUERIES': int(os.environ.get('SLOW_REQUEST_LOGGED_QUERIES', 10)),
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+
+# Resumable echo uploads
+# Chunks are written to UPLOAD_SESSION_ROOT, which must not be served publicly.
+
+UPLOAD_SESSION_ROOT = os.environ.get('UPLOAD_SESSION_ROOT', os.path.join(BASE_DIR, 'upload_sessions'))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 2 * 1024 ** 3))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get('UPLOAD_CHUNK_MAX_SIZE', 32 * 1024 ** 2))
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 60 * 60 * 24))
+# Content types accepted for echoes uploaded directly to object storage
+ECHO_CONTENT_TYPES = ['video/x-msvideo', 'video/avi', 'video/mp4', 'video/quicktime', 'application/dicom']
+# Echoes posted to the diagnosis endpoint are streamed here while being hashed.
+# Keep it on the same filesystem as MEDIA_ROOT so storing an upload is a rename.
+ECHO_UPLOAD_TEMP_DIR = os.environ.get('ECHO_UPLOAD_TEMP_DIR', os.path.join(UPLOAD_SESSION_ROOT, 'incoming'))
+
+# Poster frames and preview clips rendered by the job worker for list screens.
+# CLIP_CODEC is an OpenCV fourcc; it must be supported by the OpenCV build.
+
+ECHO_PREVIEW = {
+    'POSTER_WIDTH': int(os.environ.get('ECHO_POSTER_WIDTH', 320)),
+    'POSTER_QUALITY': int(os.environ.get('ECHO_POSTER_QUALITY', 80)),
+    'CLIP_WIDTH': int(os.environ.get('ECHO_PREVIEW_WIDTH', 160)),
+    'CLIP_SECONDS': float(os.environ.get('ECHO_PREVIEW_SECONDS', 3)),
+    'CLIP_FPS': float(os.environ.get('ECHO_PREVIEW_FPS', 10)),
+    'CLIP_CODEC': os.environ.get('ECHO_PREVIEW_CODEC', 'mp4v'),
+    'CLIP_EXTENSION': os.environ.get('ECHO_PREVIEW_EXTENSION', '.mp4'),
+}
+
+# Echocardiogram analysis job queue
+# Jobs are stored in the database and processed by `manage.py run_analysis_worker`.
+
+ANALYSIS_WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', 2))
+# Jobs claimed per round-trip; values above 1 use the batch inference endpoint
+ANALYSIS_BATCH_SIZE = int(os.environ.get('ANALYSIS_BATCH_SIZE', 1))
+ANALYSIS_POLL_INTERVAL = float(os.environ.get('ANALYSIS_POLL_INTERVAL', 2))
+ANALYSIS_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', 3))
+ANALYSIS_RETRY_DELAY = int(os.environ.get('ANALYSIS_RETRY_DELAY', 30))
+ANALYSIS_JOB_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_TIMEOUT', 600))
+
+# EF interpretation rules, see patients.interpretation.RULESETS
+# After changing this, run `manage.py reinterpret_diagnoses` to update history.
+
+INTERPRETATION_RULESET = os.environ.get('INTERPRETATION_RULESET', '2025.1')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,64 @@
+"""
+Production settings: the development settings with debugging off.
+
+With DEBUG off Django no longer keeps every SQL query of a request in
+memory, error pages no longer leak settings, and the SQL log is quiet.
+Selected by DJANGO_SETTINGS_MODULE=fyp_backend.settings_production, which
+``gunicorn.conf.py`` and the Docker image set.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from fyp_backend.settings import *  # noqa: F401,F403
+from fyp_backend.settings import ALLOWED_HOSTS, CACHES, MIDDLEWARE, STORAGES
+
+DEBUG = False
+
+# Signs sessions and JWTs; the development key is public, so never fall back to it
+if not os.environ.get('DJANGO_SECRET_KEY'):
+    raise ImproperlyConfigured('Set DJANGO_SECRET_KEY for the production settings')
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+# Comma-separated, replaces the development list when set
+ALLOWED_HOSTS = [host.strip() for host in os.environ['ALLOWED_HOSTS'].split(',')] \
+    if os.environ.get('ALLOWED_HOSTS') else ALLOWED_HOSTS
+
+# Invalidations of the response cache come from every web worker and the
+# analysis worker, so they must share it. Defaults to the database, whose
+# table `manage.py migrate` creates; after changing RESPONSE_CACHE_LOCATION run
+# `manage.py createcachetable`. RedisCache is faster.
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache')
+if RESPONSE_CACHE_BACKEND == 'django.core.cache.backends.locmem.LocMemCache':
+    raise ImproperlyConfigured('RESPONSE_CACHE_BACKEND must be shared between processes in production')
+CACHES = {**CACHES, 'responses': {
+    **CACHES['responses'],
+    'BACKEND': RESPONSE_CACHE_BACKEND,
+    'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'response_cache'),
+}}
+
+# The admin and browsable API assets: `manage.py collectstatic` (run when the
+# image is built) copies them to STATIC_ROOT under content-hashed names, which
+# WhiteNoise serves from the workers, compressed and cached for a year.
+MIDDLEWARE = [*MIDDLEWARE]
+MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                  'whitenoise.middleware.WhiteNoiseMiddleware')
+STORAGES = {**STORAGES, 'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}}
+
+# Behind the platform's TLS-terminating proxy
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {'format': '%(asctime)s %(levelname)s %(name)s [%(process)d] %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'default'},
+    },
+    'root': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+    'loggers': {
+        # Statements are only logged with DEBUG on; keep it that way if the level is lowered
+        'django.db.backends': {'level': 'WARNING', 'propagate': True},
+    },
+}
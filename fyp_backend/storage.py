@@ -0,0 +1,307 @@
+"""
+Media storage.
+
+Media lives either on the local filesystem (``SignedFileSystemStorage``) or
+in an S3-compatible bucket (``S3Storage``), chosen by MEDIA_STORAGE. Code
+should only use the storage API; ``local_copy`` gives tools that need a
+real file a local path with either backend.
+
+Local media is not public: files are served by ``fyp_backend.media.MediaView``,
+which accepts either an authenticated request or a URL signed by the
+storage. Signed URLs let ``<video>`` and ``<img>`` tags, which cannot send
+an Authorization header, load echoes and previews. Bucket media is served
+by S3 through presigned URLs.
+"""
+import base64
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.core.signing import Signer
+from django.utils.crypto import constant_time_compare
+from django.utils.deconstruct import deconstructible
+from django.utils.http import urlencode
+
+COPY_BLOCK_SIZE = 64 * 1024
+
+signer = Signer(salt='fyp_backend.media')
+
+
+def media_signature(name, expires):
+    return signer.signature(f'{name}:{expires}')
+
+
+def sign_media_url(name, url):
+    """
+    Append an expiry and signature to ``url``.
+
+    The expiry is rounded up to a whole MEDIA_URL_TTL window so that a file
+    keeps the same URL, and stays in the browser cache, for the whole window.
+    """
+    ttl = settings.MEDIA_URL_TTL
+    expires = (int(time.time()) // ttl + 2) * ttl
+    separator = '&' if '?' in url else '?'
+    return f'{url}{separator}{urlencode({"expires": expires, "signature": media_signature(name, expires)})}'
+
+
+def check_media_signature(name, expires, signature):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return constant_time_compare(signature or '', media_signature(name, expires))
+
+
+class SignedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage whose URLs carry an expiring signature for MediaView."""
+
+    def url(self, name):
+        return sign_media_url(name, super().url(name))
+
+    def move(self, name, new_name):
+        """Rename ``name`` to ``new_name``, replacing any file already there."""
+        new_path = self.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(self.path(name), new_path)
+        return new_name
+
+
+@contextmanager
+def local_copy(name, storage=None):
+    """
+    Yield a local filesystem path holding the stored file ``name``, for tools
+    such as OpenCV that need a real file. Local storage yields the file in
+    place; remote storage downloads it to a temporary file that is removed
+    afterwards.
+    """
+    storage = storage or default_storage
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    temp_dir = settings.ECHO_UPLOAD_TEMP_DIR
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1], dir=temp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as temp, storage.open(name, 'rb') as stored:
+            shutil.copyfileobj(stored, temp, COPY_BLOCK_SIZE)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _is_missing(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Storage on S3 or an S3-compatible service such as MinIO, configured by
+    the S3_STORAGE setting. Lets several app nodes share media without a
+    shared filesystem.
+
+    Large files are uploaded in parallel multipart chunks. ``url()`` returns
+    presigned download URLs, and ``presigned_upload()`` lets clients upload
+    directly to the bucket. boto3 is imported on first use.
+    """
+
+    def __init__(self, **options):
+        self.options = {**settings.S3_STORAGE, **options}
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        return self.options['BUCKET']
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    self._client = boto3.client(
+                        's3',
+                        region_name=self.options['REGION'],
+                        endpoint_url=self.options['ENDPOINT_URL'],
+                        aws_access_key_id=self.options['ACCESS_KEY'],
+                        aws_secret_access_key=self.options['SECRET_KEY'],
+                        config=Config(
+                            signature_version='s3v4',
+                            max_pool_connections=self.options['MAX_CONCURRENCY'] * 2,
+                            s3={'addressing_style': self.options['ADDRESSING_STYLE']},
+                        ),
+                    )
+        return self._client
+
+    def key(self, name):
+        location = self.options['LOCATION'].strip('/')
+        return f'{location}/{name}' if location else name
+
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.options['MULTIPART_THRESHOLD'],
+            multipart_chunksize=self.options['MULTIPART_CHUNK_SIZE'],
+            max_concurrency=self.options['MAX_CONCURRENCY'],
+        )
+
+    def _save(self, name, content):
+        content.seek(0)
+        content_type = getattr(content, 'content_type', None) or mimetypes.guess_type(name)[0]
+        extra = {'ContentType': content_type} if content_type else {}
+        self.client.upload_fileobj(content, self.bucket, self.key(name), ExtraArgs=extra,
+                                   Config=self._transfer_config())
+        return name
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError("S3Storage files can only be opened for reading")
+        # Spill anything but small files to disk
+        from botocore.exceptions import ClientError
+
+        temp = tempfile.SpooledTemporaryFile(max_size=COPY_BLOCK_SIZE * 16)
+        try:
+            self.client.download_fileobj(self.bucket, self.key(name), temp, Config=self._transfer_config())
+        except ClientError as e:
+            temp.close()
+            if _is_missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+        temp.seek(0)
+        return File(temp, name=name)
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def delete(self, name):
+        if name:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def url(self, name, expires=None):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name)},
+            ExpiresIn=expires or self.options['URL_EXPIRY'],
+        )
+
+    def presigned_upload(self, name, content_type, max_size, expires=None):
+        """
+        Return ``{'url': ..., 'fields': {...}}`` for a browser form POST of
+        at most ``max_size`` bytes straight to ``name`` in the bucket.
+        """
+        return self.client.generate_presigned_post(
+            self.bucket,
+            self.key(name),
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+            ExpiresIn=expires or self.options['URL_EXPIRY'],
+        )
+
+    def presigned_put(self, name, content_type, size, sha256, expires=None):
+        """
+        Return ``{'method', 'url', 'headers'}`` for a client to PUT exactly
+        ``size`` bytes to ``name``. S3 rejects the upload unless the body
+        matches ``sha256``, so the hash is verified without the bytes ever
+        passing through the app.
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name), 'ContentType': content_type,
+                    'ContentLength': size, 'ChecksumSHA256': checksum},
+            ExpiresIn=expires or self.options['URL_EXPIRY'],
+        )
+        return {
+            'method': 'PUT',
+            'url': url,
+            'headers': {'Content-Type': content_type, 'x-amz-checksum-sha256': checksum},
+        }
+
+    def stat(self, name):
+        """Return the size, content type and SHA-256 (hex, if recorded) of ``name``, or ``None``."""
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(name), ChecksumMode='ENABLED')
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+        checksum = head.get('ChecksumSHA256')
+        return {
+            'size': head['ContentLength'],
+            'content_type': head.get('ContentType', ''),
+            # Multipart objects carry a checksum of part checksums, suffixed with -<parts>
+            'sha256': base64.b64decode(checksum).hex() if checksum and '-' not in checksum else None,
+        }
+
+    def move(self, name, new_name):
+        """Move ``name`` to ``new_name`` with a server-side copy."""
+        self.client.copy({'Bucket': self.bucket, 'Key': self.key(name)}, self.bucket, self.key(new_name),
+                         Config=self._transfer_config())
+        self.delete(name)
+        return new_name
+
+    def start_multipart_upload(self, name, content_type):
+        """Start a client-side multipart upload and return its upload id."""
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key(name), ContentType=content_type)
+        return response['UploadId']
+
+    def presigned_part_url(self, name, upload_id, part_number, expires=None):
+        return self.client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': self.bucket, 'Key': self.key(name), 'UploadId': upload_id,
+                    'PartNumber': part_number},
+            ExpiresIn=expires or self.options['URL_EXPIRY'],
+        )
+
+    def complete_multipart_upload(self, name, upload_id, parts):
+        """``parts`` is a list of ``(part_number, etag)`` returned by the part uploads."""
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key(name), UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in parts]},
+        )
+
+    def abort_multipart_upload(self, name, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key(name), UploadId=upload_id)
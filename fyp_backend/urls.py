@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from accounts.views import SignUpView, CustomTokenObtainPairView, ProfileUpdateView, ChangePasswordView
-from fyp_backend import settings
-from patients.views import PatientListCreateView, PatientDetailView, DiagnosisListCreateView, DiagnosisDetailView
+from fyp_backend.media import MediaView
+from fyp_backend.monitoring import metrics_view
+from patients.async_views import AsyncDiagnosisCreateView, AsyncDiagnosisDetailView, DiagnosisEventsView, \
+    DiagnosisWaitView
+from patients.views import PatientListCreateView, PatientDetailView, DiagnosisListCreateView, DiagnosisDetailView, \
+    UploadSessionCreateView, UploadSessionDetailView, UploadSessionFinalizeView, DirectUploadCreateView
 
 router = DefaultRouter()
 
@@ -24,10 +29,29 @@ api_urlpatterns = [
     path('patients/<int:pk>/', PatientDetailView.as_view(), name='patient-detail'),
     path('patients/<int:patient_id>/diagnoses/', DiagnosisListCreateView.as_view(), name='diagnosis-list-create'),
     path('patients/<int:patient_id>/diagnoses/<int:pk>/', DiagnosisDetailView.as_view(), name='diagnosis-detail'),
+    # Notification of the finished analysis, instead of polling the detail view
+    path('patients/<int:patient_id>/diagnoses/<int:pk>/wait/', DiagnosisWaitView.as_view(), name='diagnosis-wait'),
+    path('patients/<int:patient_id>/diagnoses/<int:pk>/events/', DiagnosisEventsView.as_view(),
+         name='diagnosis-events'),
+
+    # Resumable echo uploads
+    path('patients/<int:patient_id>/uploads/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-session-detail'),
+    path('uploads/<uuid:pk>/finalize/', UploadSessionFinalizeView.as_view(), name='upload-session-finalize'),
+    # Direct-to-storage uploads, finalized with the view above
+    path('patients/<int:patient_id>/direct-uploads/', DirectUploadCreateView.as_view(), name='direct-upload-create'),
+
+    # Async variants that await the analysis, for ASGI deployments
+    path('async/patients/<int:patient_id>/diagnoses/', AsyncDiagnosisCreateView.as_view(),
+         name='async-diagnosis-create'),
+    path('async/patients/<int:patient_id>/diagnoses/<int:pk>/', AsyncDiagnosisDetailView.as_view(),
+         name='async-diagnosis-detail'),
 ]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('api/', include((api_urlpatterns, 'api'))),  # Include API URLs under /api/ prefix
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), MediaView.as_view(), name='media'),
+] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+Production server config, loaded by ``gunicorn`` from the working directory.
+
+SERVER_INTERFACE picks the worker model:
+
+``wsgi`` (default)
+    ``gthread`` workers, each running GUNICORN_THREADS request threads. The
+    API is mostly sync views, which this serves best. The analysis long-poll
+    and event stream answer at once here instead of holding a thread, so
+    their clients poll every RECHECK_INTERVAL.
+``asgi``
+    uvicorn workers serving ``fyp_backend.asgi``. The async endpoints
+    (``/api/async/...``) hold no thread while awaiting inference, and the
+    long-poll and event stream push finished analyses. Django runs each
+    sync view on a new thread, so database connections are not reused
+    between requests.
+
+The app is imported once in the master and forked (``preload_app``), so
+workers share its memory pages and start instantly. Each worker is replaced
+after about MAX_REQUESTS requests to bound memory growth. ``kill -HUP`` on
+the master gracefully replaces all workers and rereads this file, but
+workers are forked from the preloaded app, so new code needs a restart.
+Metrics at /metrics are per worker.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fyp_backend.settings_production')
+
+interface = os.environ.get('SERVER_INTERFACE', 'wsgi')
+cpus = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+if interface == 'asgi':
+    wsgi_app = 'fyp_backend.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    default_workers = cpus * 2
+else:
+    wsgi_app = 'fyp_backend.wsgi:application'
+    worker_class = 'gthread'
+    default_workers = cpus * 2 + 1
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# WEB_CONCURRENCY is also what most PaaS hosts set from the container size
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+preload_app = True
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+# Spread out the restarts so that workers do not recycle all at once
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+# Uploads of large echoes can take a while; inference runs in the job worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+# Heartbeat files on tmpfs instead of a possibly slow container filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading belong to the master; never share them
+    from django.db import connections
+
+    connections.close_all()
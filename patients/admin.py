@@ -2,7 +2,7 @@ from django.contrib import admin
 
 from patients.models import *
 
-models = [Patient, Diagnosis]
+models = [Patient, Diagnosis, AnalysisJob, EchoBlob]
 
 for model in models:
     admin.site.register(model)
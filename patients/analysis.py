@@ -0,0 +1,188 @@
+import hashlib
+import json
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from fyp_backend import metrics
+from fyp_backend.monitoring import inference_timer
+from patients.inference import get_async_client, get_client
+from patients.interpretation import get_ruleset
+from patients.models import Diagnosis, Interpretation
+from patients.notifications import notify_analysis_finished
+from patients.response_cache import bump_diagnoses
+
+cache_requests = metrics.counter(
+    'inference_cache_requests_total', 'EF prediction cache lookups', ['result'])
+
+
+def complete_analysis(diagnoses):
+    """
+    Persist the predicted EFs of ``diagnoses`` together with their
+    interpretations in one transaction: a single UPDATE for the diagnosis rows,
+    a single DELETE for the notes of an earlier analysis and a single INSERT
+    for all new notes. Requests waiting for the diagnoses are notified on
+    commit.
+    """
+    if not diagnoses:
+        return
+
+    for diagnosis in diagnoses:
+        diagnosis.analysis_status = Diagnosis.ANALYSIS_COMPLETED
+
+    with transaction.atomic(savepoint=False):
+        if len(diagnoses) == 1:
+            Diagnosis.objects.filter(id=diagnoses[0].id).update(
+                ejection_fraction=diagnoses[0].ejection_fraction,
+                analysis_status=Diagnosis.ANALYSIS_COMPLETED,
+            )
+        else:
+            Diagnosis.objects.bulk_update(diagnoses, ['ejection_fraction', 'analysis_status'])
+        # Re-analysis replaces the notes rather than adding to them
+        Interpretation.objects.filter(diagnosis_id__in=[diagnosis.id for diagnosis in diagnoses]).delete()
+        Interpretation.objects.bulk_create(get_ruleset().interpret(diagnoses))
+        bump_diagnoses(diagnoses)
+        notify_analysis_finished([diagnosis.id for diagnosis in diagnoses])
+
+
+def get_demographics(patient):
+    return {
+        'age': patient.get_age(),
+        'gender': patient.gender,
+        'weight': patient.weight if patient.weight else 70,
+        'height': patient.height if patient.height else 180,
+    }
+
+
+def result_cache_key(diagnosis):
+    """Key identifying a prediction by echo content, view, demographics and model."""
+    if not diagnosis.echo_blob_id:
+        return None
+    payload = json.dumps([
+        diagnosis.echo_blob.sha256,
+        diagnosis.view_type,
+        get_demographics(diagnosis.patient),
+        settings.INFERENCE_SERVICE['MODEL_VERSION'],
+    ], sort_keys=True)
+    return 'ef:' + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_cached_predictions(diagnoses):
+    """Return ``{diagnosis_id: ef}`` for diagnoses with a cached prediction."""
+    keys = {diagnosis.id: result_cache_key(diagnosis) for diagnosis in diagnoses}
+    cached = caches['inference'].get_many([key for key in keys.values() if key])
+
+    predictions = {}
+    for diagnosis_id, key in keys.items():
+        if key in cached:
+            predictions[diagnosis_id] = cached[key]
+            cache_requests.inc(result='hit')
+        else:
+            cache_requests.inc(result='miss')
+    return predictions
+
+
+def cache_predictions(diagnoses):
+    caches['inference'].set_many({
+        key: diagnosis.ejection_fraction
+        for diagnosis in diagnoses
+        if (key := result_cache_key(diagnosis))
+    })
+
+
+def apply_cached_prediction(diagnosis):
+    """Set the EF from the result cache if possible. Returns whether it was a hit."""
+    ef = get_cached_predictions([diagnosis]).get(diagnosis.id)
+    if ef is None:
+        return False
+    diagnosis.ejection_fraction = ef
+    return True
+
+
+def open_echo(diagnosis, client):
+    """
+    Open the input for ``client``: the preprocessed tensor when the backend
+    takes tensors of its shape, otherwise the echo video.
+    """
+    if diagnosis.echo_tensor_id and getattr(client, 'accepts_tensors', False):
+        tensor = diagnosis.echo_tensor
+        if (tensor.frames, tensor.frame_size) == (client.frames, client.frame_size):
+            return tensor.file.open('rb')
+    return diagnosis.echocardiogram.open('rb')
+
+
+def analyze_echo(diagnosis):
+    """Set ``diagnosis.ejection_fraction`` from the cache or the model; nothing is saved."""
+    if apply_cached_prediction(diagnosis):
+        return
+
+    client = get_client()
+    with open_echo(diagnosis, client) as video, inference_timer('predict'):
+        diagnosis.ejection_fraction = client.predict(
+            video, diagnosis.view_type, get_demographics(diagnosis.patient)
+        )
+    cache_predictions([diagnosis])
+
+
+async def analyze_echo_async(diagnosis):
+    """
+    ``analyze_echo`` for async views: the prediction is awaited on the async
+    inference client instead of blocking a thread. ``diagnosis.patient``
+    must already be loaded.
+    """
+    if await sync_to_async(apply_cached_prediction)(diagnosis):
+        return
+
+    client = get_async_client()
+    video = await sync_to_async(open_echo)(diagnosis, client)
+    try:
+        with inference_timer('predict'):
+            diagnosis.ejection_fraction = await client.predict(
+                video, diagnosis.view_type, get_demographics(diagnosis.patient)
+            )
+    finally:
+        video.close()
+    await sync_to_async(cache_predictions)([diagnosis])
+
+
+def analyze_batch(diagnoses):
+    """
+    Analyze several diagnoses with a single inference round-trip.
+
+    Cached predictions are reused and only the remaining echoes are sent to
+    the model. EFs are set on the instances but not saved. Returns a dict
+    mapping the id of every diagnosis the service rejected to its error.
+    """
+    cached = get_cached_predictions(diagnoses)
+    for diagnosis in diagnoses:
+        if diagnosis.id in cached:
+            diagnosis.ejection_fraction = cached[diagnosis.id]
+    uncached = [diagnosis for diagnosis in diagnoses if diagnosis.id not in cached]
+
+    results = []
+    if uncached:
+        client = get_client()
+        with ExitStack() as stack:
+            items = [
+                (stack.enter_context(open_echo(diagnosis, client)),
+                 diagnosis.view_type,
+                 get_demographics(diagnosis.patient))
+                for diagnosis in uncached
+            ]
+            with inference_timer('predict_batch'):
+                results = client.predict_batch(items)
+
+    predicted = []
+    errors = {}
+    for diagnosis, result in zip(uncached, results):
+        if isinstance(result, Exception):
+            errors[diagnosis.id] = result
+        else:
+            diagnosis.ejection_fraction = result
+            predicted.append(diagnosis)
+
+    cache_predictions(predicted)
+    return errors
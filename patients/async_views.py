@@ -0,0 +1,235 @@
+"""
+Async variants of the diagnosis endpoints, for ASGI deployments.
+
+Served by an ASGI server, these views hold no thread while the inference
+service works, so one process can await hundreds of analyses at once where
+the sync views are limited to the server's thread count. Database and
+storage work still runs on Django's sync threads. Under WSGI they work as
+well, each request getting its own event loop.
+"""
+import asyncio
+import os
+import socket
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from patients.jobs import claim_job, enqueue_analysis, enqueue_previews, run_job_async
+from patients.models import Diagnosis, Patient
+from patients.notifications import FINISHED, wait_for_analysis
+from patients.serializers import DiagnosisSerializer
+from patients.uploadhandlers import HashingFileUploadHandler
+
+ASYNC_WORKER_ID = f'{socket.gethostname()}:{os.getpid()}:async'
+
+
+class AsyncAPIView(View):
+    """
+    A minimal async counterpart of DRF's ``APIView``. Requests are
+    authenticated with the DRF authenticators, handlers get a DRF ``Request``
+    with the doctor's ``profile`` loaded, and API exceptions become JSON
+    error responses.
+    """
+    parser_classes = []
+    hash_uploads = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Like APIView: CSRF is left to SessionAuthentication, token requests carry no cookie
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return HttpResponseNotAllowed(self._allowed_methods())
+
+        try:
+            request = await sync_to_async(self.initialize_request)(request)
+            return await handler(request, *args, **kwargs)
+        except Http404:
+            return self.handle_exception(request, exceptions.NotFound())
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def initialize_request(self, request):
+        if self.hash_uploads:
+            # Must be set before the body is parsed
+            request.upload_handlers = [HashingFileUploadHandler(request)]
+        request = Request(
+            request,
+            parsers=[parser() for parser in self.parser_classes],
+            authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        request.profile = request.user.profile
+        return request
+
+    def handle_exception(self, request, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = self.render(data, exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            authenticator = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+            response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            response.status_code = status.HTTP_401_UNAUTHORIZED
+        return response
+
+    def render(self, data, status_code):
+        return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+    def serialize(self, request, diagnosis):
+        return DiagnosisSerializer(diagnosis, context={'request': request}).data
+
+    def served_by_asgi(self, request):
+        """Whether the request came from an ASGI server, rather than a WSGI one running this view on a thread."""
+        return isinstance(request._request, ASGIRequest)
+
+
+class AsyncDiagnosisCreateView(AsyncAPIView):
+    """
+    POST takes the same multipart body as ``DiagnosisListCreateView`` but
+    awaits the analysis instead of only queuing it. It answers 201 with the
+    EF once the analysis is done, or 202 with the diagnosis still pending if
+    the inference service fails or takes longer than
+    INFERENCE_SERVICE['ASYNC_WAIT']; the job worker then finishes it.
+    """
+    parser_classes = [MultiPartParser, FormParser]
+    hash_uploads = True
+
+    async def post(self, request, patient_id):
+        diagnosis, job = await sync_to_async(self.create)(request, patient_id)
+        if job is not None:
+            await run_job_async(job, settings.INFERENCE_SERVICE['ASYNC_WAIT'])
+
+        data = await sync_to_async(self.serialize)(request, diagnosis)
+        completed = data['analysis_status'] == Diagnosis.ANALYSIS_COMPLETED
+        return self.render(data, status.HTTP_201_CREATED if completed else status.HTTP_202_ACCEPTED)
+
+    def create(self, request, patient_id):
+        """Save the diagnosis and claim its analysis job for this request. Returns both."""
+        patient = get_object_or_404(Patient, id=patient_id, doctor=request.profile)
+        serializer = DiagnosisSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            diagnosis = serializer.save(patient=patient)
+            job = enqueue_analysis(diagnosis)
+            enqueue_previews(diagnosis)
+            # Claimed in the same transaction, so the worker only sees it if this request gives it back
+            if job is None or not claim_job(job, ASYNC_WORKER_ID):
+                return diagnosis, None
+            diagnosis.analysis_status = Diagnosis.ANALYSIS_PROCESSING
+            diagnosis.save(update_fields=['analysis_status'])
+        job.diagnosis = diagnosis
+        return diagnosis, job
+
+    def serialize(self, request, diagnosis):
+        # Failures and timeouts are recorded in the database only
+        diagnosis.refresh_from_db(fields=['analysis_status'])
+        return super().serialize(request, diagnosis)
+
+
+class AsyncDiagnosisDetailView(AsyncAPIView):
+    """GET works like ``DiagnosisDetailView``, reading through the async ORM."""
+
+    async def get(self, request, patient_id, pk):
+        diagnosis = await self.get_diagnosis(request, patient_id, pk)
+        return self.render(await sync_to_async(self.serialize)(request, diagnosis), status.HTTP_200_OK)
+
+    async def get_diagnosis(self, request, patient_id, pk):
+        try:
+            return await Diagnosis.objects.select_related('echo_blob').prefetch_related(
+                'interpretations').aget(pk=pk, patient_id=patient_id, patient__doctor=request.profile)
+        except Diagnosis.DoesNotExist:
+            raise exceptions.NotFound()
+
+
+class DiagnosisWaitView(AsyncDiagnosisDetailView):
+    """
+    Long-poll for the analysis. GET answers like the detail view as soon as
+    the analysis has completed or failed, or after ``?timeout=`` seconds
+    (at most, and by default, ANALYSIS_NOTIFICATIONS['LONG_POLL_TIMEOUT'])
+    with it still pending.
+
+    Under WSGI a waiting request would hold one of the server's few request
+    threads, so it answers at once instead, with ``Retry-After`` set to
+    RECHECK_INTERVAL while the analysis is pending.
+    """
+
+    async def get(self, request, patient_id, pk):
+        diagnosis = await self.get_diagnosis(request, patient_id, pk)
+        timeout = self.get_timeout(request)
+        if diagnosis.analysis_status not in FINISHED and timeout:
+            if await wait_for_analysis(diagnosis.id, timeout) in FINISHED:
+                diagnosis = await self.get_diagnosis(request, patient_id, pk)
+
+        response = self.render(await sync_to_async(self.serialize)(request, diagnosis), status.HTTP_200_OK)
+        if diagnosis.analysis_status not in FINISHED and not self.served_by_asgi(request):
+            response['Retry-After'] = int(settings.ANALYSIS_NOTIFICATIONS['RECHECK_INTERVAL'])
+        return response
+
+    def get_timeout(self, request):
+        limit = settings.ANALYSIS_NOTIFICATIONS['LONG_POLL_TIMEOUT']
+        try:
+            timeout = float(request.query_params.get('timeout', limit))
+        except ValueError:
+            raise exceptions.ValidationError({'timeout': 'A number of seconds is required.'})
+        if not self.served_by_asgi(request):
+            return 0
+        return min(max(timeout, 0), limit)
+
+
+class DiagnosisEventsView(AsyncDiagnosisDetailView):
+    """
+    Server-sent events for the analysis. The stream sends one ``analysis``
+    event with the diagnosis, as the detail view returns it, when the
+    analysis completes or fails, and then ends. Idle streams get a comment
+    line every KEEPALIVE_INTERVAL seconds and are closed after
+    STREAM_TIMEOUT, after which ``EventSource`` reconnects.
+
+    Under WSGI the stream would hold a request thread and be buffered until
+    it ends, so it ends at once if the analysis is pending and
+    ``EventSource`` polls by reconnecting every RECHECK_INTERVAL.
+    """
+
+    async def get(self, request, patient_id, pk):
+        diagnosis = await self.get_diagnosis(request, patient_id, pk)
+        stream_timeout = settings.ANALYSIS_NOTIFICATIONS['STREAM_TIMEOUT'] if self.served_by_asgi(request) else 0
+        response = StreamingHttpResponse(self.events(request, diagnosis, stream_timeout),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def events(self, request, diagnosis, stream_timeout):
+        config = settings.ANALYSIS_NOTIFICATIONS
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + stream_timeout
+        yield f'retry: {int(config["RECHECK_INTERVAL"] * 1000)}\n\n'
+
+        analysis_status = diagnosis.analysis_status
+        while analysis_status not in FINISHED:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            analysis_status = await wait_for_analysis(diagnosis.id, min(remaining, config['KEEPALIVE_INTERVAL']))
+            if analysis_status is None:
+                return
+            if analysis_status not in FINISHED:
+                yield ': keepalive\n\n'
+
+        diagnosis = await self.get_diagnosis(request, diagnosis.patient_id, diagnosis.id)
+        data = JSONRenderer().render(await sync_to_async(self.serialize)(request, diagnosis)).decode()
+        yield f'event: analysis\nid: {diagnosis.id}\ndata: {data}\n\n'
@@ -0,0 +1,522 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+
+class InferenceError(Exception):
+    pass
+
+
+class InferenceUnavailable(InferenceError):
+    """Raised when the model server cannot be reached or the circuit is open."""
+
+
+class MultipartBody:
+    """
+    A ``multipart/form-data`` request body that is read lazily.
+
+    requests would otherwise read every file into memory to encode the body;
+    this streams the videos from storage in small blocks instead.
+    """
+
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._parts = []
+
+        for name, value in fields:
+            self._add(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+            self._add(str(value).encode() + b'\r\n')
+        for name, (filename, fileobj) in files:
+            fileobj.seek(0)
+            self._add((
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'
+            ).encode())
+            self._parts.append((fileobj, _file_size(fileobj)))
+            self._add(b'\r\n')
+        self._add(f'--{self.boundary}--\r\n'.encode())
+
+        self._length = sum(size for _, size in self._parts)
+        self._index = 0
+        self._remaining = self._parts[0][1]
+
+    def _add(self, data):
+        self._parts.append((data, len(data)))
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part, part_size = self._parts[self._index]
+            if self._remaining:
+                count = min(size, self._remaining)
+                if isinstance(part, bytes):
+                    start = part_size - self._remaining
+                    data = part[start:start + count]
+                else:
+                    data = part.read(count)
+                    if not data:
+                        raise InferenceError("Echo file ended before its reported size")
+                chunks.append(data)
+                size -= len(data)
+                self._remaining -= len(data)
+            if not self._remaining:
+                self._index += 1
+                if self._index < len(self._parts):
+                    self._remaining = self._parts[self._index][1]
+        return b''.join(chunks)
+
+
+def _file_size(fileobj):
+    size = getattr(fileobj, 'size', None)
+    if size is None:
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+    return size
+
+
+def _multipart(fields, files):
+    body = MultipartBody(fields, files)
+    return {'data': body, 'headers': {'Content-Type': body.content_type}}
+
+
+class CircuitBreaker:
+    """
+    Fails fast after ``failure_threshold`` consecutive failures.
+
+    Once open, calls are rejected until ``reset_timeout`` seconds have passed;
+    the next call is then let through as a trial and either closes the circuit
+    or opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self):
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        End a call that neither succeeded nor failed for the service, e.g. one
+        cancelled or broken on this side, so that a half-open circuit lets the
+        next call through as its trial.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class InferenceClient:
+    """
+    HTTP client for the EF prediction service.
+
+    A single instance is shared per process so that connections to the model
+    host are kept alive and pooled across requests and worker threads.
+    """
+
+    def __init__(self, url, batch_url=None, connect_timeout=5, read_timeout=120, max_retries=3,
+                 backoff_factor=0.5, backoff_max=10, pool_size=10, breaker=None):
+        self.url = url
+        self.batch_url = batch_url or url.rstrip('/') + '/batch'
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.INFERENCE_SERVICE
+        return cls(
+            url=config['URL'],
+            batch_url=config['BATCH_URL'],
+            connect_timeout=config['CONNECT_TIMEOUT'],
+            read_timeout=config['READ_TIMEOUT'],
+            max_retries=config['MAX_RETRIES'],
+            backoff_factor=config['BACKOFF_FACTOR'],
+            backoff_max=config['BACKOFF_MAX'],
+            pool_size=config['POOL_SIZE'],
+            breaker=get_breaker(),
+        )
+
+    def predict(self, video, view, demographics):
+        """Return the predicted ejection fraction for an open echo video file."""
+        def build_request():
+            return _multipart(
+                [('view', view), ('demographic_data', json.dumps(demographics))],
+                [('video', (os.path.basename(video.name or 'echo'), video))],
+            )
+
+        return _prediction(self._post(self.url, build_request))
+
+    def predict_batch(self, items):
+        """
+        Predict many echoes in a single multipart request.
+
+        ``items`` is a list of ``(video, view, demographics)`` tuples. Returns a
+        list in the same order holding either the predicted EF or an
+        ``InferenceError`` for items the service rejected.
+        """
+        def build_request():
+            return _multipart(
+                [('items', json.dumps([
+                    {'view': view, 'demographic_data': demographics}
+                    for _, view, demographics in items
+                ]))],
+                [('videos', (os.path.basename(video.name or 'echo'), video)) for video, _, _ in items],
+            )
+
+        return _batch_predictions(self._post(self.batch_url, build_request), len(items))
+
+    def backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_factor * 2 ** attempt)
+
+    def _post(self, url, build_request):
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff(attempt - 1))
+
+            if not self.breaker.allow_request():
+                raise InferenceUnavailable("Inference service circuit is open")
+
+            try:
+                response = self.session.post(url, timeout=self.timeout, **build_request())
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                error = InferenceUnavailable(f"Error calling inference API: {e}")
+                logger.warning("Inference request failed (attempt %s): %s", attempt + 1, e)
+                continue
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+
+            if response.status_code in RETRY_STATUS_CODES:
+                self.breaker.record_failure()
+                error = InferenceUnavailable(f"API Error: HTTP {response.status_code}")
+                logger.warning("Inference service returned %s (attempt %s)", response.status_code, attempt + 1)
+                continue
+
+            self.breaker.record_success()
+            if response.status_code != 200:
+                raise InferenceError(f"API Error: {_error_detail(response)}")
+            return response.json()
+
+        raise error
+
+
+class AsyncInferenceClient:
+    """
+    asyncio counterpart of ``InferenceClient``, built on httpx, for the async
+    views served under ASGI. A request awaiting a prediction holds no
+    thread, so one process can keep hundreds of predictions in flight. It
+    has the same retries, backoff and circuit breaker as the sync client.
+
+    Pass an httpx ``transport`` (e.g. ``httpx.MockTransport``) to answer
+    requests locally instead of calling the service.
+    """
+
+    def __init__(self, url, batch_url=None, connect_timeout=5, read_timeout=120, max_retries=3,
+                 backoff_factor=0.5, backoff_max=10, pool_size=100, breaker=None, transport=None):
+        import httpx
+
+        self.url = url
+        self.batch_url = batch_url or url.rstrip('/') + '/batch'
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_settings(cls, **kwargs):
+        config = settings.INFERENCE_SERVICE
+        return cls(
+            url=config['URL'],
+            batch_url=config['BATCH_URL'],
+            connect_timeout=config['CONNECT_TIMEOUT'],
+            read_timeout=config['READ_TIMEOUT'],
+            max_retries=config['MAX_RETRIES'],
+            backoff_factor=config['BACKOFF_FACTOR'],
+            backoff_max=config['BACKOFF_MAX'],
+            pool_size=config['ASYNC_POOL_SIZE'],
+            breaker=get_breaker(),
+            **kwargs,
+        )
+
+    async def predict(self, video, view, demographics):
+        """Return the predicted ejection fraction for an open echo video file."""
+        def build_request():
+            video.seek(0)
+            return {
+                'data': {'view': view, 'demographic_data': json.dumps(demographics)},
+                'files': [('video', (os.path.basename(video.name or 'echo'), video, 'application/octet-stream'))],
+            }
+
+        return _prediction(await self._post(self.url, build_request))
+
+    async def predict_batch(self, items):
+        """Like ``InferenceClient.predict_batch``."""
+        def build_request():
+            for video, _, _ in items:
+                video.seek(0)
+            return {
+                'data': {'items': json.dumps([
+                    {'view': view, 'demographic_data': demographics} for _, view, demographics in items
+                ])},
+                'files': [
+                    ('videos', (os.path.basename(video.name or 'echo'), video, 'application/octet-stream'))
+                    for video, _, _ in items
+                ],
+            }
+
+        return _batch_predictions(await self._post(self.batch_url, build_request), len(items))
+
+    def backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_factor * 2 ** attempt)
+
+    async def _post(self, url, build_request):
+        import httpx
+
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff(attempt - 1))
+
+            if not self.breaker.allow_request():
+                raise InferenceUnavailable("Inference service circuit is open")
+
+            try:
+                response = await self.client.post(url, **build_request())
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                self.breaker.record_failure()
+                error = InferenceUnavailable(f"Error calling inference API: {e!r}")
+                logger.warning("Inference request failed (attempt %s): %r", attempt + 1, e)
+                continue
+            except BaseException:
+                # Includes the CancelledError of a caller that stopped waiting
+                self.breaker.release_trial()
+                raise
+
+            if response.status_code in RETRY_STATUS_CODES:
+                self.breaker.record_failure()
+                error = InferenceUnavailable(f"API Error: HTTP {response.status_code}")
+                logger.warning("Inference service returned %s (attempt %s)", response.status_code, attempt + 1)
+                continue
+
+            self.breaker.record_success()
+            if response.status_code != 200:
+                raise InferenceError(f"API Error: {_error_detail(response)}")
+            return response.json()
+
+        raise error
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class ThreadedInference:
+    """Awaitable wrapper running a blocking backend, such as the local engine, on a thread."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def predict(self, video, view, demographics):
+        return await asyncio.to_thread(self.client.predict, video, view, demographics)
+
+    async def predict_batch(self, items):
+        return await asyncio.to_thread(self.client.predict_batch, items)
+
+
+def _prediction(result):
+    try:
+        return result['ef_prediction']
+    except (KeyError, TypeError):
+        raise InferenceError(f"Malformed response from inference API: {result!r}")
+
+
+def _batch_predictions(result, count):
+    predictions = result.get('predictions') if isinstance(result, dict) else None
+    if not isinstance(predictions, list) or len(predictions) != count:
+        raise InferenceError(f"Malformed batch response from inference API: {result!r}")
+
+    return [
+        prediction['ef_prediction'] if 'ef_prediction' in prediction
+        else InferenceError(f"API Error: {prediction.get('detail', 'Unknown error')}")
+        for prediction in predictions
+    ]
+
+
+def _error_detail(response):
+    try:
+        return response.json().get('detail', 'Unknown error')
+    except ValueError:
+        return f'HTTP {response.status_code}'
+
+
+_client = None
+_client_lock = threading.Lock()
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """
+    Return the process-wide circuit breaker of the remote service, shared by
+    the sync client and the async clients of every event loop so that all
+    their failures count towards opening it.
+    """
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                config = settings.INFERENCE_SERVICE
+                _breaker = CircuitBreaker(
+                    failure_threshold=config['CIRCUIT_BREAKER_THRESHOLD'],
+                    reset_timeout=config['CIRCUIT_BREAKER_RESET_TIMEOUT'],
+                )
+    return _breaker
+
+
+def get_client():
+    """
+    Return the process-wide inference backend selected by
+    ``INFERENCE_SERVICE['BACKEND']``: ``'remote'`` for the HTTP service or
+    ``'local'`` for the in-process ``LocalInferenceEngine``.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                backend = settings.INFERENCE_SERVICE.get('BACKEND', 'remote')
+                if backend == 'local':
+                    from patients.local_inference import LocalInferenceEngine
+                    _client = LocalInferenceEngine.from_settings()
+                elif backend == 'remote':
+                    _client = InferenceClient.from_settings()
+                else:
+                    raise ImproperlyConfigured(f"Unknown INFERENCE_SERVICE BACKEND {backend!r}")
+    return _client
+
+
+# Event loop -> (client, task closing it). httpx clients are bound to the
+# event loop they were first used on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the awaitable inference backend for the running event loop: an
+    ``AsyncInferenceClient`` for the remote service, or the process-wide
+    backend run on a thread for blocking backends such as ``'local'``.
+
+    The httpx client is closed when its loop shuts down. Under ASGI that is
+    the server's one loop per worker; under WSGI Django runs each async view
+    on a new loop, so the client only lives for the request.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        if settings.INFERENCE_SERVICE.get('BACKEND', 'remote') == 'remote':
+            client = AsyncInferenceClient.from_settings()
+            entry = (client, loop.create_task(_close_on_shutdown(client)))
+        else:
+            entry = (ThreadedInference(get_client()), None)
+        _async_clients[loop] = entry
+    return entry[0]
+
+
+async def _close_on_shutdown(client):
+    """Wait until cancelled, as ``asyncio.run`` does to the tasks left when a loop ends, then close ``client``."""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.create_future()
+    finally:
+        # The task refers to the loop, so the entry would keep it alive
+        _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+def reset_client(**kwargs):
+    global _client, _breaker
+    if kwargs.get('setting', 'INFERENCE_SERVICE') == 'INFERENCE_SERVICE':
+        if hasattr(_client, 'shutdown'):
+            _client.shutdown()
+        _client = None
+        _breaker = None
+        _async_clients.clear()
+
+
+setting_changed.connect(reset_client)
@@ -0,0 +1,121 @@
+"""
+Declarative EF interpretation rules.
+
+A rule set is a table of EF bands, each identified by its lower bound, with
+the notes recorded for diagnoses that fall in it. Bands are contiguous: a
+band covers ``[lower, next lower)`` so every EF maps to exactly one band.
+Rule sets are versioned and every stored interpretation records the version
+that produced it, so history can be re-interpreted when the rules change.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from patients.models import Interpretation
+
+
+@dataclass(frozen=True)
+class Band:
+    lower: float
+    label: str
+    notes: tuple
+
+
+class RuleSet:
+    """
+    A compiled band table. Lookups bisect the sorted lower bounds, so
+    classifying an EF costs O(log bands) and never falls through a gap.
+    """
+
+    def __init__(self, version, bands, max_notes=3):
+        bands = sorted(bands, key=lambda band: band.lower)
+        if not bands:
+            raise ValueError(f"Rule set {version} has no bands")
+        if len({band.lower for band in bands}) != len(bands):
+            raise ValueError(f"Rule set {version} has overlapping bands")
+        self.version = version
+        self.bands = tuple(bands)
+        self.bounds = [band.lower for band in bands]
+        self.max_notes = max_notes
+
+    def band_for(self, ef):
+        # EFs below the first bound belong to the lowest band
+        return self.bands[max(bisect_right(self.bounds, ef) - 1, 0)]
+
+    def notes_for(self, ef):
+        """Return the notes for ``ef``, always the same ones in the same order."""
+        return [note.format(ef=ef) for note in self.band_for(ef).notes[:self.max_notes]]
+
+    def interpret(self, diagnoses):
+        """
+        Return unsaved interpretations for many diagnoses at once. Each
+        distinct EF is classified and formatted only once.
+        """
+        notes = {}
+        interpretations = []
+        for diagnosis in diagnoses:
+            ef = diagnosis.ejection_fraction
+            if ef not in notes:
+                notes[ef] = self.notes_for(ef)
+            interpretations.extend(
+                Interpretation(diagnosis_id=diagnosis.id, note=note, rule_version=self.version)
+                for note in notes[ef]
+            )
+        return interpretations
+
+
+RULESETS = {
+    '2025.1': RuleSet('2025.1', [
+        Band(0, 'severe', (
+            "Severely abnormal ejection fraction ({ef}%) indicating critical cardiac dysfunction",
+            "High risk condition requiring immediate medical attention",
+            "Patient likely experiencing severe symptoms with risk of cardiac arrest",
+        )),
+        Band(30, 'moderate', (
+            "Moderately abnormal ejection fraction ({ef}%) indicating significant dysfunction",
+            "Patient may experience symptoms even at rest",
+            "Close monitoring and therapy adjustment may be needed",
+        )),
+        Band(41, 'mild', (
+            "Borderline low ejection fraction ({ef}%) indicating mild systolic dysfunction",
+            "May experience mild symptoms during physical activity",
+            "Regular monitoring and follow-up recommended",
+        )),
+        Band(50, 'normal', (
+            "Normal ejection fraction ({ef}%) indicating preserved systolic function",
+            "Heart pumping function within normal range",
+            "Consider monitoring for HFpEF despite normal ejection fraction",
+        )),
+        Band(75, 'hyperdynamic', (
+            "Dangerously elevated ejection fraction ({ef}%) suggesting possible Hypertrophic Cardiomyopathy",
+            "High risk condition requiring immediate attention due to potential cardiac arrest risk",
+            "Impaired ventricular filling due to extremely high ejection fraction",
+        )),
+    ]),
+}
+
+_ruleset = None
+
+
+def get_ruleset(version=None):
+    """Return the rule set ``version``, or the one named by INTERPRETATION_RULESET."""
+    global _ruleset
+    if version is not None:
+        try:
+            return RULESETS[version]
+        except KeyError:
+            raise ValueError(f"Unknown interpretation rule set {version!r}")
+    if _ruleset is None:
+        _ruleset = get_ruleset(settings.INTERPRETATION_RULESET)
+    return _ruleset
+
+
+def reset_ruleset(**kwargs):
+    global _ruleset
+    if kwargs.get('setting', 'INTERPRETATION_RULESET') == 'INTERPRETATION_RULESET':
+        _ruleset = None
+
+
+setting_changed.connect(reset_ruleset)
@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from patients.analysis import analyze_batch, analyze_echo, analyze_echo_async, apply_cached_prediction, \
+    complete_analysis
+from patients.models import AnalysisJob, Diagnosis
+from patients.notifications import notify_analysis_finished
+from patients.previews import generate_previews
+from patients.response_cache import bump_diagnoses
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_analysis(diagnosis):
+    """
+    Queue an echo analysis for the diagnosis and mark it as pending.
+
+    Echoes with a cached prediction are completed straight away and no job is
+    created; ``None`` is returned in that case.
+    """
+    if apply_cached_prediction(diagnosis):
+        complete_analysis([diagnosis])
+        return None
+
+    if diagnosis.analysis_status != Diagnosis.ANALYSIS_PENDING:
+        diagnosis.analysis_status = Diagnosis.ANALYSIS_PENDING
+        diagnosis.save(update_fields=['analysis_status'])
+
+    return AnalysisJob.objects.create(
+        diagnosis=diagnosis,
+        max_attempts=settings.ANALYSIS_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_previews(diagnosis):
+    """
+    Queue rendering of the poster frame and preview clip of the diagnosis'
+    echo, unless they already exist. Returns the job or ``None``.
+    """
+    blob = diagnosis.echo_blob
+    if blob is None or (blob.poster and blob.preview):
+        return None
+
+    return AnalysisJob.objects.create(
+        diagnosis=diagnosis,
+        kind=AnalysisJob.KIND_PREVIEW,
+        max_attempts=settings.ANALYSIS_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_bulk(diagnoses):
+    """
+    Queue analyses for many diagnoses at once, skipping ones that already have
+    an open job. Returns the created jobs.
+    """
+    diagnosis_ids = [diagnosis.id for diagnosis in diagnoses]
+    open_ids = set(AnalysisJob.objects.filter(
+        diagnosis_id__in=diagnosis_ids,
+        kind=AnalysisJob.KIND_ANALYSIS,
+        status__in=[Diagnosis.ANALYSIS_PENDING, Diagnosis.ANALYSIS_PROCESSING],
+    ).values_list('diagnosis_id', flat=True))
+    new_ids = [diagnosis_id for diagnosis_id in diagnosis_ids if diagnosis_id not in open_ids]
+
+    Diagnosis.objects.filter(id__in=new_ids).update(analysis_status=Diagnosis.ANALYSIS_PENDING)
+    bump_diagnoses([diagnosis for diagnosis in diagnoses if diagnosis.id not in open_ids])
+    return AnalysisJob.objects.bulk_create([
+        AnalysisJob(diagnosis_id=diagnosis_id, max_attempts=settings.ANALYSIS_MAX_ATTEMPTS)
+        for diagnosis_id in new_ids
+    ])
+
+
+def _claimable(now):
+    stale_before = now - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT)
+    return (
+        Q(status=Diagnosis.ANALYSIS_PENDING, run_after__lte=now)
+        | Q(status=Diagnosis.ANALYSIS_PROCESSING, started_at__lt=stale_before)
+    )
+
+
+def runnable_jobs(now=None):
+    """Jobs a worker may claim right now, in the order they should run."""
+    return AnalysisJob.objects.filter(_claimable(now or timezone.now())).order_by('run_after', 'id')
+
+
+def claim_jobs(worker_id, limit=1):
+    """
+    Atomically take up to ``limit`` runnable jobs for ``worker_id``.
+
+    Jobs left in ``processing`` by a worker that died are reclaimed once they
+    are older than ANALYSIS_JOB_TIMEOUT. Claiming is a conditional UPDATE per
+    row, so concurrent workers never run the same job twice.
+    """
+    now = timezone.now()
+    condition = _claimable(now)
+    candidates = runnable_jobs(now).values_list('id', flat=True)
+
+    claimed = []
+    for job_id in candidates[:limit * 4]:
+        if _claim(job_id, worker_id, condition, now):
+            claimed.append(job_id)
+        if len(claimed) == limit:
+            break
+
+    return list(AnalysisJob.objects.filter(id__in=claimed).select_related(
+        'diagnosis__patient', 'diagnosis__echo_blob', 'diagnosis__echo_tensor'
+    ))
+
+
+def _claim(job_id, worker_id, condition, now):
+    return AnalysisJob.objects.filter(condition, id=job_id).update(
+        status=Diagnosis.ANALYSIS_PROCESSING,
+        worker=worker_id,
+        started_at=now,
+        attempts=F('attempts') + 1,
+    )
+
+
+def claim_job(job, worker_id):
+    """Claim one specific pending job for ``worker_id``. Returns whether it was claimed."""
+    now = timezone.now()
+    if not _claim(job.id, worker_id, _claimable(now), now):
+        return False
+    job.status = Diagnosis.ANALYSIS_PROCESSING
+    job.worker = worker_id
+    job.started_at = now
+    job.attempts += 1
+    return True
+
+
+def run_jobs(jobs):
+    """
+    Run claimed jobs, batching them into one inference request when there are
+    several. Returns the number of jobs that completed.
+    """
+    diagnoses = [job.diagnosis for job in jobs]
+    Diagnosis.objects.filter(id__in=[d.id for d in diagnoses]).update(
+        analysis_status=Diagnosis.ANALYSIS_PROCESSING
+    )
+    bump_diagnoses(diagnoses)
+
+    try:
+        if len(diagnoses) == 1:
+            analyze_echo(diagnoses[0])
+            errors = {}
+        else:
+            errors = analyze_batch(diagnoses)
+    except Exception as e:
+        errors = {diagnosis.id: e for diagnosis in diagnoses}
+
+    completed = []
+    for job in jobs:
+        if job.diagnosis_id in errors:
+            _record_failure(job, errors[job.diagnosis_id])
+        else:
+            completed.append(job)
+
+    if not completed:
+        return 0
+
+    _complete(completed)
+    return len(completed)
+
+
+async def run_job_async(job, timeout):
+    """
+    Run a claimed analysis job in an async view, awaiting the prediction for
+    at most ``timeout`` seconds. Failures are recorded as in ``run_jobs`` and
+    a job that runs out of time is handed back to the worker straight away.
+    Returns whether the job completed.
+    """
+    try:
+        await asyncio.wait_for(analyze_echo_async(job.diagnosis), timeout)
+    except asyncio.TimeoutError:
+        await sync_to_async(_release)(job)
+        return False
+    except Exception as e:
+        await sync_to_async(_record_failure)(job, e)
+        return False
+
+    await sync_to_async(_complete)([job])
+    return True
+
+
+def _complete(jobs):
+    with transaction.atomic():
+        complete_analysis([job.diagnosis for job in jobs])
+        AnalysisJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            status=Diagnosis.ANALYSIS_COMPLETED,
+            finished_at=timezone.now(),
+            last_error='',
+        )
+
+
+def _release(job):
+    """Give a claimed job back to the queue without counting the attempt."""
+    AnalysisJob.objects.filter(id=job.id).update(
+        status=Diagnosis.ANALYSIS_PENDING,
+        run_after=timezone.now(),
+        worker='',
+        attempts=F('attempts') - 1,
+    )
+    Diagnosis.objects.filter(id=job.diagnosis_id).update(analysis_status=Diagnosis.ANALYSIS_PENDING)
+    bump_diagnoses([job.diagnosis])
+
+
+def run_preview_jobs(jobs):
+    """Render previews for claimed preview jobs. Returns the number that completed."""
+    completed = []
+    for job in jobs:
+        try:
+            generate_previews(job.diagnosis.echo_blob)
+        except Exception as e:
+            _record_failure(job, e)
+        else:
+            completed.append(job.id)
+
+    AnalysisJob.objects.filter(id__in=completed).update(
+        status=Diagnosis.ANALYSIS_COMPLETED,
+        finished_at=timezone.now(),
+        last_error='',
+    )
+    return len(completed)
+
+
+def _record_failure(job, error):
+    now = timezone.now()
+
+    if job.attempts < job.max_attempts:
+        delay = settings.ANALYSIS_RETRY_DELAY * 2 ** (job.attempts - 1)
+        logger.warning("Analysis job %s failed (attempt %s/%s), retrying in %ss: %s",
+                       job.id, job.attempts, job.max_attempts, delay, error)
+        AnalysisJob.objects.filter(id=job.id).update(
+            status=Diagnosis.ANALYSIS_PENDING,
+            run_after=now + timedelta(seconds=delay),
+            last_error=str(error),
+        )
+        status = Diagnosis.ANALYSIS_PENDING
+    else:
+        logger.error("Analysis job %s failed permanently: %s", job.id, error)
+        AnalysisJob.objects.filter(id=job.id).update(
+            status=Diagnosis.ANALYSIS_FAILED,
+            finished_at=now,
+            last_error=str(error),
+        )
+        status = Diagnosis.ANALYSIS_FAILED
+
+    # A failed preview does not affect the diagnosis' analysis status
+    if job.kind == AnalysisJob.KIND_ANALYSIS:
+        Diagnosis.objects.filter(id=job.diagnosis_id).update(analysis_status=status)
+        bump_diagnoses([job.diagnosis])
+        if status == Diagnosis.ANALYSIS_FAILED:
+            notify_analysis_finished([job.diagnosis_id])
+
+
+class Worker:
+    """
+    Polls the job table and runs analyses on a pool of threads. Each thread
+    claims up to ``batch_size`` jobs at a time and analyzes them together;
+    preview jobs among them are rendered one by one.
+
+    With a single thread the worker runs in the calling thread, which keeps
+    ``burst`` runs usable from tests and one-off management commands.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None, burst=False, batch_size=None):
+        self.concurrency = concurrency or settings.ANALYSIS_WORKER_CONCURRENCY
+        self.batch_size = batch_size or settings.ANALYSIS_BATCH_SIZE
+        self.poll_interval = settings.ANALYSIS_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.burst = burst
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        if self.concurrency == 1:
+            self._loop(self.name)
+            return self.processed
+
+        threads = [
+            threading.Thread(target=self._thread_main, args=(f'{self.name}:{i}',), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.processed
+
+    def _thread_main(self, worker_id):
+        try:
+            self._loop(worker_id)
+        finally:
+            connection.close()
+
+    def _loop(self, worker_id):
+        while not self._stop.is_set():
+            jobs = claim_jobs(worker_id, limit=self.batch_size)
+            if not jobs:
+                if self.burst:
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+
+            try:
+                analyses = [job for job in jobs if job.kind == AnalysisJob.KIND_ANALYSIS]
+                if analyses:
+                    run_jobs(analyses)
+                previews = [job for job in jobs if job.kind == AnalysisJob.KIND_PREVIEW]
+                if previews:
+                    run_preview_jobs(previews)
+            except Exception:
+                logger.exception("Unexpected error while running analysis jobs %s", [job.id for job in jobs])
+            with self._lock:
+                self.processed += len(jobs)
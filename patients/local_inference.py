@@ -0,0 +1,233 @@
+"""
+In-process EF inference.
+
+The model is run on a pool of worker processes on this host instead of
+behind the remote HTTP service. Each worker process loads the model once
+and keeps it in memory; frames are decoded with OpenCV inside the worker so
+the video bytes never cross the process boundary, only the file path does.
+
+keras, numpy and cv2 are imported inside the worker processes only, so the
+web and job processes that merely submit work do not pay for them.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from django.conf import settings
+
+from patients.inference import InferenceError, InferenceUnavailable
+
+logger = logging.getLogger(__name__)
+
+GENDERS = {'M': 1.0, 'F': 0.0}
+
+# Per worker process: view -> loaded keras model
+_models = {}
+_model_path = None
+
+
+def _init_worker(model_path):
+    global _model_path
+    _model_path = model_path
+
+
+def _load_model(view):
+    if view not in _models:
+        import keras
+        path = _model_path.format(view=view)
+        logger.info("Loading EF model %s in process %s", path, os.getpid())
+        _models[view] = keras.models.load_model(path, compile=False)
+    return _models[view]
+
+
+def read_frames(path, frames, size):
+    """
+    Decode ``frames`` evenly spaced grayscale frames of ``size`` x ``size``
+    pixels as a uint8 array of shape (frames, size, size, 1).
+    """
+    import cv2
+    import numpy as np
+
+    capture = cv2.VideoCapture(path)
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            raise ValueError(f"Could not read any frames from {os.path.basename(path)}")
+
+        clip = np.zeros((frames, size, size, 1), dtype=np.uint8)
+        for i, index in enumerate(np.linspace(0, total - 1, frames).astype(int)):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ok, frame = capture.read()
+            if not ok:
+                # Keep the last decoded frame for short or truncated videos
+                clip[i:] = clip[i - 1] if i else 0
+                break
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frame = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+            clip[i, :, :, 0] = frame
+        return clip
+    finally:
+        capture.release()
+
+
+def demographic_features(demographics):
+    return [
+        float(demographics.get('age') or 0),
+        GENDERS.get(demographics.get('gender'), 0.5),
+        float(demographics.get('weight') or 0),
+        float(demographics.get('height') or 0),
+    ]
+
+
+def load_clip(path, frames, size):
+    """Memory-map a preprocessed ``.npy`` tensor, or decode the video at ``path``."""
+    import numpy as np
+
+    if path.endswith('.npy'):
+        clip = np.load(path, mmap_mode='r')
+        if clip.shape != (frames, size, size, 1):
+            raise ValueError(f"Preprocessed tensor has shape {clip.shape}, expected {(frames, size, size, 1)}")
+        return clip
+    return read_frames(path, frames, size)
+
+
+def _run(path, view, demographics, frames, size):
+    """Predict one echo inside a worker process. Returns the EF as a float."""
+    import numpy as np
+
+    clip = np.asarray(load_clip(path, frames, size), dtype=np.float32) / 255.0
+    features = np.asarray([demographic_features(demographics)], dtype=np.float32)
+    prediction = _load_model(view).predict([clip[np.newaxis], features], verbose=0)
+    return round(float(np.ravel(prediction)[0]), 2)
+
+
+class LocalInferenceEngine:
+    """
+    Drop-in replacement for ``InferenceClient`` that predicts on a local
+    process pool. Besides videos it accepts preprocessed ``.npy`` tensors of
+    its input shape, which are memory-mapped instead of decoded.
+
+    At most ``max_pending`` predictions are queued or running at once; callers
+    beyond that wait up to ``queue_timeout`` seconds for a slot and then get
+    ``InferenceUnavailable``, so a burst of uploads cannot pile up unbounded
+    work in memory.
+    """
+    accepts_tensors = True
+
+    def __init__(self, model_path, workers=None, max_pending=None, queue_timeout=30, frames=32, frame_size=112,
+                 executor=None):
+        self.model_path = model_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.queue_timeout = queue_timeout
+        self.frames = frames
+        self.frame_size = frame_size
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.INFERENCE_SERVICE
+        return cls(
+            model_path=config['LOCAL_MODEL_PATH'],
+            workers=config['LOCAL_WORKERS'],
+            max_pending=config['LOCAL_MAX_PENDING'],
+            queue_timeout=config['LOCAL_QUEUE_TIMEOUT'],
+            frames=config['LOCAL_FRAMES'],
+            frame_size=config['LOCAL_FRAME_SIZE'],
+        )
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: the parent holds DB connections and threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=get_context('spawn'),
+                        initializer=_init_worker,
+                        initargs=(self.model_path,),
+                    )
+        return self._executor
+
+    def predict(self, video, view, demographics):
+        """Return the predicted ejection fraction for an open echo video file."""
+        return self._result(self._submit(video, view, demographics))
+
+    def predict_batch(self, items):
+        """
+        Predict ``(video, view, demographics)`` items in parallel across the
+        pool. Returns the EF or an ``InferenceError`` per item, in order.
+        """
+        futures = [self._submit(*item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(self._result(future))
+            except InferenceUnavailable:
+                raise
+            except InferenceError as e:
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _submit(self, video, view, demographics):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise InferenceUnavailable(f"Local inference queue is full ({self.max_pending} pending)")
+
+        path, cleanup = _local_path(video)
+        try:
+            future = self.executor.submit(_run, path, view, demographics, self.frames, self.frame_size)
+        except BaseException:
+            self._slots.release()
+            cleanup()
+            raise
+
+        def done(_):
+            self._slots.release()
+            cleanup()
+
+        future.add_done_callback(done)
+        return future
+
+    def _result(self, future):
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            self.shutdown()
+            raise InferenceUnavailable(f"Local inference worker died: {e}")
+        except Exception as e:
+            raise InferenceError(f"Local inference failed: {e}")
+
+
+def _local_path(video):
+    """
+    Return ``(path, cleanup)`` for a file the worker processes can open.
+
+    Files already on the local filesystem are used in place; anything else is
+    copied to a temporary file that ``cleanup`` removes.
+    """
+    try:
+        path = video.path
+    except (AttributeError, NotImplementedError):
+        path = getattr(video, 'name', None)
+    if path and os.path.isfile(path):
+        return path, lambda: None
+
+    video.seek(0)
+    _, ext = os.path.splitext(getattr(video, 'name', None) or '')
+    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp:
+        shutil.copyfileobj(video, temp, 64 * 1024)
+    return temp.name, lambda: os.path.exists(temp.name) and os.remove(temp.name)
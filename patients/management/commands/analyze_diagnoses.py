@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from patients.jobs import Worker, enqueue_bulk
+from patients.models import Diagnosis
+
+
+class Command(BaseCommand):
+    help = 'Queue diagnoses for (re-)analysis and process them in inference batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', choices=[choice for choice, _ in Diagnosis.ANALYSIS_STATUS_CHOICES],
+                            action='append', help='Only diagnoses with this analysis status (repeatable)')
+        parser.add_argument('--patient', type=int, help='Only diagnoses for this patient id')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Echoes per inference request (defaults to ANALYSIS_BATCH_SIZE)')
+        parser.add_argument('--queue-only', action='store_true',
+                            help='Only queue the jobs and leave them to run_analysis_worker')
+
+    def handle(self, *args, **options):
+        diagnoses = Diagnosis.objects.only('id')
+        if options['status']:
+            diagnoses = diagnoses.filter(analysis_status__in=options['status'])
+        if options['patient']:
+            diagnoses = diagnoses.filter(patient_id=options['patient'])
+
+        jobs = enqueue_bulk(list(diagnoses))
+        self.stdout.write(f'Queued {len(jobs)} diagnosis(es) for analysis')
+
+        if options['queue_only']:
+            return
+
+        worker = Worker(concurrency=1, burst=True, batch_size=options['batch_size'])
+        processed = worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s) in batches of {worker.batch_size}'))
@@ -0,0 +1,48 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from patients.models import Diagnosis, EchoBlob
+from patients.response_cache import bump_all
+
+
+class Command(BaseCommand):
+    help = 'Move legacy per-patient echo files into content-addressed storage and remove duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+
+    def handle(self, *args, **options):
+        legacy = Diagnosis.objects.filter(echo_blob__isnull=True).exclude(echocardiogram='')
+        moved = missing = 0
+        freed = set()
+
+        for diagnosis in legacy.iterator():
+            name = diagnosis.echocardiogram.name
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            if options['dry_run']:
+                moved += 1
+                continue
+
+            with transaction.atomic():
+                with default_storage.open(name, 'rb') as echo:
+                    blob = EchoBlob.objects.acquire(echo, name)
+                Diagnosis.objects.filter(pk=diagnosis.pk).update(echo_blob=blob, echocardiogram=blob.file.name)
+            moved += 1
+            freed.add(name)
+
+        if freed:
+            bump_all()
+
+        removed = 0
+        for name in freed:
+            if not Diagnosis.objects.filter(echocardiogram=name).exists():
+                default_storage.delete(name)
+                removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would move" if options["dry_run"] else "Moved"} {moved} echo(s) into content-addressed storage, '
+            f'removed {removed} legacy file(s), {missing} missing'
+        ))
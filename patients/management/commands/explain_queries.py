@@ -0,0 +1,89 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+
+from accounts.models import Profile
+from patients.jobs import runnable_jobs
+from patients.models import Diagnosis, Interpretation
+from patients.views import DiagnosisDetailView, DiagnosisListCreateView, PatientDetailView, PatientListCreateView
+
+# Postgres: "Seq Scan on patients_patient"; SQLite: "SCAN patients_patient" (no index)
+SEQ_SCAN_PATTERNS = [
+    re.compile(r'Seq Scan on (\w+)'),
+    re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)'),
+]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the querysets behind each API view and flag sequential scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, help='Profile id to build the doctor-scoped queries for')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run EXPLAIN ANALYZE (executes the queries; Postgres only)')
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help='Exit with an error if any query uses a sequential scan')
+
+    def handle(self, *args, **options):
+        doctor = self.get_doctor(options['doctor'])
+        patient = doctor.patients.order_by('-created_at').first()
+        diagnosis = Diagnosis.objects.filter(patient=patient).order_by('-diagnosis_date').first()
+        patient_id = patient.id if patient else 0
+        diagnosis_id = diagnosis.id if diagnosis else 0
+
+        queries = [
+            ('PatientListCreateView', self.list_queryset(PatientListCreateView, doctor)),
+            ('PatientDetailView', self.view_queryset(PatientDetailView, doctor).filter(pk=patient_id)),
+            ('DiagnosisListCreateView', self.list_queryset(DiagnosisListCreateView, doctor, patient_id=patient_id)),
+            ('DiagnosisDetailView',
+             self.view_queryset(DiagnosisDetailView, doctor, patient_id=patient_id).filter(pk=diagnosis_id)),
+            ('DiagnosisDetailView interpretations',
+             Interpretation.objects.filter(diagnosis_id__in=[diagnosis_id]).order_by('created_at')),
+            ('run_analysis_worker claim', runnable_jobs()),
+        ]
+
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        flagged = []
+        for name, queryset in queries:
+            plan = queryset.explain(**explain_options)
+            scans = sorted({match for pattern in SEQ_SCAN_PATTERNS for match in pattern.findall(plan)})
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            if scans:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(f'Sequential scan on: {", ".join(scans)}'))
+            self.stdout.write('')
+
+        if flagged and options['fail_on_seq_scan']:
+            raise CommandError(f'Sequential scans in: {", ".join(flagged)}')
+        if flagged:
+            self.stdout.write(self.style.WARNING(f'{len(flagged)} of {len(queries)} queries use sequential scans'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {len(queries)} queries use indexes ({connection.vendor})'))
+
+    def get_doctor(self, profile_id):
+        if profile_id:
+            try:
+                return Profile.objects.get(id=profile_id)
+            except Profile.DoesNotExist:
+                raise CommandError(f'Profile {profile_id} does not exist')
+
+        doctor = Profile.objects.annotate(patient_count=Count('patients')).order_by('-patient_count').first()
+        if doctor is None:
+            raise CommandError('No doctor profiles found, create one or pass --doctor')
+        return doctor
+
+    def view_queryset(self, view_class, doctor, **kwargs):
+        request = RequestFactory().get('/')
+        request.user = doctor.user
+        view = view_class(request=request, kwargs=kwargs, format_kwarg=None)
+        return view.get_queryset()
+
+    def list_queryset(self, view_class, doctor, **kwargs):
+        pagination = view_class.pagination_class
+        queryset = self.view_queryset(view_class, doctor, **kwargs)
+        return queryset.order_by(*pagination.ordering)[:pagination.page_size + 1]
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from patients.jobs import Worker, enqueue_previews
+from patients.models import AnalysisJob, Diagnosis, EchoBlob
+
+
+class Command(BaseCommand):
+    help = 'Queue poster frames and preview clips for echoes that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue-only', action='store_true',
+                            help='Only queue the jobs and leave them to run_analysis_worker')
+
+    def handle(self, *args, **options):
+        queued = AnalysisJob.objects.filter(
+            kind=AnalysisJob.KIND_PREVIEW,
+            status__in=[Diagnosis.ANALYSIS_PENDING, Diagnosis.ANALYSIS_PROCESSING],
+        ).values('diagnosis__echo_blob_id')
+        blobs = EchoBlob.objects.filter(Q(poster='') | Q(preview='')).exclude(id__in=queued)
+
+        # One job per echo; the previews are shared by every diagnosis referencing it
+        count = 0
+        for blob in blobs.iterator():
+            diagnosis = Diagnosis.objects.filter(echo_blob=blob).select_related('echo_blob').first()
+            if diagnosis and enqueue_previews(diagnosis):
+                count += 1
+        self.stdout.write(f'Queued {count} echo(es) for preview rendering')
+
+        if options['queue_only']:
+            return
+
+        processed = Worker(concurrency=1, burst=True).run()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+
+from patients.models import Diagnosis
+from patients.preprocessing import input_shape, preprocess
+
+
+class Command(BaseCommand):
+    help = 'Decode echoes into memory-mappable tensors of the local model input shape'
+
+    def add_arguments(self, parser):
+        frames, frame_size = input_shape()
+        parser.add_argument('--frames', type=int, default=frames, help=f'Frames per tensor (default {frames})')
+        parser.add_argument('--frame-size', type=int, default=frame_size,
+                            help=f'Frame width and height in pixels (default {frame_size})')
+        parser.add_argument('--patient', type=int, help='Only diagnoses for this patient id')
+        parser.add_argument('--workers', type=int, default=1, help='Decoding processes to run in parallel')
+        parser.add_argument('--batch-size', type=int, default=200, help='Diagnoses loaded per batch')
+
+    def handle(self, *args, **options):
+        diagnoses = Diagnosis.objects.filter(echo_blob__isnull=False).exclude(
+            echo_tensor__frames=options['frames'], echo_tensor__frame_size=options['frame_size'],
+        ).only('id', 'echo_blob_id', 'echo_tensor_id').order_by('id')
+        if options['patient']:
+            diagnoses = diagnoses.filter(patient_id=options['patient'])
+
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'], mp_context=get_context('spawn'))
+
+        created = failed = 0
+        last_id = 0
+        try:
+            while True:
+                batch = list(diagnoses.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                # Two echoes per process, so the next one downloads while one decodes
+                batch_created, batch_failed = preprocess(
+                    batch, options['frames'], options['frame_size'], executor=executor,
+                    concurrency=options['workers'] * 2)
+                created += batch_created
+                failed += batch_failed
+                last_id = batch[-1].id
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} tensor(s) of {options["frames"]}x{options["frame_size"]}, {failed} failed'
+        ))
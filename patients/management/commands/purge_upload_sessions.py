@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from patients.models import UploadSession
+from patients.uploads import discard
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were not finalized within UPLOAD_SESSION_TTL'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(
+            status=UploadSession.STATUS_ACTIVE,
+            updated_at__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL),
+        )
+        count = 0
+        for session in expired.iterator():
+            discard(session)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} expired upload session(s)'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from patients.interpretation import get_ruleset
+from patients.models import Diagnosis, Interpretation
+from patients.response_cache import bump_all
+
+
+class Command(BaseCommand):
+    help = 'Replace the interpretations of completed diagnoses with those of the current rule set'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ruleset', help='Rule set version to apply (defaults to INTERPRETATION_RULESET)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Diagnoses rewritten per transaction')
+        parser.add_argument('--all', action='store_true',
+                            help='Also rewrite diagnoses already interpreted with this rule set')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the diagnoses that would change')
+
+    def handle(self, *args, **options):
+        try:
+            ruleset = get_ruleset(options['ruleset'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        diagnoses = Diagnosis.objects.filter(
+            analysis_status=Diagnosis.ANALYSIS_COMPLETED, ejection_fraction__isnull=False,
+        ).only('id', 'ejection_fraction').order_by('id')
+        if not options['all']:
+            current = Interpretation.objects.filter(rule_version=ruleset.version).values('diagnosis_id')
+            diagnoses = diagnoses.exclude(id__in=current)
+
+        if options['dry_run']:
+            self.stdout.write(f'{diagnoses.count()} diagnosis(es) would be re-interpreted with {ruleset.version}')
+            return
+
+        # Keyset pagination so each batch is an index range scan however large the table
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(diagnoses.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            ids = [diagnosis.id for diagnosis in batch]
+            with transaction.atomic():
+                Interpretation.objects.filter(diagnosis_id__in=ids).delete()
+                Interpretation.objects.bulk_create(ruleset.interpret(batch))
+                bump_all()
+            total += len(batch)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Re-interpreted {total} diagnosis(es) with rule set {ruleset.version}'))
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from patients.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Process queued echocardiogram analysis jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of worker threads (defaults to ANALYSIS_WORKER_CONCURRENCY)')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once there are no runnable jobs left')
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+        )
+
+        def shutdown(signum, frame):
+            self.stdout.write('Shutting down after current jobs...')
+            worker.stop()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        self.stdout.write(f'Starting analysis worker {worker.name} with {worker.concurrency} thread(s)')
+        processed = worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:04
+
+import django.db.models.deletion
+import patients.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_analysis_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EchoBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='diagnosis',
+            name='echocardiogram',
+            field=models.FileField(default='', max_length=255, upload_to=patients.models.echo_upload_path),
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='echo_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='diagnoses', to='patients.echoblob'),
+        ),
+    ]
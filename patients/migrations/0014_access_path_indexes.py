@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_profile_profile_picture'),
+        ('patients', '0013_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['patient', '-diagnosis_date', '-id'], name='diagnosis_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interpretation',
+            index=models.Index(fields=['diagnosis', 'created_at'], name='interp_diagnosis_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['doctor', '-created_at', '-id'], name='patient_doctor_created_idx'),
+        ),
+    ]
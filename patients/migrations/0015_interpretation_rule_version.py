@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0014_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interpretation',
+            name='rule_version',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
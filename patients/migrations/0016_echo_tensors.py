@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0015_interpretation_rule_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EchoTensor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frames', models.PositiveIntegerField()),
+                ('frame_size', models.PositiveIntegerField()),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tensors', to='patients.echoblob')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='echo_tensor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='diagnoses', to='patients.echotensor'),
+        ),
+        migrations.AddConstraint(
+            model_name='echotensor',
+            constraint=models.UniqueConstraint(fields=('blob', 'frames', 'frame_size'), name='unique_echo_tensor_shape'),
+        ),
+    ]
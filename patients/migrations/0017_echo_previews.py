@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0016_echo_tensors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='kind',
+            field=models.CharField(choices=[('analysis', 'EF analysis'), ('preview', 'Poster and preview clip')], default='analysis', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='echoblob',
+            name='poster',
+            field=models.FileField(blank=True, max_length=255, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='echoblob',
+            name='preview',
+            field=models.FileField(blank=True, max_length=255, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0017_echo_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='mode',
+            field=models.CharField(choices=[('chunked', 'Chunked'), ('direct', 'Direct to storage')], default='chunked', max_length=20),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:12
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # The production settings keep patients.response_cache in a DatabaseCache,
+    # so deploying the migrations is enough to serve cached responses. Skips
+    # tables that exist and caches with other backends.
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0018_direct_uploads'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
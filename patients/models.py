@@ -1,6 +1,12 @@
+import hashlib
 import os
+import uuid
 
-from django.db import models
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 
 from accounts.models import Profile
 
@@ -9,6 +15,125 @@ def echo_upload_path(instance, filename):
     return f'echos/patient_{instance.patient.id}/{instance.diagnosis_date.strftime("%Y-%m-%d")}_{filename}'
 
 
+def echo_blob_path(sha256, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'echos/sha256/{sha256[:2]}/{sha256}{extension}'
+
+
+class EchoBlobManager(models.Manager):
+    def acquire(self, file, filename):
+        """
+        Store ``file`` under its content hash and return the blob with one more
+        reference. Identical bytes are only ever written to storage once.
+
+        Files that were already hashed while being received carry a ``sha256``
+        attribute, which saves reading them again here.
+        """
+        sha256 = getattr(file, 'sha256', None)
+        size = file.size
+        if sha256 is None:
+            digest = hashlib.sha256()
+            for chunk in file.chunks():
+                digest.update(chunk)
+            sha256 = digest.hexdigest()
+
+        with transaction.atomic(savepoint=False):
+            blob = self.select_for_update().filter(sha256=sha256).first()
+            if blob is not None:
+                self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                return blob
+
+        file.seek(0)
+        name = default_storage.save(echo_blob_path(sha256, filename), file)
+        try:
+            with transaction.atomic():
+                return self.create(sha256=sha256, file=name, size=size, ref_count=1)
+        except IntegrityError:
+            # Another upload of the same bytes won the race; keep its copy.
+            default_storage.delete(name)
+            blob = self.get(sha256=sha256)
+            self.add_reference(blob.pk)
+            return blob
+
+    def adopt(self, name, sha256, size):
+        """
+        Return the blob for content already uploaded to storage at ``name``,
+        moving it to its content-addressed name or deleting it if the same
+        bytes are stored already. The blob gets no reference of its own;
+        saving a diagnosis with it adds one.
+        """
+        blob = self.filter(sha256=sha256).first()
+        if blob is not None:
+            default_storage.delete(name)
+            return blob
+
+        stored_name = default_storage.move(name, echo_blob_path(sha256, name))
+        try:
+            with transaction.atomic():
+                return self.create(sha256=sha256, file=stored_name, size=size, ref_count=0)
+        except IntegrityError:
+            # Same bytes adopted concurrently under the same name; keep the file
+            return self.get(sha256=sha256)
+
+    def add_reference(self, blob_id):
+        self.filter(pk=blob_id).update(ref_count=F('ref_count') + 1)
+
+    def release(self, blob_id):
+        """Drop one reference and delete the stored file once none are left."""
+        with transaction.atomic():
+            blob = self.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                self.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            names = [field.name for field in (blob.file, blob.poster, blob.preview) if field]
+            blob.delete()
+            transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+class EchoBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    # Poster frame and low-resolution clip for list screens, see patients.previews
+    poster = models.FileField(max_length=255, blank=True)
+    preview = models.FileField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = EchoBlobManager()
+
+    def __str__(self):
+        return self.sha256
+
+
+def echo_tensor_path(sha256, frames, frame_size):
+    return f'tensors/{sha256[:2]}/{sha256}_{frames}x{frame_size}.npy'
+
+
+class EchoTensor(models.Model):
+    """
+    The decoded, sampled and resized frames of an echo, stored as a ``.npy``
+    array of uint8 grayscale frames shaped (frames, size, size, 1) so that it
+    can be memory-mapped instead of decoding the video again.
+    """
+    blob = models.ForeignKey(EchoBlob, on_delete=models.CASCADE, related_name='tensors')
+    frames = models.PositiveIntegerField()
+    frame_size = models.PositiveIntegerField()
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'frames', 'frame_size'], name='unique_echo_tensor_shape'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob} {self.frames}x{self.frame_size}"
+
+
 class Patient(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
@@ -27,6 +152,12 @@ class Patient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Doctor-scoped patient list, paginated by (created_at, id)
+            models.Index(fields=['doctor', '-created_at', '-id'], name='patient_doctor_created_idx'),
+        ]
+
     def get_age(self):
         if self.date_of_birth:
             return (self.date_of_birth.today() - self.date_of_birth).days // 365
@@ -43,6 +174,17 @@ class Diagnosis(models.Model):
         ('psax', 'PSAX'),
     ]
 
+    ANALYSIS_PENDING = 'pending'
+    ANALYSIS_PROCESSING = 'processing'
+    ANALYSIS_COMPLETED = 'completed'
+    ANALYSIS_FAILED = 'failed'
+    ANALYSIS_STATUS_CHOICES = [
+        (ANALYSIS_PENDING, 'Pending'),
+        (ANALYSIS_PROCESSING, 'Processing'),
+        (ANALYSIS_COMPLETED, 'Completed'),
+        (ANALYSIS_FAILED, 'Failed'),
+    ]
+
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='diagnoses')
     diagnosis_date = models.DateTimeField(auto_now_add=True)
     symptoms = models.TextField(default='')
@@ -51,22 +193,134 @@ class Diagnosis(models.Model):
     notes = models.TextField(blank=True)
     follow_up_date = models.DateField(null=True, blank=True)
     ejection_fraction = models.FloatField(null=True, blank=True, default=0)
-    echocardiogram = models.FileField(upload_to=echo_upload_path, default='')
+    echocardiogram = models.FileField(upload_to=echo_upload_path, default='', max_length=255)
+    echo_blob = models.ForeignKey(EchoBlob, on_delete=models.PROTECT, null=True, blank=True,
+                                  related_name='diagnoses')
+    # Preprocessed frames of the echo, see patients.preprocessing
+    echo_tensor = models.ForeignKey(EchoTensor, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='diagnoses')
+    analysis_status = models.CharField(max_length=20, choices=ANALYSIS_STATUS_CHOICES, default=ANALYSIS_PENDING)
+
+    class Meta:
+        indexes = [
+            # Per-patient diagnosis history, paginated by (diagnosis_date, id)
+            models.Index(fields=['patient', '-diagnosis_date', '-id'], name='diagnosis_patient_date_idx'),
+        ]
 
     def __str__(self):
         return f"Diagnosis for {self.patient} on {self.diagnosis_date.date()}"
 
+    def save(self, *args, **kwargs):
+        # New uploads are stored content-addressed and shared between diagnoses
+        if self.echocardiogram and not self.echocardiogram._committed:
+            previous_blob_id = self.echo_blob_id
+            self.echo_blob = EchoBlob.objects.acquire(self.echocardiogram.file, self.echocardiogram.name)
+            self.echocardiogram.name = self.echo_blob.file.name
+            self.echocardiogram._committed = True
+            super().save(*args, **kwargs)
+            if previous_blob_id:
+                EchoBlob.objects.release(previous_blob_id)
+            return
+
+        if self._state.adding and self.echo_blob_id:
+            EchoBlob.objects.add_reference(self.echo_blob_id)
+            self.echocardiogram.name = self.echo_blob.file.name
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
-        if self.echocardiogram:
-            if os.path.isfile(self.echocardiogram.path):
-                os.remove(self.echocardiogram.path)
+        # Blob-backed echoes are released by the post_delete signal
+        if self.echocardiogram and not self.echo_blob_id:
+            self.echocardiogram.storage.delete(self.echocardiogram.name)
         super().delete(*args, **kwargs)
 
 
 class Interpretation(models.Model):
     diagnosis = models.ForeignKey(Diagnosis, on_delete=models.CASCADE, related_name='interpretations')
     note = models.TextField()
+    # Version of the rule set in patients.interpretation that produced the note
+    rule_version = models.CharField(max_length=20, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['diagnosis', 'created_at'], name='interp_diagnosis_created_idx'),
+        ]
+
     def __str__(self):
         return f"Interpretation for {self.diagnosis} - {self.created_at}"
+
+
+class AnalysisJob(models.Model):
+    STATUS_CHOICES = Diagnosis.ANALYSIS_STATUS_CHOICES
+
+    KIND_ANALYSIS = 'analysis'
+    KIND_PREVIEW = 'preview'
+    KIND_CHOICES = [
+        (KIND_ANALYSIS, 'EF analysis'),
+        (KIND_PREVIEW, 'Poster and preview clip'),
+    ]
+
+    diagnosis = models.ForeignKey(Diagnosis, on_delete=models.CASCADE, related_name='analysis_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_ANALYSIS)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=Diagnosis.ANALYSIS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='analysisjob_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"Analysis job {self.id} for diagnosis {self.diagnosis_id} ({self.status})"
+
+
+class UploadSession(models.Model):
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+
+    # Chunks sent through the API, or one PUT straight to object storage
+    MODE_CHUNKED = 'chunked'
+    MODE_DIRECT = 'direct'
+    MODE_CHOICES = [
+        (MODE_CHUNKED, 'Chunked'),
+        (MODE_DIRECT, 'Direct to storage'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default=MODE_CHUNKED)
+    doctor = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='upload_sessions')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    diagnosis_data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    diagnosis = models.OneToOneField(Diagnosis, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='upload_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, f'{self.id}.part')
+
+    @property
+    def object_name(self):
+        """Where a direct upload is staged in storage until it is finalized."""
+        return f'uploads/{self.id}{os.path.splitext(self.filename)[1].lower()}'
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename} ({self.offset}/{self.size})"
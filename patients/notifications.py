@@ -0,0 +1,231 @@
+"""
+Push notification of finished analyses to waiting requests.
+
+Requests waiting for an analysis (the SSE and long-poll endpoints) subscribe
+to its diagnosis and sleep until the analysis is announced as finished,
+instead of polling the database. Two backends:
+
+``PostgresNotifier``
+    Finishing an analysis sends ``NOTIFY analysis_finished`` inside the same
+    transaction, so it is only delivered once the result is committed. Every
+    web process runs one listener thread with its own connection that wakes
+    the local subscribers, so an analysis finished by a worker on any host
+    reaches every waiting request.
+``LocalNotifier``
+    Wakes subscribers in this process after the commit. Analyses finished in
+    other processes are not seen.
+
+Either way, waiters recheck the database every RECHECK_INTERVAL seconds, so
+a missed notification only delays an answer.
+"""
+import asyncio
+import logging
+import select
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from patients.models import Diagnosis
+
+logger = logging.getLogger(__name__)
+
+FINISHED = {Diagnosis.ANALYSIS_COMPLETED, Diagnosis.ANALYSIS_FAILED}
+
+
+class Subscription:
+    """Wakes one coroutine when any of its diagnoses is announced, from any thread."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # The waiting request is gone along with its event loop
+            pass
+
+    async def wait(self, timeout):
+        """Wait for a notification. Returns False if ``timeout`` seconds passed first."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class LocalNotifier:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, diagnosis_ids):
+        """Announce the diagnoses as finished once the current transaction commits."""
+        diagnosis_ids = list(diagnosis_ids)
+        transaction.on_commit(lambda: self.dispatch(diagnosis_ids))
+
+    def dispatch(self, diagnosis_ids):
+        with self._lock:
+            subscriptions = set().union(*(self._subscriptions.get(i, ()) for i in diagnosis_ids))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def dispatch_all(self):
+        with self._lock:
+            subscriptions = set().union(*self._subscriptions.values())
+        for subscription in subscriptions:
+            subscription.notify()
+
+    @contextmanager
+    def subscribe(self, diagnosis_id):
+        """Subscribe the running coroutine to the diagnosis for the duration of the block."""
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[diagnosis_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscriptions[diagnosis_id]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[diagnosis_id]
+
+    def close(self):
+        pass
+
+
+class PostgresNotifier(LocalNotifier):
+    """
+    ``LocalNotifier`` fed by LISTEN/NOTIFY. The listener thread starts with
+    the first subscription and reconnects after errors, waking everyone
+    since notifications may have been missed meanwhile. Needs psycopg2.
+    """
+    channel = 'analysis_finished'
+    # NOTIFY payloads are limited to 8000 bytes
+    ids_per_notification = 500
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, poll_timeout=5, reconnect_delay=2):
+        super().__init__()
+        self.using = using
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._listener = None
+        self._stopped = threading.Event()
+
+    def publish(self, diagnosis_ids):
+        diagnosis_ids = [str(diagnosis_id) for diagnosis_id in diagnosis_ids]
+        with connections[self.using].cursor() as cursor:
+            for start in range(0, len(diagnosis_ids), self.ids_per_notification):
+                payload = ','.join(diagnosis_ids[start:start + self.ids_per_notification])
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    @contextmanager
+    def subscribe(self, diagnosis_id):
+        self._start_listener()
+        with super().subscribe(diagnosis_id) as subscription:
+            yield subscription
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is None and not self._stopped.is_set():
+                self._listener = threading.Thread(target=self._listen, name='analysis-notifications', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            connection = connections.create_connection(self.using)
+            try:
+                connection.ensure_connection()
+                raw = connection.connection
+                with raw.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                self.dispatch_all()
+
+                while not self._stopped.is_set():
+                    if not select.select([raw], [], [], self.poll_timeout)[0]:
+                        continue
+                    raw.poll()
+                    diagnosis_ids = []
+                    while raw.notifies:
+                        payload = raw.notifies.pop(0).payload
+                        diagnosis_ids.extend(int(diagnosis_id) for diagnosis_id in payload.split(',') if diagnosis_id)
+                    self.dispatch(diagnosis_ids)
+            except Exception:
+                logger.exception("Analysis notification listener failed, reconnecting in %ss", self.reconnect_delay)
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                connection.close()
+
+    def close(self):
+        self._stopped.set()
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """
+    Return the process-wide notifier selected by
+    ``ANALYSIS_NOTIFICATIONS['BACKEND']``: ``'postgres'``, ``'local'``, or
+    ``'auto'`` for postgres on a PostgreSQL database.
+    """
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                backend = settings.ANALYSIS_NOTIFICATIONS['BACKEND']
+                if backend == 'auto':
+                    backend = 'postgres' if connections[DEFAULT_DB_ALIAS].vendor == 'postgresql' else 'local'
+                if backend == 'postgres':
+                    _notifier = PostgresNotifier()
+                elif backend == 'local':
+                    _notifier = LocalNotifier()
+                else:
+                    raise ImproperlyConfigured(f"Unknown ANALYSIS_NOTIFICATIONS BACKEND {backend!r}")
+    return _notifier
+
+
+def notify_analysis_finished(diagnosis_ids):
+    """Wake requests waiting for these diagnoses when the current transaction commits."""
+    if diagnosis_ids:
+        get_notifier().publish(diagnosis_ids)
+
+
+async def wait_for_analysis(diagnosis_id, timeout):
+    """
+    Wait up to ``timeout`` seconds for the diagnosis' analysis to complete or
+    fail. Returns its analysis status, or ``None`` if it was deleted.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    recheck_interval = settings.ANALYSIS_NOTIFICATIONS['RECHECK_INTERVAL']
+    statuses = Diagnosis.objects.filter(id=diagnosis_id).values_list('analysis_status', flat=True)
+
+    # Subscribed before reading the status, so a finish in between is not missed
+    with get_notifier().subscribe(diagnosis_id) as subscription:
+        while True:
+            status = await statuses.afirst()
+            remaining = deadline - loop.time()
+            if status in FINISHED or status is None or remaining <= 0:
+                return status
+            await subscription.wait(min(remaining, recheck_interval))
+
+
+def reset_notifier(**kwargs):
+    global _notifier
+    if kwargs.get('setting', 'ANALYSIS_NOTIFICATIONS') in ('ANALYSIS_NOTIFICATIONS', 'DATABASES'):
+        if _notifier is not None:
+            _notifier.close()
+        _notifier = None
+
+
+setting_changed.connect(reset_notifier)
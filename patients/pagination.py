@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PatientCursorPagination(CursorPagination):
+    """Keyset pagination over a doctor's patients, newest first."""
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class DiagnosisCursorPagination(CursorPagination):
+    """Keyset pagination over a patient's diagnoses, most recent first."""
+    ordering = ('-diagnosis_date', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
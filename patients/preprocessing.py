@@ -0,0 +1,136 @@
+"""
+Echo preprocessing.
+
+Each stored echo is decoded once into the model's input shape and kept as a
+memory-mappable ``.npy`` file (see ``EchoTensor``). Diagnoses sharing an echo
+share its tensor, and re-analysing with a new model version reads the
+tensor instead of decoding the video again.
+"""
+import logging
+import os
+import uuid
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+from fyp_backend.storage import local_copy
+from patients.models import Diagnosis, EchoBlob, EchoTensor, echo_tensor_path
+from patients.response_cache import bump_blob
+from patients.uploads import PartFile
+
+logger = logging.getLogger(__name__)
+
+
+def input_shape():
+    """Return ``(frames, frame_size)`` of the local model's input."""
+    config = settings.INFERENCE_SERVICE
+    return config['LOCAL_FRAMES'], config['LOCAL_FRAME_SIZE']
+
+
+def decode_to_file(video_path, out_path, frames, frame_size):
+    """Decode a video into a uint8 ``.npy`` tensor at ``out_path``. Safe to run in a worker process."""
+    import numpy as np
+
+    from patients.local_inference import read_frames
+
+    np.save(out_path, read_frames(video_path, frames, frame_size))
+    return os.path.getsize(out_path)
+
+
+def _decode(args):
+    try:
+        return decode_to_file(*args)
+    except Exception as e:
+        return e
+
+
+def _decode_all(blobs, frames, frame_size, executor, concurrency):
+    """
+    Decode ``blobs`` on ``executor`` and yield ``(blob, out_path, result)``
+    in order. Remote echoes are downloaded one by one as decoding proceeds,
+    so at most ``concurrency`` local copies exist at a time.
+    """
+    temp_dir = settings.ECHO_UPLOAD_TEMP_DIR
+    os.makedirs(temp_dir, exist_ok=True)
+    pending = deque()
+
+    def finish():
+        blob, out_path, copy, work = pending.popleft()
+        with copy:
+            result = work.result() if executor else _decode(work)
+        return blob, out_path, result
+
+    try:
+        for blob in blobs:
+            copy = ExitStack()
+            with copy:
+                args = (copy.enter_context(local_copy(blob.file.name)),
+                        os.path.join(temp_dir, f'{uuid.uuid4().hex}.npy'), frames, frame_size)
+                pending.append((blob, args[1], copy.pop_all(), executor.submit(_decode, args) if executor else args))
+            if len(pending) >= concurrency:
+                yield finish()
+        while pending:
+            yield finish()
+    finally:
+        for _, _, copy, _ in pending:
+            copy.close()
+
+
+def preprocess(diagnoses, frames=None, frame_size=None, executor=None, concurrency=1):
+    """
+    Link every diagnosis in ``diagnoses`` to a tensor of the given shape,
+    decoding each distinct echo at most once. Decoding runs on ``executor``
+    when one is given, with up to ``concurrency`` echoes in flight. Returns
+    ``(created, failed)`` counts of tensors.
+    """
+    default_frames, default_size = input_shape()
+    frames = frames or default_frames
+    frame_size = frame_size or default_size
+
+    blob_ids = {diagnosis.echo_blob_id for diagnosis in diagnoses if diagnosis.echo_blob_id}
+    tensors = {
+        tensor.blob_id: tensor
+        for tensor in EchoTensor.objects.filter(blob_id__in=blob_ids, frames=frames, frame_size=frame_size)
+    }
+    missing = list(EchoBlob.objects.filter(id__in=blob_ids - tensors.keys()))
+
+    created = failed = 0
+    for blob, out_path, result in _decode_all(missing, frames, frame_size, executor, max(concurrency, 1)):
+        if isinstance(result, Exception):
+            logger.warning("Could not preprocess echo %s: %s", blob.sha256, result)
+            failed += 1
+            continue
+        try:
+            tensors[blob.id] = _store(blob, out_path, frames, frame_size, result)
+            created += 1
+        finally:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+    for blob_id, tensor in tensors.items():
+        Diagnosis.objects.filter(echo_blob_id=blob_id).exclude(echo_tensor=tensor).update(echo_tensor=tensor)
+        bump_blob(blob_id)
+    for diagnosis in diagnoses:
+        if diagnosis.echo_blob_id in tensors:
+            diagnosis.echo_tensor = tensors[diagnosis.echo_blob_id]
+    return created, failed
+
+
+def _store(blob, path, frames, frame_size, size):
+    name = echo_tensor_path(blob.sha256, frames, frame_size)
+    # A leftover file from an interrupted run would make storage pick another name
+    default_storage.delete(name)
+    with open(path, 'rb') as tensor_file:
+        name = default_storage.save(name, PartFile(tensor_file, name=name))
+    try:
+        with transaction.atomic():
+            return EchoTensor.objects.create(blob=blob, frames=frames, frame_size=frame_size, file=name, size=size)
+    except IntegrityError:
+        # Preprocessed concurrently; keep the other run's copy
+        tensor = EchoTensor.objects.get(blob=blob, frames=frames, frame_size=frame_size)
+        if tensor.file.name != name:
+            default_storage.delete(name)
+        return tensor
@@ -0,0 +1,130 @@
+"""
+Poster frames and preview clips for echoes.
+
+List screens show a JPEG poster frame and a short, small clip instead of
+downloading the full echocardiogram. Both are rendered once per stored echo
+by the job worker (``AnalysisJob.KIND_PREVIEW``) and shared by every
+diagnosis that references it. cv2 is imported only when rendering.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from fyp_backend.storage import local_copy
+from patients.models import EchoBlob
+from patients.response_cache import bump_blob
+
+
+def poster_path(sha256):
+    return f'previews/{sha256[:2]}/{sha256}_poster.jpg'
+
+
+def preview_path(sha256, extension):
+    return f'previews/{sha256[:2]}/{sha256}_preview{extension}'
+
+
+def _scaled(frame, width):
+    import cv2
+
+    height, original_width = frame.shape[:2]
+    if original_width <= width:
+        return frame
+    # Codecs need even dimensions
+    height = max(2, int(height * width / original_width) // 2 * 2)
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def render_poster(video_path, width, quality):
+    """Return the JPEG bytes of the middle frame of the video, scaled down to ``width``."""
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.set(cv2.CAP_PROP_POS_FRAMES, max(total // 2, 0))
+        ok, frame = capture.read()
+        if not ok:
+            raise ValueError(f"Could not read a frame from {os.path.basename(video_path)}")
+    finally:
+        capture.release()
+
+    ok, jpeg = cv2.imencode('.jpg', _scaled(frame, width), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode the poster frame")
+    return jpeg.tobytes()
+
+
+def render_preview(video_path, out_path, width, seconds, fps, codec):
+    """Write the first ``seconds`` of the video to ``out_path`` at ``fps`` and ``width``."""
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    writer = None
+    try:
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or fps
+        step = max(source_fps / fps, 1.0)
+        wanted = 0.0
+        index = written = 0
+        while written < seconds * fps:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if index >= wanted:
+                frame = _scaled(frame, width)
+                if writer is None:
+                    height, frame_width = frame.shape[:2]
+                    writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*codec), fps, (frame_width, height))
+                writer.write(frame)
+                written += 1
+                wanted += step
+            index += 1
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+
+    if not written:
+        raise ValueError(f"Could not read any frames from {os.path.basename(video_path)}")
+
+
+def generate_previews(blob):
+    """Render and store the poster and preview clip of ``blob`` unless it already has them."""
+    blob.refresh_from_db(fields=['poster', 'preview'])
+    if blob.poster and blob.preview:
+        return blob
+
+    with local_copy(blob.file.name) as video_path:
+        updates = _render(blob, video_path)
+
+    EchoBlob.objects.filter(pk=blob.pk).update(**updates)
+    bump_blob(blob.pk)
+    for field, name in updates.items():
+        setattr(blob, field, name)
+    return blob
+
+
+def _render(blob, video_path):
+    config = settings.ECHO_PREVIEW
+    updates = {}
+
+    if not blob.poster:
+        poster = render_poster(video_path, config['POSTER_WIDTH'], config['POSTER_QUALITY'])
+        updates['poster'] = default_storage.save(poster_path(blob.sha256), ContentFile(poster))
+
+    if not blob.preview:
+        temp_dir = settings.ECHO_UPLOAD_TEMP_DIR
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, out_path = tempfile.mkstemp(suffix=config['CLIP_EXTENSION'], dir=temp_dir)
+        os.close(fd)
+        try:
+            render_preview(video_path, out_path, config['CLIP_WIDTH'], config['CLIP_SECONDS'],
+                           config['CLIP_FPS'], config['CLIP_CODEC'])
+            with open(out_path, 'rb') as clip:
+                updates['preview'] = default_storage.save(
+                    preview_path(blob.sha256, config['CLIP_EXTENSION']), ContentFile(clip.read()))
+        finally:
+            os.remove(out_path)
+    return updates
@@ -0,0 +1,138 @@
+"""
+Per-doctor cache of GET response data, with ETags.
+
+Cached responses are keyed by the doctor's cache version, which is replaced
+whenever one of their patients, diagnoses or interpretations changes: by
+the signals in ``patients.signals`` for model saves and deletes, and by
+explicit ``bump_*`` calls next to the queryset updates and bulk writes that
+send no signals. Outdated entries are then never read again and simply
+expire. Every change to the data behind a response must bump the version.
+
+Versions live in the same cache as the entries, so processes that do not
+share the cache backend never see each other's invalidations; analyses,
+for one, finish in the separate job worker. Only a single process may use
+a local-memory cache.
+
+Versions are random tokens, not counters, so a version evicted from the
+cache can never come back and revive old entries. Each bump is repeated
+when the transaction commits, so a response computed from data read
+before the commit cannot be stored under the new version.
+
+Responses carry an ETag of their rendered content, and ``If-None-Match``
+gets a 304 whether the response came from the cache or not.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from patients.models import Diagnosis, Patient
+
+CACHE_ALIAS = 'responses'
+GLOBAL_VERSION_KEY = 'responses:version'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _doctor_version_key(doctor_id):
+    return f'responses:doctor:{doctor_id}:version'
+
+
+def _versions(doctor_id):
+    cache = _cache()
+    keys = [GLOBAL_VERSION_KEY, _doctor_version_key(doctor_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() so that concurrent requests agree on one version
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def cache_key(request):
+    """Key of the response to ``request`` for its doctor's current data."""
+    doctor_id = request.user.profile.id
+    url = f'{request.accepted_renderer.format}:{request.build_absolute_uri()}'
+    digest = hashlib.sha256(url.encode()).hexdigest()
+    return f'responses:{doctor_id}:{":".join(_versions(doctor_id))}:{digest}'
+
+
+def _set_versions(keys):
+    _cache().set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def _bump(keys):
+    if not keys:
+        return
+    _set_versions(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _set_versions(keys))
+
+
+def bump_doctors(doctor_ids):
+    """Invalidate every cached response of these doctors."""
+    _bump([_doctor_version_key(doctor_id) for doctor_id in set(doctor_ids) if doctor_id is not None])
+
+
+def bump_diagnoses(diagnoses):
+    """Invalidate the cached responses of the doctors of these diagnoses."""
+    doctor_ids = {diagnosis.patient.doctor_id for diagnosis in diagnoses if Diagnosis.patient.is_cached(diagnosis)}
+    patient_ids = {diagnosis.patient_id for diagnosis in diagnoses if not Diagnosis.patient.is_cached(diagnosis)}
+    if patient_ids:
+        doctor_ids.update(Patient.objects.filter(id__in=patient_ids).values_list('doctor_id', flat=True))
+    bump_doctors(doctor_ids)
+
+
+def bump_diagnosis_ids(diagnosis_ids):
+    bump_doctors(Patient.objects.filter(diagnoses__id__in=diagnosis_ids).values_list('doctor_id', flat=True))
+
+
+def bump_blob(blob_id):
+    """Invalidate the cached responses of every doctor with a diagnosis of this echo."""
+    bump_doctors(Patient.objects.filter(diagnoses__echo_blob_id=blob_id).values_list('doctor_id', flat=True))
+
+
+def bump_all():
+    """Invalidate every cached response, e.g. after a data migration."""
+    _bump([GLOBAL_VERSION_KEY])
+
+
+class CachedResponseMixin:
+    """
+    Serves GETs of a doctor-scoped DRF view from the response cache and
+    answers ``If-None-Match`` with 304. Only 200 responses are cached, as
+    their data, so that only rendering is repeated.
+    """
+
+    def get(self, request, *args, **kwargs):
+        request.response_cache_key = cache_key(request)
+        cached = _cache().get(request.response_cache_key)
+        if cached is None:
+            return super().get(request, *args, **kwargs)
+
+        data, etag = cached
+        response = Response(data, headers={'ETag': etag})
+        response.from_cache = True
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method != 'GET' or response.status_code != status.HTTP_200_OK:
+            return response
+
+        if not getattr(response, 'from_cache', False):
+            response.render()
+            response['ETag'] = quote_etag(hashlib.sha256(response.content).hexdigest()[:32])
+            _cache().set(request.response_cache_key, (response.data, response['ETag']))
+
+        # Clients revalidate with the ETag; shared caches must not keep per-doctor data
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization', 'Cookie'])
+        return get_conditional_response(request, etag=response['ETag'], response=response)
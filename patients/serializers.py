@@ -1,6 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from patients.models import Patient, Diagnosis, Interpretation
+from patients.models import Patient, Diagnosis, Interpretation, EchoBlob, UploadSession
 
 
 class PatientSerializer(serializers.ModelSerializer):
@@ -9,18 +10,125 @@ class PatientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class PatientListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Patient
+        fields = ['id', 'full_name', 'patient_id', 'gender', 'date_of_birth', 'created_at']
+
+
 class InterpretationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Interpretation
         fields = ['id', 'note', 'created_at']
 
 
-class DiagnosisSerializer(serializers.ModelSerializer):
+class EchoPreviewMixin:
+    """URLs of the poster frame and preview clip of the diagnosis' echo, once rendered."""
+
+    def _preview_url(self, diagnosis, field):
+        file = getattr(diagnosis.echo_blob, field) if diagnosis.echo_blob_id else None
+        if not file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(file.url) if request else file.url
+
+    def get_poster_url(self, diagnosis):
+        return self._preview_url(diagnosis, 'poster')
+
+    def get_preview_url(self, diagnosis):
+        return self._preview_url(diagnosis, 'preview')
+
+
+class DiagnosisSerializer(EchoPreviewMixin, serializers.ModelSerializer):
     interpretations = InterpretationSerializer(many=True, read_only=True)
-    echocardiogram = serializers.FileField(required=True)
+    echocardiogram = serializers.FileField(required=False)
+    echo_sha256 = serializers.CharField(write_only=True, required=False, min_length=64, max_length=64)
     patient = serializers.PrimaryKeyRelatedField(read_only=True)
     diagnosis_date = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", required=False)
+    poster_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Diagnosis
         fields = '__all__'
+        read_only_fields = ['analysis_status', 'echo_blob', 'echo_tensor']
+
+    def validate(self, attrs):
+        sha256 = attrs.pop('echo_sha256', None)
+        if attrs.get('echocardiogram'):
+            return attrs
+        if not sha256:
+            raise serializers.ValidationError({'echocardiogram': 'This field is required.'})
+
+        # Re-use an echo this doctor already uploaded instead of sending the bytes again
+        blob = EchoBlob.objects.filter(
+            sha256=sha256.lower(),
+            diagnoses__patient__doctor=self.context['request'].user.profile,
+        ).first()
+        if blob is None:
+            raise serializers.ValidationError({'echo_sha256': 'Unknown echo, upload the file instead.'})
+        attrs['echo_blob'] = blob
+        return attrs
+
+
+class DiagnosisListSerializer(EchoPreviewMixin, serializers.ModelSerializer):
+    """Compact representation used by the diagnosis list; see DiagnosisSerializer for details."""
+    diagnosis_date = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    poster_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Diagnosis
+        fields = ['id', 'patient', 'diagnosis_date', 'view_type', 'ejection_fraction', 'analysis_status',
+                  'follow_up_date', 'echocardiogram', 'poster_url', 'preview_url']
+        # Columns the list view loads
+        columns = ['id', 'patient', 'diagnosis_date', 'view_type', 'ejection_fraction', 'analysis_status',
+                   'follow_up_date', 'echocardiogram', 'echo_blob', 'echo_blob__poster', 'echo_blob__preview']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    symptoms = serializers.CharField(write_only=True, required=False, allow_blank=True)
+    view_type = serializers.ChoiceField(choices=Diagnosis.VIEW_CHOICES, write_only=True, required=False)
+    prescription = serializers.CharField(write_only=True, required=False, allow_blank=True)
+    notes = serializers.CharField(write_only=True, required=False, allow_blank=True)
+    follow_up_date = serializers.DateField(write_only=True, required=False, allow_null=True)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+
+    DIAGNOSIS_FIELDS = ['symptoms', 'view_type', 'prescription', 'notes', 'follow_up_date']
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'offset', 'sha256', 'status', 'diagnosis', 'created_at',
+                  'symptoms', 'view_type', 'prescription', 'notes', 'follow_up_date']
+        read_only_fields = ['offset', 'status', 'diagnosis', 'created_at']
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Upload size must be positive.")
+        if value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Uploads are limited to {settings.UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+    def create(self, validated_data):
+        diagnosis_data = {
+            field: validated_data.pop(field)
+            for field in self.DIAGNOSIS_FIELDS
+            if field in validated_data
+        }
+        if diagnosis_data.get('follow_up_date'):
+            diagnosis_data['follow_up_date'] = diagnosis_data['follow_up_date'].isoformat()
+        validated_data['sha256'] = validated_data.get('sha256', '').lower()
+        return super().create({**validated_data, 'diagnosis_data': diagnosis_data})
+
+
+class DirectUploadSerializer(UploadSessionSerializer):
+    """An upload the client sends straight to object storage; the hash is required to verify it."""
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+    content_type = serializers.ChoiceField(choices=settings.ECHO_CONTENT_TYPES)
+
+    class Meta(UploadSessionSerializer.Meta):
+        fields = UploadSessionSerializer.Meta.fields + ['mode', 'content_type']
+        read_only_fields = UploadSessionSerializer.Meta.read_only_fields + ['mode']
+
+    def create(self, validated_data):
+        return super().create({**validated_data, 'mode': UploadSession.MODE_DIRECT})
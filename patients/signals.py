@@ -0,0 +1,41 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from patients.models import Diagnosis, EchoBlob, EchoTensor, Interpretation, Patient
+from patients.response_cache import bump_diagnoses, bump_diagnosis_ids, bump_doctors
+
+
+@receiver(post_delete, sender=Diagnosis)
+def release_echo_blob(sender, instance, **kwargs):
+    # Also runs for diagnoses removed by a cascading patient delete
+    if instance.echo_blob_id:
+        EchoBlob.objects.release(instance.echo_blob_id)
+
+
+@receiver(post_delete, sender=EchoTensor)
+def delete_echo_tensor_file(sender, instance, **kwargs):
+    # Tensors are deleted along with their blob
+    name = instance.file.name
+    transaction.on_commit(lambda: default_storage.delete(name))
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def invalidate_patient_responses(sender, instance, **kwargs):
+    bump_doctors([instance.doctor_id])
+
+
+@receiver([post_save, post_delete], sender=Diagnosis)
+def invalidate_diagnosis_responses(sender, instance, origin=None, **kwargs):
+    # Diagnoses deleted with their patient are covered by the patient's signal
+    if not isinstance(origin, Patient):
+        bump_diagnoses([instance])
+
+
+# Not on delete: interpretations go with their diagnosis or in
+# reinterpret_diagnoses, which invalidates itself, and a receiver would stop
+# Django from deleting them in bulk
+@receiver(post_save, sender=Interpretation)
+def invalidate_interpretation_responses(sender, instance, **kwargs):
+    bump_diagnosis_ids([instance.diagnosis_id])
@@ -0,0 +1,403 @@
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from email.parser import BytesParser
+
+import httpx
+import pytest
+import requests
+
+from patients.analysis import get_demographics
+from patients.inference import (
+    AsyncInferenceClient, CircuitBreaker, InferenceClient, InferenceError, InferenceUnavailable, MultipartBody,
+    ThreadedInference, _async_clients, get_async_client, get_client,
+)
+from patients.local_inference import LocalInferenceEngine, demographic_features
+from patients.models import Patient
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload or {}
+
+    def json(self):
+        return self.payload
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(responses, **kwargs):
+    client = InferenceClient('http://model.test/predict', backoff_factor=0, **kwargs)
+    calls = []
+
+    def post(url, **request):
+        calls.append(parse_multipart(request))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client.session.post = post
+    return client, calls
+
+
+def parse_multipart(request):
+    """Reads the streamed body back into ``{'timeout', 'data', 'files'}``"""
+    body = request['data']
+    raw = body.read(7)
+    raw += body.read()
+    assert len(raw) == len(body)
+
+    headers = f"Content-Type: {request['headers']['Content-Type']}\r\n\r\n".encode()
+    message = BytesParser().parsebytes(headers + raw)
+    data, files = {}, []
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        if part.get_filename():
+            files.append((name, part.get_payload(decode=True)))
+        else:
+            data[name] = part.get_payload()
+    return {'timeout': request['timeout'], 'data': data, 'files': files}
+
+
+def echo_file():
+    video = io.BytesIO(b"echo bytes")
+    video.name = 'echos/patient_1/echo.avi'
+    return video
+
+
+class TestInferenceClient:
+    """Tests for the pooled inference HTTP client"""
+
+    def test_prediction_uses_configured_timeouts(self):
+        """Ensures every call is bounded by the connect/read timeouts"""
+        client, calls = make_client([FakeResponse(200, {'ef_prediction': 55.5})],
+                                    connect_timeout=2, read_timeout=30)
+
+        ef = client.predict(echo_file(), 'a4c', {'age': 40})
+
+        assert ef == 55.5
+        assert calls[0]['timeout'] == (2, 30)
+        assert calls[0]['data']['view'] == 'a4c'
+
+    def test_transient_errors_are_retried(self):
+        """Ensures connection errors and 5xx responses are retried with the file rewound"""
+        client, calls = make_client([
+            requests.ConnectionError("reset"),
+            FakeResponse(503),
+            FakeResponse(200, {'ef_prediction': 60}),
+        ])
+        video = echo_file()
+
+        assert client.predict(video, 'a4c', {}) == 60
+        assert len(calls) == 3
+        assert calls[2]['files'] == [('video', b"echo bytes")]
+
+    def test_video_is_streamed_in_blocks(self):
+        """Ensures the request body is produced from the file in bounded reads"""
+        class CountingFile(io.BytesIO):
+            largest_read = 0
+
+            def read(self, size=-1):
+                self.largest_read = max(self.largest_read, size)
+                return super().read(size)
+
+        video = CountingFile(b"x" * 100000)
+        body = MultipartBody([('view', 'a4c')], [('video', ('echo.avi', video))])
+
+        while body.read(8192):
+            pass
+
+        assert video.largest_read <= 8192
+
+    def test_retries_are_bounded(self):
+        """Ensures the client gives up after max_retries"""
+        client, calls = make_client([FakeResponse(502)] * 3, max_retries=2)
+
+        with pytest.raises(InferenceUnavailable):
+            client.predict(echo_file(), 'a4c', {})
+        assert len(calls) == 3
+
+    def test_client_errors_are_not_retried(self):
+        """Ensures a rejected request surfaces the API detail immediately"""
+        client, calls = make_client([FakeResponse(422, {'detail': 'Invalid video'})])
+
+        with pytest.raises(InferenceError, match='Invalid video'):
+            client.predict(echo_file(), 'a4c', {})
+        assert len(calls) == 1
+
+    def test_batch_prediction_sends_one_request(self):
+        """Ensures a batch goes out as one multipart request with per-item results"""
+        client, calls = make_client([FakeResponse(200, {'predictions': [
+            {'ef_prediction': 52},
+            {'detail': 'Unreadable video'},
+        ]})])
+
+        results = client.predict_batch([(echo_file(), 'a4c', {'age': 1}), (echo_file(), 'psax', {'age': 2})])
+
+        assert len(calls) == 1
+        assert [name for name, _ in calls[0]['files']] == ['videos', 'videos']
+        assert results[0] == 52
+        assert isinstance(results[1], InferenceError)
+
+    def test_batch_prediction_rejects_mismatched_response(self):
+        client, _ = make_client([FakeResponse(200, {'predictions': [{'ef_prediction': 52}]})])
+
+        with pytest.raises(InferenceError):
+            client.predict_batch([(echo_file(), 'a4c', {}), (echo_file(), 'a4c', {})])
+
+    def test_backoff_is_capped(self):
+        client = InferenceClient('http://model.test/predict', backoff_factor=1, backoff_max=5)
+        assert [client.backoff(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+class TestAsyncInferenceClient:
+    """Tests for the httpx client used by the async views"""
+
+    def make_client(self, responses, **kwargs):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        client = AsyncInferenceClient('http://model.test/predict', backoff_factor=0,
+                                      transport=httpx.MockTransport(handler), **kwargs)
+        return client, calls
+
+    def test_prediction_is_awaited(self):
+        client, calls = self.make_client([httpx.Response(200, json={'ef_prediction': 55.5})])
+
+        ef = asyncio.run(client.predict(echo_file(), 'a4c', {'age': 40}))
+
+        assert ef == 55.5
+        body = calls[0].read()
+        assert b'name="view"' in body and b'echo bytes' in body
+        assert b'filename="echo.avi"' in body
+
+    def test_transient_errors_are_retried(self):
+        """Ensures connection errors and 5xx responses are retried with the file rewound"""
+        client, calls = self.make_client([
+            httpx.ConnectError("reset"),
+            httpx.Response(503),
+            httpx.Response(200, json={'ef_prediction': 60}),
+        ])
+
+        assert asyncio.run(client.predict(echo_file(), 'a4c', {})) == 60
+        assert len(calls) == 3
+        assert b'echo bytes' in calls[2].read()
+
+    def test_retries_are_bounded(self):
+        client, calls = self.make_client([httpx.ConnectTimeout("slow")] * 3, max_retries=2)
+
+        with pytest.raises(InferenceUnavailable):
+            asyncio.run(client.predict(echo_file(), 'a4c', {}))
+        assert len(calls) == 3
+
+    def test_client_errors_are_not_retried(self):
+        client, calls = self.make_client([httpx.Response(422, json={'detail': 'Invalid video'})])
+
+        with pytest.raises(InferenceError, match='Invalid video'):
+            asyncio.run(client.predict(echo_file(), 'a4c', {}))
+        assert len(calls) == 1
+
+    def test_batch_prediction_sends_one_request(self):
+        client, calls = self.make_client([httpx.Response(200, json={'predictions': [
+            {'ef_prediction': 52},
+            {'detail': 'Unreadable video'},
+        ]})])
+
+        results = asyncio.run(client.predict_batch([(echo_file(), 'a4c', {}), (echo_file(), 'psax', {})]))
+
+        assert len(calls) == 1
+        assert str(calls[0].url) == 'http://model.test/predict/batch'
+        assert results[0] == 52
+        assert isinstance(results[1], InferenceError)
+
+    def test_open_circuit_rejects_calls(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        client, calls = self.make_client([httpx.ConnectError("down")], max_retries=5, breaker=breaker)
+
+        with pytest.raises(InferenceUnavailable, match='circuit is open'):
+            asyncio.run(client.predict(echo_file(), 'a4c', {}))
+        assert len(calls) == 1
+
+    def test_cancelled_trial_releases_the_circuit(self):
+        """Ensures a half-open trial cancelled by the caller's timeout does not keep the circuit open"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now = 10
+
+        async def slow(request):
+            await asyncio.sleep(10)
+
+        client = AsyncInferenceClient('http://model.test/predict', breaker=breaker,
+                                      transport=httpx.MockTransport(slow))
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(client.predict(echo_file(), 'a4c', {}), 0.05))
+
+        assert breaker.allow_request()
+
+    def test_backend_follows_settings(self, settings):
+        """Ensures the remote service gets the httpx client and blocking backends run on a thread"""
+        async def backend():
+            return get_async_client()
+
+        settings.INFERENCE_SERVICE = {**settings.INFERENCE_SERVICE, 'BACKEND': 'remote'}
+        assert isinstance(asyncio.run(backend()), AsyncInferenceClient)
+
+        settings.INFERENCE_SERVICE = {**settings.INFERENCE_SERVICE, 'BACKEND': 'local', 'LOCAL_WORKERS': 1}
+        threaded = asyncio.run(backend())
+        assert isinstance(threaded, ThreadedInference)
+        assert isinstance(threaded.client, LocalInferenceEngine)
+
+    def test_clients_close_with_their_loop_and_share_a_breaker(self, settings):
+        """Ensures the per-request loops of async views under WSGI leave no open client behind"""
+        settings.INFERENCE_SERVICE = {**settings.INFERENCE_SERVICE, 'BACKEND': 'remote'}
+
+        async def backend():
+            client = get_async_client()
+            assert get_async_client() is client
+            return client
+
+        first, second = asyncio.run(backend()), asyncio.run(backend())
+
+        assert first is not second
+        assert first.client.is_closed and second.client.is_closed
+        assert first.breaker is second.breaker is get_client().breaker
+        assert not _async_clients
+
+
+class TestCircuitBreaker:
+    """Tests for failing fast when the model server is down"""
+
+    def test_open_circuit_rejects_calls_without_network(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        client, calls = make_client([requests.ConnectionError("down")] * 2, max_retries=5, breaker=breaker)
+
+        with pytest.raises(InferenceUnavailable, match='circuit is open'):
+            client.predict(echo_file(), 'a4c', {})
+        assert len(calls) == 2
+
+    def test_half_open_trial_closes_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        assert not breaker.allow_request()
+
+        clock.now = 10
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_unexpected_error_in_trial_releases_the_circuit(self):
+        """Ensures a half-open trial broken on this side lets the next call through"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now = 10
+        client, calls = make_client([InferenceError("Echo file ended before its reported size"),
+                                     FakeResponse(200, {'ef_prediction': 58})], breaker=breaker)
+
+        with pytest.raises(InferenceError, match='ended before'):
+            client.predict(echo_file(), 'a4c', {})
+
+        assert client.predict(echo_file(), 'a4c', {}) == 58
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_failed_trial_reopens_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+        for _ in range(3):
+            breaker.record_failure()
+
+        clock.now = 10
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+class TestLocalInferenceEngine:
+    """Tests for the in-process inference backend"""
+
+    def test_backend_is_selected_in_settings(self, settings):
+        settings.INFERENCE_SERVICE = {**settings.INFERENCE_SERVICE, 'BACKEND': 'local', 'LOCAL_WORKERS': 2}
+        engine = get_client()
+
+        assert isinstance(engine, LocalInferenceEngine)
+        assert engine.workers == 2
+        assert engine.max_pending == 4
+
+    def test_workers_receive_a_path_not_the_video(self, monkeypatch):
+        seen = []
+
+        def fake_run(path, view, demographics, frames, size):
+            with open(path, 'rb') as f:
+                seen.append(f.read())
+            return 61.5
+
+        monkeypatch.setattr('patients.local_inference._run', fake_run)
+        engine = LocalInferenceEngine('model.keras', workers=1, executor=ThreadPoolExecutor(1))
+
+        assert engine.predict(echo_file(), 'a4c', {'age': 40}) == 61.5
+        assert seen == [b"echo bytes"]
+
+    def test_batch_reports_failures_per_item(self, monkeypatch):
+        def fake_run(path, view, demographics, frames, size):
+            if view == 'psax':
+                raise ValueError("Could not read any frames")
+            return 55.0
+
+        monkeypatch.setattr('patients.local_inference._run', fake_run)
+        engine = LocalInferenceEngine('model.keras', workers=2, executor=ThreadPoolExecutor(2))
+
+        results = engine.predict_batch([(echo_file(), 'a4c', {}), (echo_file(), 'psax', {})])
+
+        assert results[0] == 55.0
+        assert isinstance(results[1], InferenceError)
+
+    def test_features_describe_the_patient(self):
+        patient = Patient(gender='F', date_of_birth=date(1980, 6, 1), weight=62.5, height=168)
+
+        features = demographic_features(get_demographics(patient))
+
+        assert features == [float(patient.get_age()), 0.0, 62.5, 168.0]
+
+    def test_full_queue_rejects_work(self, monkeypatch):
+        release = threading.Event()
+        monkeypatch.setattr('patients.local_inference._run', lambda *args: release.wait(5) and 50.0)
+        engine = LocalInferenceEngine('model.keras', workers=1, max_pending=1, queue_timeout=0.01,
+                                      executor=ThreadPoolExecutor(1))
+
+        first = engine._submit(echo_file(), 'a4c', {})
+        with pytest.raises(InferenceUnavailable, match='queue is full'):
+            engine.predict(echo_file(), 'a4c', {})
+
+        release.set()
+        assert first.result() == 50.0
+
+    def test_temporary_copies_are_removed(self, monkeypatch):
+        paths = []
+        monkeypatch.setattr('patients.local_inference._run', lambda path, *args: paths.append(path) or 60.0)
+        engine = LocalInferenceEngine('model.keras', workers=1, executor=ThreadPoolExecutor(1))
+
+        engine.predict(echo_file(), 'a4c', {})
+        engine.executor.shutdown(wait=True)
+
+        assert paths and paths[0].endswith('.avi')
+        assert not os.path.exists(paths[0])
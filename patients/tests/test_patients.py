@@ -1,14 +1,37 @@
+import httpx
 import pytest
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import AsyncClient
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 from datetime import date, timedelta
+import asyncio
+import hashlib
+import io
 import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
 
 from accounts.models import Profile
-from patients.models import Patient, Diagnosis
+from patients.analysis import cache_predictions, cache_requests, complete_analysis, open_echo, result_cache_key
+from patients.inference import AsyncInferenceClient, InferenceError
+from patients.interpretation import get_ruleset
+from patients.jobs import Worker, claim_jobs, run_jobs
+from patients.models import Patient, Diagnosis, AnalysisJob, EchoBlob, EchoTensor, Interpretation, UploadSession
+from patients.notifications import LocalNotifier, PostgresNotifier, get_notifier, wait_for_analysis
+from patients.preprocessing import preprocess
+from patients.uploadhandlers import HashedUploadedFile
+from patients.uploads import AlreadyFinalized, finalize
 
 User = get_user_model()
 
@@ -62,6 +85,19 @@ def sample_diagnosis(sample_patient):
     )
 
 
+@pytest.fixture
+def fake_inference(monkeypatch):
+    """Replaces the remote model call with a fixed prediction"""
+    calls = []
+
+    def analyze(diagnosis):
+        calls.append(diagnosis.id)
+        diagnosis.ejection_fraction = 60.0
+
+    monkeypatch.setattr('patients.jobs.analyze_echo', analyze)
+    return calls
+
+
 @pytest.mark.django_db
 class TestPatientManagement:
     """Tests for patient-related behaviors"""
@@ -88,8 +124,8 @@ class TestPatientManagement:
 
         response = client.get('/api/patients/')
         assert response.status_code == status.HTTP_200_OK
-        assert len(response.data) == 1
-        assert response.data[0]['full_name'] == 'John Doe'
+        assert len(response.data['results']) == 1
+        assert response.data['results'][0]['full_name'] == 'John Doe'
 
     def test_patient_creation_with_required_fields(self, authenticated_client):
         """Ensures patients can be created with mandatory fields"""
@@ -106,6 +142,31 @@ class TestPatientManagement:
         assert response.status_code == status.HTTP_201_CREATED
         assert response.data['full_name'] == 'Jane Doe'
 
+    def test_patient_list_is_cursor_paginated(self, authenticated_client):
+        """Ensures patient pages are fetched by cursor, newest first, without gaps or repeats"""
+        client, doctor = authenticated_client
+        for i in range(5):
+            Patient.objects.create(doctor=doctor, full_name=f'Patient {i}', gender='F')
+
+        first = client.get('/api/patients/', {'page_size': 2})
+        second = client.get(first.data['next'])
+        third = client.get(second.data['next'])
+
+        names = [p['full_name'] for page in (first, second, third) for p in page.data['results']]
+        assert names == [f'Patient {i}' for i in reversed(range(5))]
+        assert third.data['next'] is None
+        assert 'count' not in first.data
+
+    def test_patient_list_uses_compact_representation(self, authenticated_client, sample_patient):
+        """Ensures list rows leave out detail-only fields such as the address"""
+        client, _ = authenticated_client
+
+        row = client.get('/api/patients/').data['results'][0]
+        detail = client.get(f'/api/patients/{sample_patient.id}/').data
+
+        assert 'address' not in row
+        assert 'address' in detail
+
     def test_patient_age_calculation(self, sample_patient):
         """Ensures correct age calculation"""
         expected_age = (date.today() - sample_patient.date_of_birth).days // 365
@@ -145,16 +206,17 @@ class TestDiagnosisManagement:
         diagnosis = Diagnosis.objects.get(id=response.data['id'])
         assert os.path.exists(diagnosis.echocardiogram.path)
 
-    def test_diagnosis_cleanup_on_deletion(self, sample_diagnosis):
+    def test_diagnosis_cleanup_on_deletion(self, sample_diagnosis, django_capture_on_commit_callbacks):
         """Ensures proper cleanup of files when diagnosis is deleted"""
         file_path = sample_diagnosis.echocardiogram.path
         assert os.path.exists(file_path)
 
-        sample_diagnosis.delete()
+        with django_capture_on_commit_callbacks(execute=True):
+            sample_diagnosis.delete()
         assert not os.path.exists(file_path)
 
-    def test_diagnosis_interpretation_creation(self, authenticated_client, sample_patient):
-        """Ensures interpretations are created when diagnosis is created via API"""
+    def test_diagnosis_interpretation_creation(self, authenticated_client, sample_patient, fake_inference):
+        """Ensures interpretations are created once the queued analysis has run"""
         client, _ = authenticated_client
 
         echo_file = SimpleUploadedFile(
@@ -175,12 +237,16 @@ class TestDiagnosisManagement:
             format='multipart'
         )
         assert create_response.status_code == status.HTTP_201_CREATED
+        assert create_response.data['analysis_status'] == 'pending'
+
+        Worker(concurrency=1, burst=True).run()
 
         diagnosis_id = create_response.data['id']
         get_response = client.get(f'/api/patients/{sample_patient.id}/diagnoses/{diagnosis_id}/')
 
         assert get_response.status_code == status.HTTP_200_OK
         assert len(get_response.data['interpretations']) > 0
+        assert get_response.data['analysis_status'] == 'completed'
 
         assert get_response.data['ejection_fraction'] is not None
 
@@ -204,8 +270,715 @@ class TestDiagnosisManagement:
         response = client.get(f'/api/patients/{sample_patient.id}/diagnoses/')
 
         assert response.status_code == status.HTTP_200_OK
-        assert len(response.data) == 3
-        assert response.data[0]['diagnosis_date'] > response.data[1]['diagnosis_date']
+        results = response.data['results']
+        assert len(results) == 3
+        assert results[0]['diagnosis_date'] > results[1]['diagnosis_date']
+
+
+@pytest.mark.django_db
+class TestEchoStorage:
+    """Tests for content-addressed echo storage"""
+
+    def test_identical_uploads_share_one_file(self, sample_patient):
+        """Ensures identical bytes are stored once and reference-counted"""
+        first = Diagnosis.objects.create(
+            patient=sample_patient, echocardiogram=SimpleUploadedFile("a.avi", b"same bytes"))
+        second = Diagnosis.objects.create(
+            patient=sample_patient, echocardiogram=SimpleUploadedFile("b.avi", b"same bytes"))
+
+        assert first.echocardiogram.name == second.echocardiogram.name
+        assert first.echo_blob_id == second.echo_blob_id
+        assert EchoBlob.objects.get(id=first.echo_blob_id).ref_count == 2
+
+    def test_file_removed_only_with_last_reference(self, sample_patient, django_capture_on_commit_callbacks):
+        """Ensures the shared file survives until the last diagnosis is deleted"""
+        first = Diagnosis.objects.create(
+            patient=sample_patient, echocardiogram=SimpleUploadedFile("a.avi", b"shared"))
+        second = Diagnosis.objects.create(
+            patient=sample_patient, echocardiogram=SimpleUploadedFile("b.avi", b"shared"))
+        path = first.echocardiogram.path
+
+        first.delete()
+        assert os.path.exists(path)
+        assert EchoBlob.objects.get(id=second.echo_blob_id).ref_count == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        assert not os.path.exists(path)
+        assert not EchoBlob.objects.exists()
+
+    def test_upload_is_hashed_while_streaming(self, authenticated_client, sample_patient, monkeypatch,
+                                              settings, tmp_path):
+        """Ensures an uploaded echo is hashed on arrival and moved into storage without re-reading"""
+        client, _ = authenticated_client
+        settings.ECHO_UPLOAD_TEMP_DIR = str(tmp_path)
+        content = os.urandom(300 * 1024)
+
+        def no_reread(*args, **kwargs):
+            raise AssertionError("echo was read a second time")
+
+        monkeypatch.setattr(HashedUploadedFile, 'chunks', no_reread)
+
+        response = client.post(
+            f'/api/patients/{sample_patient.id}/diagnoses/',
+            {'echocardiogram': SimpleUploadedFile("large.avi", content)},
+            format='multipart'
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        diagnosis = Diagnosis.objects.get(id=response.data['id'])
+        assert diagnosis.echo_blob.sha256 == hashlib.sha256(content).hexdigest()
+        with open(diagnosis.echocardiogram.path, 'rb') as stored:
+            assert stored.read() == content
+        assert os.listdir(tmp_path) == []
+
+    def test_known_echo_can_be_referenced_by_hash(self, authenticated_client, sample_diagnosis):
+        """Ensures a previously uploaded echo can be reused without re-sending the bytes"""
+        client, _ = authenticated_client
+        sha256 = sample_diagnosis.echo_blob.sha256
+
+        response = client.post(
+            f'/api/patients/{sample_diagnosis.patient.id}/diagnoses/',
+            {'symptoms': 'Follow-up', 'echo_sha256': sha256},
+            format='multipart'
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['echo_blob'] == sample_diagnosis.echo_blob_id
+        assert EchoBlob.objects.get(sha256=sha256).ref_count == 2
+
+    def test_unknown_hash_is_rejected(self, authenticated_client, sample_patient):
+        client, _ = authenticated_client
+
+        response = client.post(
+            f'/api/patients/{sample_patient.id}/diagnoses/',
+            {'symptoms': 'Follow-up', 'echo_sha256': '0' * 64},
+            format='multipart'
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'echo_sha256' in response.data
+
+
+@pytest.mark.django_db
+class TestEchoPreprocessing:
+    """Tests for decoding echoes into reusable tensors"""
+
+    @pytest.fixture
+    def fake_decode(self, monkeypatch, settings, tmp_path):
+        settings.ECHO_UPLOAD_TEMP_DIR = str(tmp_path)
+        decoded = []
+
+        def decode_to_file(video_path, out_path, frames, frame_size):
+            decoded.append(video_path)
+            with open(out_path, 'wb') as out:
+                out.write(b"tensor of " + os.path.basename(video_path).encode())
+            return os.path.getsize(out_path)
+
+        monkeypatch.setattr('patients.preprocessing.decode_to_file', decode_to_file)
+        return decoded
+
+    def test_each_echo_is_decoded_once(self, sample_patient, fake_decode):
+        """Ensures diagnoses sharing an echo share one tensor"""
+        diagnoses = [
+            Diagnosis.objects.create(patient=sample_patient, echocardiogram=SimpleUploadedFile(name, content))
+            for name, content in [("a.avi", b"same"), ("b.avi", b"same"), ("c.avi", b"other")]
+        ]
+
+        call_command('preprocess_echos', '--frames', '16', '--frame-size', '64', stdout=io.StringIO())
+
+        assert len(fake_decode) == 2
+        assert EchoTensor.objects.count() == 2
+        tensors = [Diagnosis.objects.get(id=d.id).echo_tensor for d in diagnoses]
+        assert tensors[0] == tensors[1] != tensors[2]
+        assert tensors[0].file.name.endswith('_16x64.npy')
+
+        out = io.StringIO()
+        call_command('preprocess_echos', '--frames', '16', '--frame-size', '64', stdout=out)
+        assert 'Created 0 tensor(s)' in out.getvalue()
+        assert len(fake_decode) == 2
+
+    def test_remote_echoes_are_downloaded_as_needed(self, sample_patient, fake_decode, monkeypatch):
+        """Ensures no more local copies exist at once than echoes being decoded"""
+        copies = {'open': 0, 'most': 0}
+
+        @contextmanager
+        def local_copy(name):
+            copies['open'] += 1
+            copies['most'] = max(copies['most'], copies['open'])
+            try:
+                yield default_storage.path(name)
+            finally:
+                copies['open'] -= 1
+
+        monkeypatch.setattr('patients.preprocessing.local_copy', local_copy)
+        diagnoses = [
+            Diagnosis.objects.create(patient=sample_patient, echocardiogram=SimpleUploadedFile(f"{i}.avi", bytes([i])))
+            for i in range(6)
+        ]
+
+        with ThreadPoolExecutor(2) as executor:
+            assert preprocess(diagnoses, 16, 64, executor=executor, concurrency=2) == (6, 0)
+
+        assert len(fake_decode) == 6
+        assert copies == {'open': 0, 'most': 2}
+
+    def test_tensor_backend_reads_the_tensor(self, sample_diagnosis, fake_decode):
+        """Ensures a backend taking tensors of the matching shape gets the .npy, others the video"""
+        call_command('preprocess_echos', '--frames', '16', '--frame-size', '64', stdout=io.StringIO())
+        sample_diagnosis.refresh_from_db()
+
+        class TensorClient:
+            accepts_tensors = True
+            frames, frame_size = 16, 64
+
+        with open_echo(sample_diagnosis, TensorClient()) as echo:
+            assert echo.name.endswith('.npy')
+        TensorClient.frame_size = 112
+        with open_echo(sample_diagnosis, TensorClient()) as echo:
+            assert echo.name == sample_diagnosis.echocardiogram.name
+
+    def test_posted_tensor_is_ignored(self, authenticated_client, sample_diagnosis, fake_decode):
+        """Ensures a client cannot point a new diagnosis at another echo's tensor"""
+        client, _ = authenticated_client
+        call_command('preprocess_echos', stdout=io.StringIO())
+        tensor = EchoTensor.objects.get()
+
+        response = client.post(
+            f'/api/patients/{sample_diagnosis.patient_id}/diagnoses/',
+            {'echocardiogram': SimpleUploadedFile("other.avi", b"other echo"), 'echo_tensor': tensor.id},
+            format='multipart'
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert Diagnosis.objects.get(id=response.data['id']).echo_tensor is None
+
+    def test_tensor_removed_with_its_echo(self, sample_diagnosis, fake_decode, django_capture_on_commit_callbacks):
+        call_command('preprocess_echos', stdout=io.StringIO())
+        path = EchoTensor.objects.get().file.path
+        assert os.path.exists(path)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sample_diagnosis.delete()
+
+        assert not EchoTensor.objects.exists()
+        assert not os.path.exists(path)
+
+
+@pytest.mark.django_db
+class TestEchoPreviews:
+    """Tests for poster frames and preview clips"""
+
+    @pytest.fixture
+    def fake_render(self, monkeypatch):
+        rendered = []
+
+        def render_poster(video_path, width, quality):
+            rendered.append(video_path)
+            return b"jpeg"
+
+        def render_preview(video_path, out_path, width, seconds, fps, codec):
+            with open(out_path, 'wb') as out:
+                out.write(b"clip")
+
+        monkeypatch.setattr('patients.previews.render_poster', render_poster)
+        monkeypatch.setattr('patients.previews.render_preview', render_preview)
+        return rendered
+
+    def test_upload_queues_previews_off_the_request(self, authenticated_client, sample_patient,
+                                                    fake_inference, fake_render):
+        """Ensures previews are rendered by the worker and exposed as URLs"""
+        client, _ = authenticated_client
+        url = f'/api/patients/{sample_patient.id}/diagnoses/'
+
+        response = client.post(url, {'echocardiogram': SimpleUploadedFile("echo.avi", b"frames")},
+                               format='multipart')
+        assert response.data['poster_url'] is None
+        assert fake_render == []
+        assert AnalysisJob.objects.filter(kind=AnalysisJob.KIND_PREVIEW).count() == 1
+
+        Worker(concurrency=1, burst=True).run()
+
+        listed = client.get(url).data['results'][0]
+        assert urlparse(listed['poster_url']).path.endswith('_poster.jpg')
+        assert urlparse(listed['preview_url']).path.endswith('_preview.mp4')
+        assert len(fake_render) == 1
+
+        # The same echo again already has previews
+        client.post(url, {'echocardiogram': SimpleUploadedFile("again.avi", b"frames")}, format='multipart')
+        assert AnalysisJob.objects.filter(kind=AnalysisJob.KIND_PREVIEW).count() == 1
+
+    def test_failed_preview_leaves_analysis_status(self, sample_diagnosis, monkeypatch):
+        def broken(*args):
+            raise ValueError("Could not read a frame")
+
+        monkeypatch.setattr('patients.previews.render_poster', broken)
+        sample_diagnosis.analysis_status = Diagnosis.ANALYSIS_COMPLETED
+        sample_diagnosis.save()
+        job = AnalysisJob.objects.create(diagnosis=sample_diagnosis, kind=AnalysisJob.KIND_PREVIEW, max_attempts=1)
+
+        Worker(concurrency=1, burst=True).run()
+
+        job.refresh_from_db()
+        sample_diagnosis.refresh_from_db()
+        assert job.status == 'failed'
+        assert 'Could not read a frame' in job.last_error
+        assert sample_diagnosis.analysis_status == Diagnosis.ANALYSIS_COMPLETED
+
+    def test_previews_removed_with_their_echo(self, sample_diagnosis, fake_render,
+                                              django_capture_on_commit_callbacks):
+        call_command('generate_previews', stdout=io.StringIO())
+        blob = EchoBlob.objects.get()
+        paths = [blob.poster.path, blob.preview.path]
+        assert all(os.path.exists(path) for path in paths)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            sample_diagnosis.delete()
+
+        assert not any(os.path.exists(path) for path in paths)
+
+
+@pytest.mark.django_db
+class TestAnalysisJobs:
+    """Tests for the background echo analysis queue"""
+
+    def test_upload_returns_before_analysis(self, authenticated_client, sample_patient, fake_inference):
+        """Ensures the upload request only queues the analysis"""
+        client, _ = authenticated_client
+
+        response = client.post(
+            f'/api/patients/{sample_patient.id}/diagnoses/',
+            {'symptoms': 'Fatigue', 'echocardiogram': SimpleUploadedFile("echo.txt", b"echo")},
+            format='multipart'
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert fake_inference == []
+        job = AnalysisJob.objects.get(diagnosis_id=response.data['id'], kind=AnalysisJob.KIND_ANALYSIS)
+        assert job.status == 'pending'
+
+    def test_worker_processes_each_job_once(self, sample_diagnosis, fake_inference):
+        """Ensures a queued job is run exactly once and marked completed"""
+        AnalysisJob.objects.create(diagnosis=sample_diagnosis)
+
+        processed = Worker(concurrency=1, burst=True).run()
+
+        assert processed == 1
+        assert fake_inference == [sample_diagnosis.id]
+        sample_diagnosis.refresh_from_db()
+        assert sample_diagnosis.analysis_status == 'completed'
+        assert sample_diagnosis.interpretations.exists()
+
+    def test_failed_job_is_retried_then_marked_failed(self, sample_diagnosis, monkeypatch, settings):
+        """Ensures failures are rescheduled until the attempt budget is used up"""
+        settings.ANALYSIS_RETRY_DELAY = 0
+
+        def broken(diagnosis):
+            raise Exception("model unavailable")
+
+        monkeypatch.setattr('patients.jobs.analyze_echo', broken)
+        job = AnalysisJob.objects.create(diagnosis=sample_diagnosis, max_attempts=2)
+
+        Worker(concurrency=1, burst=True).run()
+
+        job.refresh_from_db()
+        sample_diagnosis.refresh_from_db()
+        assert job.attempts == 2
+        assert job.status == 'failed'
+        assert 'model unavailable' in job.last_error
+        assert sample_diagnosis.analysis_status == 'failed'
+
+    def test_worker_batches_jobs_into_one_inference_call(self, sample_patient, monkeypatch):
+        """Ensures claimed jobs share one batch request and failures stay per-diagnosis"""
+        class FakeClient:
+            batches = []
+
+            def predict_batch(self, items):
+                self.batches.append(items)
+                return [50.0, InferenceError("Unreadable video"), 65.0]
+
+        monkeypatch.setattr('patients.analysis.get_client', FakeClient)
+        diagnoses = [
+            Diagnosis.objects.create(
+                patient=sample_patient,
+                echocardiogram=SimpleUploadedFile(f"echo_{i}.txt", b"echo")
+            )
+            for i in range(3)
+        ]
+        for diagnosis in diagnoses:
+            AnalysisJob.objects.create(diagnosis=diagnosis, max_attempts=1)
+
+        Worker(concurrency=1, burst=True, batch_size=3).run()
+
+        assert len(FakeClient.batches) == 1
+        statuses = [Diagnosis.objects.get(id=d.id).analysis_status for d in diagnoses]
+        assert statuses == ['completed', 'failed', 'completed']
+        assert Diagnosis.objects.get(id=diagnoses[2].id).ejection_fraction == 65.0
+
+    def test_reanalysis_replaces_interpretations(self, sample_diagnosis, fake_inference):
+        """Ensures running analyze_diagnoses again does not pile up interpretation notes"""
+        call_command('analyze_diagnoses', stdout=io.StringIO())
+        notes = list(sample_diagnosis.interpretations.values_list('note', flat=True))
+
+        call_command('analyze_diagnoses', '--status', 'completed', stdout=io.StringIO())
+
+        assert fake_inference == [sample_diagnosis.id, sample_diagnosis.id]
+        assert notes
+        assert sorted(sample_diagnosis.interpretations.values_list('note', flat=True)) == sorted(notes)
+
+
+@pytest.mark.django_db
+class TestDiagnosisWriteQueries:
+    """Tests pinning the number of queries on the diagnosis write path"""
+
+    def test_completing_an_analysis_costs_fixed_queries(self, sample_diagnosis, fake_inference,
+                                                        django_assert_num_queries):
+        """Ensures EF, status and interpretations are written with one UPDATE, DELETE and INSERT"""
+        AnalysisJob.objects.create(diagnosis=sample_diagnosis)
+        jobs = claim_jobs('test-worker')
+
+        # processing UPDATE, savepoint, diagnosis UPDATE, interpretations DELETE and INSERT, job UPDATE, release
+        with django_assert_num_queries(7):
+            run_jobs(jobs)
+
+        sample_diagnosis.refresh_from_db()
+        assert sample_diagnosis.ejection_fraction == 60.0
+        assert sample_diagnosis.interpretations.count() >= 2
+
+    def test_completing_a_batch_costs_the_same_queries(self, sample_patient, monkeypatch,
+                                                        django_assert_num_queries):
+        """Ensures a batch of analyses is persisted without per-row queries"""
+        class FakeClient:
+            def predict_batch(self, items):
+                return [55.0] * len(items)
+
+        monkeypatch.setattr('patients.analysis.get_client', FakeClient)
+        for i in range(5):
+            diagnosis = Diagnosis.objects.create(
+                patient=sample_patient, echocardiogram=SimpleUploadedFile(f"echo_{i}.avi", bytes([i])))
+            AnalysisJob.objects.create(diagnosis=diagnosis)
+        jobs = claim_jobs('test-worker', limit=5)
+
+        with django_assert_num_queries(7):
+            run_jobs(jobs)
+
+        assert Interpretation.objects.filter(diagnosis__patient=sample_patient).count() >= 10
+
+    def test_cached_upload_is_written_in_one_transaction(self, authenticated_client, sample_diagnosis,
+                                                         django_assert_num_queries):
+        """Ensures an upload answered from the cache needs no per-interpretation INSERTs"""
+        client, _ = authenticated_client
+        sample_diagnosis.ejection_fraction = 45.0
+        cache_predictions([sample_diagnosis])
+
+        # patient lookup, savepoint, blob lookup and reference, diagnosis INSERT, EF UPDATE,
+        # interpretations DELETE and INSERT, preview job INSERT, release, interpretations for the response
+        with django_assert_num_queries(11):
+            response = client.post(
+                f'/api/patients/{sample_diagnosis.patient.id}/diagnoses/',
+                {'echocardiogram': SimpleUploadedFile("again.txt", b"test echo content")},
+                format='multipart'
+            )
+
+        assert response.data['analysis_status'] == 'completed'
+        assert response.data['ejection_fraction'] == 45.0
+
+
+@pytest.mark.django_db
+class TestInterpretationRules:
+    """Tests for the EF interpretation rule sets"""
+
+    @pytest.mark.parametrize('ef,label', [
+        (12.0, 'severe'), (29.9, 'severe'), (30.0, 'moderate'), (40.5, 'moderate'), (49.5, 'mild'),
+        (50.0, 'normal'), (72.0, 'normal'), (75.0, 'hyperdynamic'), (-1.0, 'severe'),
+    ])
+    def test_every_ef_falls_in_a_band(self, ef, label):
+        """Ensures the bands have no gaps, including the old 49-50 and 70-75 holes"""
+        assert get_ruleset().band_for(ef).label == label
+
+    def test_selection_is_deterministic(self, sample_diagnosis):
+        """Ensures the same EF always yields the same notes tagged with the rule version"""
+        sample_diagnosis.ejection_fraction = 45.0
+        first = get_ruleset().interpret([sample_diagnosis])
+        second = get_ruleset().interpret([sample_diagnosis])
+
+        assert [i.note for i in first] == [i.note for i in second]
+        assert "45.0%" in first[0].note
+        assert {i.rule_version for i in first} == {get_ruleset().version}
+
+    def test_reinterpret_command_rewrites_history(self, sample_patient, django_assert_max_num_queries):
+        """Ensures stale interpretations are replaced in batches rather than per diagnosis"""
+        diagnoses = [
+            Diagnosis.objects.create(
+                patient=sample_patient, ejection_fraction=ef, analysis_status=Diagnosis.ANALYSIS_COMPLETED,
+                echocardiogram=SimpleUploadedFile(f"echo_{ef}.avi", str(ef).encode()))
+            for ef in (20.0, 35.0, 45.0, 60.0, 80.0)
+        ]
+        Interpretation.objects.bulk_create(
+            [Interpretation(diagnosis=diagnosis, note="old note") for diagnosis in diagnoses])
+
+        # per batch of 2: SELECT, savepoint, DELETE, INSERT, release; then one empty SELECT
+        with django_assert_max_num_queries(16):
+            call_command('reinterpret_diagnoses', '--batch-size', '2', stdout=io.StringIO())
+
+        assert not Interpretation.objects.filter(note="old note").exists()
+        assert Interpretation.objects.filter(rule_version=get_ruleset().version).count() == 15
+
+        out = io.StringIO()
+        call_command('reinterpret_diagnoses', stdout=out)
+        assert 'Re-interpreted 0' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestInferenceCache:
+    """Tests for reusing predictions of identical echoes"""
+
+    def test_repeat_upload_is_answered_from_cache(self, authenticated_client, sample_patient, monkeypatch):
+        """Ensures a duplicate echo is completed without another model call"""
+        client, _ = authenticated_client
+        calls = []
+
+        class FakeClient:
+            def predict(self, video, view, demographics):
+                calls.append(view)
+                return 58.0
+
+        monkeypatch.setattr('patients.analysis.get_client', FakeClient)
+        url = f'/api/patients/{sample_patient.id}/diagnoses/'
+
+        client.post(url, {'echocardiogram': SimpleUploadedFile("a.avi", b"frames")}, format='multipart')
+        Worker(concurrency=1, burst=True).run()
+        hits_before = cache_requests.value(result='hit')
+
+        response = client.post(url, {'echocardiogram': SimpleUploadedFile("b.avi", b"frames")}, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['analysis_status'] == 'completed'
+        assert response.data['ejection_fraction'] == 58.0
+        assert len(response.data['interpretations']) > 0
+        assert calls == ['a4c']
+        assert cache_requests.value(result='hit') == hits_before + 1
+
+    def test_cache_key_depends_on_view_and_demographics(self, sample_diagnosis):
+        key = result_cache_key(sample_diagnosis)
+
+        sample_diagnosis.view_type = 'psax'
+        assert result_cache_key(sample_diagnosis) != key
+
+        sample_diagnosis.view_type = 'a4c'
+        sample_diagnosis.patient.weight = 90
+        assert result_cache_key(sample_diagnosis) != key
+
+
+@pytest.fixture
+def upload_root(settings, tmp_path):
+    settings.UPLOAD_SESSION_ROOT = str(tmp_path / 'upload_sessions')
+    return settings.UPLOAD_SESSION_ROOT
+
+
+@pytest.mark.django_db
+class TestResumableUploads:
+    """Tests for chunked, resumable echo uploads"""
+
+    echo = b"0123456789" * 10
+
+    def start_upload(self, client, patient, **extra):
+        response = client.post(f'/api/patients/{patient.id}/uploads/', {
+            'filename': 'study.avi',
+            'size': len(self.echo),
+            'symptoms': 'Palpitations',
+            'view_type': 'psax',
+            **extra,
+        }, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.data['id']
+
+    def put_chunk(self, client, upload_id, start, end):
+        return client.put(
+            f'/api/uploads/{upload_id}/',
+            data=self.echo[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.echo)}'
+        )
+
+    def test_chunks_are_assembled_into_a_diagnosis(self, authenticated_client, sample_patient, upload_root):
+        """Ensures an upload sent in chunks is verified and queued for analysis"""
+        client, _ = authenticated_client
+        upload_id = self.start_upload(client, sample_patient, sha256=hashlib.sha256(self.echo).hexdigest())
+
+        assert self.put_chunk(client, upload_id, 0, 39).data['offset'] == 40
+        assert self.put_chunk(client, upload_id, 40, 99).data['offset'] == 100
+
+        response = client.post(f'/api/uploads/{upload_id}/finalize/')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        diagnosis = Diagnosis.objects.get(id=response.data['id'])
+        assert diagnosis.view_type == 'psax'
+        assert diagnosis.symptoms == 'Palpitations'
+        assert diagnosis.echocardiogram.read() == self.echo
+        assert diagnosis.analysis_jobs.filter(status='pending').exists()
+        assert not os.listdir(upload_root)
+
+    def test_upload_resumes_from_stored_offset(self, authenticated_client, sample_patient, upload_root):
+        """Ensures a client that lost a chunk is told where to resume"""
+        client, _ = authenticated_client
+        upload_id = self.start_upload(client, sample_patient)
+        self.put_chunk(client, upload_id, 0, 49)
+
+        response = self.put_chunk(client, upload_id, 60, 99)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['offset'] == 50
+
+        assert client.get(f'/api/uploads/{upload_id}/').data['offset'] == 50
+        assert self.put_chunk(client, upload_id, 50, 99).data['offset'] == 100
+
+    def test_concurrent_finalize_creates_one_diagnosis(self, authenticated_client, sample_patient, upload_root):
+        """Ensures a retried finalize that read the session before the first one committed gets its diagnosis"""
+        client, _ = authenticated_client
+        upload_id = self.start_upload(client, sample_patient)
+        self.put_chunk(client, upload_id, 0, 99)
+        first, retry = UploadSession.objects.get(id=upload_id), UploadSession.objects.get(id=upload_id)
+
+        diagnosis = finalize(first)
+        with pytest.raises(AlreadyFinalized) as finalized:
+            finalize(retry)
+
+        assert finalized.value.diagnosis == diagnosis
+        assert Diagnosis.objects.count() == 1
+        response = client.post(f'/api/uploads/{upload_id}/finalize/')
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['diagnosis'] == diagnosis.id
+
+    def test_finalize_rejects_corrupted_upload(self, authenticated_client, sample_patient, upload_root):
+        """Ensures bytes that do not match the declared hash are not accepted"""
+        client, _ = authenticated_client
+        upload_id = self.start_upload(client, sample_patient, sha256='f' * 64)
+        self.put_chunk(client, upload_id, 0, 99)
+
+        response = client.post(f'/api/uploads/{upload_id}/finalize/')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Diagnosis.objects.exists()
+
+    def test_finalize_rejects_incomplete_upload(self, authenticated_client, sample_patient, upload_root):
+        client, _ = authenticated_client
+        upload_id = self.start_upload(client, sample_patient)
+        self.put_chunk(client, upload_id, 0, 9)
+
+        response = client.post(f'/api/uploads/{upload_id}/finalize/')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'incomplete' in response.data['detail']
+
+
+@pytest.fixture
+def s3_media(settings):
+    """Makes the default storage an S3Storage backed by moto's in-process S3"""
+    pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+
+    with moto.mock_aws():
+        settings.S3_STORAGE = {**settings.S3_STORAGE, 'BUCKET': 'test-media', 'REGION': 'us-east-1',
+                               'ENDPOINT_URL': None, 'ACCESS_KEY': 'test', 'SECRET_KEY': 'test'}
+        settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'fyp_backend.storage.S3Storage'}}
+        from django.core.files.storage import default_storage
+        default_storage.client.create_bucket(Bucket='test-media')
+        yield default_storage
+
+
+@pytest.mark.django_db
+class TestDirectUploads:
+    """Tests for echo uploads sent straight to object storage"""
+
+    echo = b"direct echo bytes" * 10
+
+    def start_upload(self, client, patient, **extra):
+        return client.post(f'/api/patients/{patient.id}/direct-uploads/', {
+            'filename': 'study.avi',
+            'size': len(self.echo),
+            'sha256': hashlib.sha256(self.echo).hexdigest(),
+            'content_type': 'video/x-msvideo',
+            'view_type': 'a4c',
+            **extra,
+        }, format='json')
+
+    def send(self, upload, body=None):
+        import requests
+
+        return requests.request(upload['method'], upload['url'], data=self.echo if body is None else body,
+                                headers=upload['headers'])
+
+    def test_upload_is_adopted_without_copying_through_the_app(self, authenticated_client, sample_patient, s3_media):
+        client, _ = authenticated_client
+        response = self.start_upload(client, sample_patient)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['mode'] == 'direct'
+        assert self.send(response.data['upload']).status_code == 200
+
+        finalized = client.post(f"/api/uploads/{response.data['id']}/finalize/")
+
+        assert finalized.status_code == status.HTTP_201_CREATED
+        diagnosis = Diagnosis.objects.select_related('echo_blob').get(id=finalized.data['id'])
+        assert diagnosis.echo_blob.sha256 == hashlib.sha256(self.echo).hexdigest()
+        assert diagnosis.echo_blob.ref_count == 1
+        assert diagnosis.echocardiogram.name == diagnosis.echo_blob.file.name
+        with s3_media.open(diagnosis.echo_blob.file.name) as f:
+            assert f.read() == self.echo
+        assert not s3_media.exists(f"uploads/{response.data['id']}.avi")
+        assert diagnosis.analysis_jobs.filter(kind=AnalysisJob.KIND_ANALYSIS).exists()
+
+    def test_recorded_checksum_avoids_reading_the_echo(self, authenticated_client, sample_patient, s3_media,
+                                                       monkeypatch):
+        """Ensures finalizing only reads metadata when storage recorded the checksum"""
+        client, _ = authenticated_client
+        stat, sha256 = s3_media.stat, hashlib.sha256(self.echo).hexdigest()
+        monkeypatch.setattr(s3_media, 'stat', lambda name: {**stat(name), 'sha256': sha256})
+        monkeypatch.setattr(s3_media, 'open', lambda *args: pytest.fail("the echo was downloaded"))
+        response = self.start_upload(client, sample_patient)
+        self.send(response.data['upload'])
+
+        finalized = client.post(f"/api/uploads/{response.data['id']}/finalize/")
+
+        assert finalized.status_code == status.HTTP_201_CREATED
+
+    def test_finalize_rejects_bytes_that_do_not_match_the_hash(self, authenticated_client, sample_patient, s3_media):
+        client, _ = authenticated_client
+        response = self.start_upload(client, sample_patient)
+        self.send(response.data['upload'], body=b"X" + self.echo[1:])
+
+        finalized = client.post(f"/api/uploads/{response.data['id']}/finalize/")
+
+        assert finalized.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Diagnosis.objects.exists()
+
+    def test_duplicate_echo_reuses_the_stored_blob(self, authenticated_client, sample_patient, s3_media):
+        client, _ = authenticated_client
+        for _ in range(2):
+            response = self.start_upload(client, sample_patient)
+            self.send(response.data['upload'])
+            client.post(f"/api/uploads/{response.data['id']}/finalize/")
+
+        blob = EchoBlob.objects.get()
+        assert blob.ref_count == 2
+        assert len(s3_media.client.list_objects_v2(Bucket='test-media')['Contents']) == 1
+
+    def test_local_storage_cannot_take_direct_uploads(self, authenticated_client, sample_patient):
+        client, _ = authenticated_client
+        assert self.start_upload(client, sample_patient).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestQueryPlans:
+    """Tests for the doctor-scoped access path indexes"""
+
+    def test_view_queries_use_indexes(self, sample_diagnosis):
+        """Ensures no API view queryset falls back to a sequential scan"""
+        out = io.StringIO()
+
+        call_command('explain_queries', '--fail-on-seq-scan', stdout=out)
+
+        assert 'patient_doctor_created_idx' in out.getvalue()
+        assert 'diagnosis_patient_date_idx' in out.getvalue()
 
 
 @pytest.mark.django_db
@@ -252,4 +1025,336 @@ class TestAccessControl:
             response = api_client.get('/api/patients/')
             assert response.status_code == status.HTTP_403_FORBIDDEN
         except User.profile.RelatedObjectDoesNotExist:
-            pass
\ No newline at end of file
+            pass
+
+@pytest.fixture
+def async_inference(monkeypatch):
+    """Answers the async views' inference calls with the queued httpx responses"""
+    responses = []
+
+    def handler(request):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr('patients.analysis.get_async_client', lambda: AsyncInferenceClient(
+        'http://model.test/predict', max_retries=0, transport=httpx.MockTransport(handler)))
+    return responses
+
+
+@pytest.mark.django_db
+class TestAsyncDiagnosisViews:
+    """Tests for the async diagnosis endpoints served under ASGI"""
+
+    def upload(self, client, patient):
+        return client.post(
+            f'/api/async/patients/{patient.id}/diagnoses/',
+            {'symptoms': 'Fatigue', 'view_type': 'a4c', 'echocardiogram': SimpleUploadedFile("echo.avi", b"echo")},
+            format='multipart'
+        )
+
+    def test_upload_waits_for_the_analysis(self, authenticated_client, sample_patient, async_inference):
+        """Ensures the EF is returned in the response and the job is not left for the worker"""
+        client, _ = authenticated_client
+        async_inference.append(httpx.Response(200, json={'ef_prediction': 58.0}))
+
+        response = self.upload(client, sample_patient)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()['ejection_fraction'] == 58.0
+        assert response.json()['analysis_status'] == 'completed'
+        job = AnalysisJob.objects.get(diagnosis_id=response.json()['id'], kind=AnalysisJob.KIND_ANALYSIS)
+        assert job.status == 'completed'
+        assert Interpretation.objects.filter(diagnosis_id=response.json()['id']).exists()
+
+    def test_failed_analysis_is_left_to_the_worker(self, authenticated_client, sample_patient, async_inference,
+                                                   settings):
+        """Ensures an inference failure answers 202 and reschedules the job"""
+        settings.ANALYSIS_RETRY_DELAY = 0
+        client, _ = authenticated_client
+        async_inference.append(httpx.ConnectError("down"))
+
+        response = self.upload(client, sample_patient)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json()['analysis_status'] == 'pending'
+        job = AnalysisJob.objects.get(diagnosis_id=response.json()['id'], kind=AnalysisJob.KIND_ANALYSIS)
+        assert job.status == 'pending'
+        assert job.attempts == 1
+
+    def test_slow_analysis_is_released(self, authenticated_client, sample_patient, monkeypatch, settings):
+        """Ensures a timed out analysis goes back to the queue without using up an attempt"""
+        settings.INFERENCE_SERVICE = {**settings.INFERENCE_SERVICE, 'ASYNC_WAIT': 0.01}
+        client, _ = authenticated_client
+
+        async def slow(diagnosis):
+            await asyncio.sleep(1)
+
+        monkeypatch.setattr('patients.jobs.analyze_echo_async', slow)
+
+        response = self.upload(client, sample_patient)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json()['analysis_status'] == 'pending'
+        job = AnalysisJob.objects.get(diagnosis_id=response.json()['id'], kind=AnalysisJob.KIND_ANALYSIS)
+        assert (job.status, job.attempts, job.worker) == ('pending', 0, '')
+
+    def test_token_requests_skip_csrf(self, authenticated_client, sample_patient, async_inference):
+        """Ensures clients without a session cookie are not rejected by the CSRF middleware"""
+        client, _ = authenticated_client
+        client.handler.enforce_csrf_checks = True
+        async_inference.append(httpx.Response(200, json={'ef_prediction': 58.0}))
+
+        assert self.upload(client, sample_patient).status_code == status.HTTP_201_CREATED
+
+    def test_detail_is_scoped_to_the_doctor(self, authenticated_client, sample_diagnosis, api_client):
+        client, _ = authenticated_client
+        url = f'/api/async/patients/{sample_diagnosis.patient_id}/diagnoses/{sample_diagnosis.id}/'
+
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['id'] == sample_diagnosis.id
+
+        other_user = User.objects.create_user(email='otherdoc@test.com', password='pass123')
+        Profile.objects.create(user=other_user, full_name='Dr. Other')
+        other = APIClient()
+        other.force_authenticate(user=other_user)
+        assert other.get(url).status_code == status.HTTP_404_NOT_FOUND
+
+        assert APIClient().get(url).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+class TestAnalysisNotifications:
+    """Tests for pushing finished analyses to waiting clients"""
+
+    def url(self, diagnosis, endpoint):
+        return f'/api/patients/{diagnosis.patient_id}/diagnoses/{diagnosis.id}/{endpoint}/'
+
+    def finish(self, diagnosis, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            diagnosis.ejection_fraction = 55.0
+            complete_analysis([diagnosis])
+
+    def test_waiter_is_woken_by_the_commit(self, sample_diagnosis, settings, django_capture_on_commit_callbacks):
+        """Ensures a finished analysis is seen right away, not at the next database recheck"""
+        settings.ANALYSIS_NOTIFICATIONS = {**settings.ANALYSIS_NOTIFICATIONS, 'RECHECK_INTERVAL': 30}
+
+        async def scenario():
+            waiter = asyncio.create_task(wait_for_analysis(sample_diagnosis.id, 10))
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+            await sync_to_async(self.finish)(sample_diagnosis, django_capture_on_commit_callbacks)
+            return await asyncio.wait_for(waiter, 2)
+
+        assert async_to_sync(scenario)() == 'completed'
+
+    def test_backend_follows_the_database(self, settings):
+        assert isinstance(get_notifier(), LocalNotifier)
+
+        settings.ANALYSIS_NOTIFICATIONS = {**settings.ANALYSIS_NOTIFICATIONS, 'BACKEND': 'postgres'}
+        assert isinstance(get_notifier(), PostgresNotifier)
+
+    def test_permanent_failure_is_announced(self, sample_diagnosis, monkeypatch, settings):
+        settings.ANALYSIS_RETRY_DELAY = 0
+        announced = []
+        monkeypatch.setattr('patients.jobs.notify_analysis_finished', announced.append)
+
+        def fail(diagnosis):
+            raise InferenceError("Model unavailable")
+
+        monkeypatch.setattr('patients.jobs.analyze_echo', fail)
+        AnalysisJob.objects.create(diagnosis=sample_diagnosis, max_attempts=2)
+
+        run_jobs(claim_jobs('worker-1'))
+        assert announced == []
+        AnalysisJob.objects.update(run_after=timezone.now())
+        run_jobs(claim_jobs('worker-1'))
+        assert announced == [[sample_diagnosis.id]]
+
+    def test_long_poll_returns_finished_analysis(self, authenticated_client, sample_diagnosis,
+                                                 django_capture_on_commit_callbacks):
+        client, _ = authenticated_client
+        self.finish(sample_diagnosis, django_capture_on_commit_callbacks)
+
+        response = client.get(self.url(sample_diagnosis, 'wait'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['analysis_status'] == 'completed'
+        assert response.json()['ejection_fraction'] == 55.0
+
+    def test_long_poll_times_out_with_pending_analysis(self, authenticated_client, sample_diagnosis):
+        client, _ = authenticated_client
+
+        response = client.get(self.url(sample_diagnosis, 'wait'), {'timeout': '0.05'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['analysis_status'] == 'pending'
+        assert client.get(self.url(sample_diagnosis, 'wait'), {'timeout': 'soon'}).status_code == 400
+
+    @pytest.mark.filterwarnings('ignore:StreamingHttpResponse must consume asynchronous iterators')
+    def test_event_stream_sends_the_finished_analysis(self, authenticated_client, sample_diagnosis,
+                                                      django_capture_on_commit_callbacks):
+        client, _ = authenticated_client
+        self.finish(sample_diagnosis, django_capture_on_commit_callbacks)
+
+        response = client.get(self.url(sample_diagnosis, 'events'))
+        body = b''.join(response).decode()
+
+        assert response['Content-Type'] == 'text/event-stream'
+        assert body.startswith('retry: ')
+        event = body.split('\n\n')[1].split('\n')
+        assert event[:2] == ['event: analysis', f'id: {sample_diagnosis.id}']
+        assert '"ejection_fraction":55.0' in event[2]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_idle_asgi_requests_wait(self, sample_diagnosis, settings):
+        """Ensures under ASGI a pending analysis is waited for and idle streams are kept alive then closed"""
+        settings.ANALYSIS_NOTIFICATIONS = {**settings.ANALYSIS_NOTIFICATIONS, 'STREAM_TIMEOUT': 0.2,
+                                           'KEEPALIVE_INTERVAL': 0.05}
+        token = RefreshToken.for_user(sample_diagnosis.patient.doctor.user).access_token
+        headers = {'Authorization': f'Bearer {token}'}
+
+        async def scenario():
+            started = asyncio.get_running_loop().time()
+            response = await AsyncClient().get(self.url(sample_diagnosis, 'wait'), {'timeout': '0.2'}, headers=headers)
+            waited = asyncio.get_running_loop().time() - started
+            stream = await AsyncClient().get(self.url(sample_diagnosis, 'events'), headers=headers)
+            body = b''.join([chunk async for chunk in stream.streaming_content]).decode()
+            return response, waited, body
+
+        response, waited, body = async_to_sync(scenario)()
+
+        assert response.json()['analysis_status'] == 'pending'
+        assert waited >= 0.2 and not response.has_header('Retry-After')
+        assert ': keepalive' in body
+        assert 'event: analysis' not in body
+
+    @pytest.mark.filterwarnings('ignore:StreamingHttpResponse must consume asynchronous iterators')
+    def test_wsgi_requests_answer_at_once(self, authenticated_client, sample_diagnosis):
+        """Ensures a pending analysis never holds one of the few WSGI request threads"""
+        client, _ = authenticated_client
+        started = time.monotonic()
+
+        response = client.get(self.url(sample_diagnosis, 'wait'), {'timeout': '10'})
+        body = b''.join(client.get(self.url(sample_diagnosis, 'events'))).decode()
+
+        assert time.monotonic() - started < 2
+        assert response.json()['analysis_status'] == 'pending'
+        assert response['Retry-After'] == '5'
+        assert body == 'retry: 5000\n\n'
+
+    def test_endpoints_are_scoped_to_the_doctor(self, sample_diagnosis):
+        other_user = User.objects.create_user(email='otherdoc@test.com', password='pass123')
+        Profile.objects.create(user=other_user, full_name='Dr. Other')
+        other = APIClient()
+        other.force_authenticate(user=other_user)
+
+        assert other.get(self.url(sample_diagnosis, 'wait')).status_code == status.HTTP_404_NOT_FOUND
+        assert other.get(self.url(sample_diagnosis, 'events')).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestResponseCache:
+    """Tests for the per-doctor response cache"""
+
+    def test_repeat_reads_skip_the_database(self, authenticated_client, sample_diagnosis,
+                                            django_assert_num_queries):
+        client, _ = authenticated_client
+        url = f'/api/patients/{sample_diagnosis.patient_id}/diagnoses/{sample_diagnosis.id}/'
+        first = client.get(url)
+
+        # force_authenticate keeps the doctor's profile loaded, so nothing at all
+        with django_assert_num_queries(0):
+            second = client.get(url)
+
+        assert second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+        assert second['ETag'] == first['ETag']
+
+    def test_writes_invalidate_the_doctors_responses(self, authenticated_client, sample_patient):
+        client, _ = authenticated_client
+        assert client.get('/api/patients/').data['results'][0]['full_name'] == 'John Doe'
+
+        sample_patient.full_name = 'John Smith'
+        sample_patient.save()
+
+        assert client.get('/api/patients/').data['results'][0]['full_name'] == 'John Smith'
+
+    def test_finished_analysis_invalidates_the_diagnosis(self, authenticated_client, sample_diagnosis,
+                                                         fake_inference):
+        """Ensures the queryset updates of the job worker, which send no signals, still invalidate"""
+        client, _ = authenticated_client
+        url = f'/api/patients/{sample_diagnosis.patient_id}/diagnoses/{sample_diagnosis.id}/'
+        assert client.get(url).data['analysis_status'] == 'pending'
+
+        AnalysisJob.objects.create(diagnosis=sample_diagnosis)
+        Worker(concurrency=1, burst=True).run()
+
+        response = client.get(url)
+        assert response.data['analysis_status'] == 'completed'
+        assert response.data['ejection_fraction'] == 60.0
+        assert response.data['interpretations']
+
+    def test_invalidation_reaches_other_processes(self, authenticated_client, sample_diagnosis, settings, tmp_path):
+        """Ensures a version bumped by another process, such as the job worker, is seen through a shared backend"""
+        backend = 'django.core.cache.backends.filebased.FileBasedCache'
+        settings.CACHES = {**settings.CACHES, 'responses': {'BACKEND': backend, 'LOCATION': str(tmp_path)}}
+        client, profile = authenticated_client
+        url = f'/api/patients/{sample_diagnosis.patient_id}/diagnoses/{sample_diagnosis.id}/'
+        client.get(url)
+        Diagnosis.objects.filter(id=sample_diagnosis.id).update(ejection_fraction=61.0)
+        assert client.get(url).data['ejection_fraction'] != 61.0
+
+        subprocess.run(
+            [sys.executable, '-c', 'import django; django.setup(); from patients.response_cache import bump_doctors; '
+                                   f'bump_doctors([{profile.id}])'],
+            env={**os.environ, 'RESPONSE_CACHE_BACKEND': backend, 'RESPONSE_CACHE_LOCATION': str(tmp_path)},
+            cwd=settings.BASE_DIR, check=True,
+        )
+
+        assert client.get(url).data['ejection_fraction'] == 61.0
+
+    def test_default_backend_is_shared_between_processes(self, authenticated_client, sample_diagnosis, settings):
+        """Ensures runserver sees what the job worker, a separate process, bumps under the default settings"""
+        client, profile = authenticated_client
+        url = f'/api/patients/{sample_diagnosis.patient_id}/diagnoses/{sample_diagnosis.id}/'
+        client.get(url)
+        Diagnosis.objects.filter(id=sample_diagnosis.id).update(ejection_fraction=61.0)
+
+        env = {name: value for name, value in os.environ.items() if not name.startswith('RESPONSE_CACHE_')}
+        subprocess.run(
+            [sys.executable, '-c', 'import django; django.setup(); from patients.response_cache import bump_doctors; '
+                                   f'bump_doctors([{profile.id}])'],
+            env={**env, 'DJANGO_SETTINGS_MODULE': 'fyp_backend.settings'}, cwd=settings.BASE_DIR, check=True,
+        )
+
+        assert client.get(url).data['ejection_fraction'] == 61.0
+
+    def test_unchanged_response_is_not_modified(self, authenticated_client, sample_patient):
+        client, _ = authenticated_client
+        url = f'/api/patients/{sample_patient.id}/'
+        etag = client.get(url)['ETag']
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+        assert response['ETag'] == etag
+        assert 'private' in response['Cache-Control']
+
+        sample_patient.full_name = 'John Smith'
+        sample_patient.save()
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+
+    def test_cache_is_per_doctor(self, authenticated_client, sample_patient):
+        client, _ = authenticated_client
+        assert client.get(f'/api/patients/{sample_patient.id}/').status_code == status.HTTP_200_OK
+
+        other_user = User.objects.create_user(email='otherdoc@test.com', password='pass123')
+        Profile.objects.create(user=other_user, full_name='Dr. Other')
+        other = APIClient()
+        other.force_authenticate(user=other_user)
+
+        assert other.get(f'/api/patients/{sample_patient.id}/').status_code == status.HTTP_404_NOT_FOUND
+        assert other.get('/api/patients/').data['results'] == []
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """
+    A temporary upload that carries the SHA-256 of its bytes.
+
+    It is created in ECHO_UPLOAD_TEMP_DIR, which should sit on the same
+    filesystem as MEDIA_ROOT so that storing it is a rename, not a copy.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        temp_dir = settings.ECHO_UPLOAD_TEMP_DIR or settings.FILE_UPLOAD_TEMP_DIR
+        if temp_dir:
+            os.makedirs(temp_dir, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=temp_dir)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """
+    Writes each uploaded chunk straight to disk while hashing it, so an echo is
+    read from the socket once and memory use is bounded by ``chunk_size``
+    whatever the length of the video.
+    """
+    chunk_size = 64 * 2 ** 10
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.digest.update(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.digest.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            temp_location = self.file.temporary_file_path()
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from patients.jobs import enqueue_analysis, enqueue_previews
+from patients.models import Diagnosis, EchoBlob, UploadSession
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class AlreadyFinalized(UploadError):
+    def __init__(self, diagnosis):
+        super().__init__("Upload has already been finalized")
+        self.diagnosis = diagnosis
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f"Expected a chunk starting at byte {offset}")
+        self.offset = offset
+
+
+def parse_content_range(header, session):
+    """Return ``(start, length)`` for a ``Content-Range: bytes start-end/total`` header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError("Content-Range header must look like 'bytes <start>-<end>/<total>'")
+
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    if end < start:
+        raise UploadError("Content-Range end is before start")
+    if total != '*' and int(total) != session.size:
+        raise UploadError(f"Content-Range total does not match the upload size of {session.size} bytes")
+    if end >= session.size:
+        raise UploadError("Chunk extends past the end of the upload")
+    return start, end - start + 1
+
+
+def write_chunk(session, start, length, stream):
+    """
+    Append ``length`` bytes read from ``stream`` at ``start`` to the session's
+    part file, which is written straight to disk in small reads.
+
+    Chunks must arrive in order; a chunk that does not start at the current
+    offset raises ``OffsetMismatch`` so the client can resume from there.
+    """
+    if start != session.offset:
+        raise OffsetMismatch(session.offset)
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(f"Chunks may be at most {settings.UPLOAD_CHUNK_MAX_SIZE} bytes")
+
+    os.makedirs(os.path.dirname(session.path), exist_ok=True)
+    mode = 'r+b' if os.path.exists(session.path) else 'wb'
+    written = 0
+    with open(session.path, mode) as part:
+        part.seek(start)
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            part.write(data)
+            written += len(data)
+        part.truncate()
+
+    if written != length:
+        raise UploadError(f"Received {written} of {length} bytes, resend the chunk")
+
+    # Guard against two clients resuming the same session concurrently
+    updated = UploadSession.objects.filter(id=session.id, offset=start).update(offset=start + written)
+    if not updated:
+        session.refresh_from_db(fields=['offset'])
+        raise OffsetMismatch(session.offset)
+    session.offset = start + written
+    return session.offset
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for data in iter(lambda: part.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class PartFile(File):
+    """Lets FileSystemStorage move the finished part file instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def direct_upload_target(session):
+    """Return the presigned request the client sends the echo bytes with."""
+    return default_storage.presigned_put(session.object_name, session.content_type, session.size, session.sha256)
+
+
+def finalize(session):
+    """
+    Verify a completed upload and turn it into a queued ``Diagnosis``.
+
+    The session row is locked for the duration, so of concurrent calls, such
+    as a client retrying after a timeout, one creates the diagnosis and the
+    others get ``AlreadyFinalized`` with it.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().select_related('patient', 'diagnosis').get(
+            pk=session.pk)
+        if session.status != UploadSession.STATUS_ACTIVE:
+            raise AlreadyFinalized(session.diagnosis)
+        if session.mode == UploadSession.MODE_DIRECT:
+            return _finalize_direct(session)
+        diagnosis = _finalize_chunked(session)
+
+    # acquire() moves the file when the content is new; drop it if it was a duplicate
+    if os.path.exists(session.path):
+        os.remove(session.path)
+    return diagnosis
+
+
+def _finalize_chunked(session):
+    if session.offset != session.size:
+        raise UploadError(f"Upload is incomplete: {session.offset} of {session.size} bytes received")
+
+    sha256 = _hash_file(session.path)
+    if session.sha256 and session.sha256 != sha256:
+        raise UploadError("Uploaded bytes do not match the declared sha256")
+
+    with open(session.path, 'rb') as part:
+        echo = PartFile(part, name=session.filename)
+        echo.sha256 = sha256
+        diagnosis = Diagnosis(patient=session.patient, echocardiogram=echo, **session.diagnosis_data)
+        diagnosis.save()
+    enqueue_analysis(diagnosis)
+    enqueue_previews(diagnosis)
+
+    session.status = UploadSession.STATUS_COMPLETED
+    session.diagnosis = diagnosis
+    session.save(update_fields=['status', 'diagnosis', 'updated_at'])
+    return diagnosis
+
+
+def _stored_sha256(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _finalize_direct(session):
+    # Storage verified the bytes against sha256 on upload, so normally only
+    # metadata is read. Services that do not record checksums are hashed here.
+    stat = default_storage.stat(session.object_name)
+    if stat is None:
+        raise UploadError("The echo has not been uploaded to storage yet")
+    if stat['size'] != session.size:
+        raise UploadError(f"Uploaded {stat['size']} bytes, expected {session.size}")
+    if stat['content_type'] != session.content_type:
+        raise UploadError(f"Uploaded content type {stat['content_type']!r} does not match {session.content_type!r}")
+    if (stat['sha256'] or _stored_sha256(session.object_name)) != session.sha256:
+        raise UploadError("Uploaded bytes do not match the declared sha256")
+
+    blob = EchoBlob.objects.adopt(session.object_name, session.sha256, session.size)
+    diagnosis = Diagnosis(patient=session.patient, echo_blob=blob, **session.diagnosis_data)
+    diagnosis.save()
+    enqueue_analysis(diagnosis)
+    enqueue_previews(diagnosis)
+
+    session.status = UploadSession.STATUS_COMPLETED
+    session.offset = session.size
+    session.diagnosis = diagnosis
+    session.save(update_fields=['status', 'offset', 'diagnosis', 'updated_at'])
+    return diagnosis
+
+
+def discard(session):
+    if session.mode == UploadSession.MODE_DIRECT:
+        default_storage.delete(session.object_name)
+    elif os.path.exists(session.path):
+        os.remove(session.path)
+    session.delete()
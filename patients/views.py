@@ -1,30 +1,41 @@
-import json
-import os
-import random
-import time
-
-import requests
-from rest_framework import generics, permissions
+from django.core.files.storage import default_storage
+from django.db import transaction
+from rest_framework import generics, permissions, status
+from rest_framework.generics import get_object_or_404
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.response import Response
 
-from patients.models import Patient, Diagnosis, Interpretation
-from patients.serializers import PatientSerializer, DiagnosisSerializer
+from patients.jobs import enqueue_analysis, enqueue_previews
+from patients.models import Patient, Diagnosis, UploadSession
+from patients.pagination import DiagnosisCursorPagination, PatientCursorPagination
+from patients.response_cache import CachedResponseMixin
+from patients.serializers import PatientSerializer, PatientListSerializer, DiagnosisSerializer, \
+    DiagnosisListSerializer, UploadSessionSerializer, DirectUploadSerializer
+from patients.uploadhandlers import HashingFileUploadHandler
+from patients.uploads import AlreadyFinalized, OffsetMismatch, UploadError, direct_upload_target, discard, finalize, \
+    parse_content_range, write_chunk
 
 
-class PatientListCreateView(generics.ListCreateAPIView):
+class PatientListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PatientCursorPagination
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return PatientListSerializer
+        return PatientSerializer
 
     def get_queryset(self):
         # Only return patients associated with the logged-in doctor's profile
-        return Patient.objects.filter(doctor=self.request.user.profile)
+        return Patient.objects.filter(doctor=self.request.user.profile).only(*PatientListSerializer.Meta.fields)
 
     def perform_create(self, serializer):
         serializer.save(doctor=self.request.user.profile)
 
 
-class PatientDetailView(generics.RetrieveAPIView):
+class PatientDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -33,130 +44,40 @@ class PatientDetailView(generics.RetrieveAPIView):
         return Patient.objects.filter(doctor=self.request.user.profile)
 
 
-class DiagnosisListCreateView(generics.ListCreateAPIView):
+class DiagnosisListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
     serializer_class = DiagnosisSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)
-    ECHO_ANALYSIS_URL = 'empty_for_now'
+    pagination_class = DiagnosisCursorPagination
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Must be set before the body is parsed
+        request.upload_handlers = [HashingFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return DiagnosisListSerializer
+        return DiagnosisSerializer
 
     def get_queryset(self):
         patient_id = self.kwargs.get('patient_id')
         return Diagnosis.objects.filter(
             patient_id=patient_id,
             patient__doctor=self.request.user.profile
-        ).prefetch_related('interpretations').order_by('-diagnosis_date')
+        ).select_related('echo_blob').only(*DiagnosisListSerializer.Meta.columns)
 
     def perform_create(self, serializer):
         patient_id = self.kwargs.get('patient_id')
         patient = Patient.objects.get(id=patient_id, doctor=self.request.user.profile)
 
-        diagnosis = serializer.save(patient=patient)
+        with transaction.atomic():
+            diagnosis = serializer.save(patient=patient)
+            enqueue_analysis(diagnosis)
+            enqueue_previews(diagnosis)
 
-        try:
-            self.analyze_echo(diagnosis)
-        except Exception as e:
-            print(f"Error analyzing echo: {str(e)}")
-
-        self.create_interpretations(diagnosis)
-
-    def create_interpretations(self, diagnosis):
-        ef = diagnosis.ejection_fraction
-
-        if ef >= 75:
-            interpretations = [
-                "Dangerously elevated ejection fraction (≥75%) suggesting possible Hypertrophic Cardiomyopathy",
-                "High risk condition requiring immediate attention due to potential cardiac arrest risk",
-                "Impaired ventricular filling due to extremely high ejection fraction"
-            ]
-        elif 50 <= ef <= 70:
-            interpretations = [
-                f"Normal ejection fraction ({ef}%) indicating preserved systolic function",
-                "Heart pumping function within normal range",
-                "Consider monitoring for HFpEF despite normal ejection fraction"
-            ]
-        elif 41 <= ef <= 49:
-            interpretations = [
-                f"Borderline low ejection fraction ({ef}%) indicating mild systolic dysfunction",
-                "May experience mild symptoms during physical activity",
-                "Regular monitoring and follow-up recommended"
-            ]
-        elif 30 <= ef <= 40:
-            interpretations = [
-                f"Moderately abnormal ejection fraction ({ef}%) indicating significant dysfunction",
-                "Patient may experience symptoms even at rest",
-                "Close monitoring and therapy adjustment may be needed"
-            ]
-        else:  # ef < 30
-            interpretations = [
-                f"Severely abnormal ejection fraction ({ef}%) indicating critical cardiac dysfunction",
-                "High risk condition requiring immediate medical attention",
-                "Patient likely experiencing severe symptoms with risk of cardiac arrest"
-            ]
-
-        num_interpretations = random.randint(2, 3)
-        selected_interpretations = random.sample(interpretations, num_interpretations)
-
-        for interpretation in selected_interpretations:
-            Interpretation.objects.create(
-                diagnosis=diagnosis,
-                note=interpretation
-            )
-
-    def analyze_echo(self, diagnosis):
-        try:
-            API_URL = "https://fe60-124-13-17-173.ngrok-free.app/predict"
-
-            files = {
-                'video': diagnosis.echocardiogram.file
-            }
-
-            demo_data = {
-                'age': diagnosis.patient.get_age(),
-                'weight': diagnosis.patient.weight if diagnosis.patient.weight else 70,
-                'height': diagnosis.patient.height if diagnosis.patient.height else 180,
-            }
-
-            data = {
-                'view': diagnosis.view_type,
-                'demographic_data': json.dumps(demo_data),
-            }
-
-            # diagnosis.ejection_fraction = self.get_random_ef()
-            # diagnosis.save()
-
-            response = requests.post(API_URL, files=files, data=data)
-
-            if response.status_code == 200:
-                result = response.json()
-                diagnosis.ejection_fraction = result['ef_prediction']
-                diagnosis.save()
-            else:
-                error_message = response.json().get('detail', 'Unknown error')
-                raise Exception(f"API Error: {error_message}")
-
-        except requests.RequestException as e:
-            print(f"Error calling inference API: {str(e)}")
-            raise
-        except Exception as e:
-            print(f"Error in analyze_echo: {str(e)}")
-            raise
-        finally:
-            diagnosis.echocardiogram.close()
-
-    def get_random_ef(self):
-        time.sleep(4)
-        weights = [
-            (55, 70, 50),
-            (40, 54, 25),
-            (71, 90, 15),
-            (10, 39, 10)
-        ]
-
-        chosen_range = random.choices(weights, weights=[w[2] for w in weights])[0]
-        return random.randint(chosen_range[0], chosen_range[1])
-
-
-class DiagnosisDetailView(generics.RetrieveAPIView):
+
+class DiagnosisDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     serializer_class = DiagnosisSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -164,4 +85,90 @@ class DiagnosisDetailView(generics.RetrieveAPIView):
         patient_id = self.kwargs.get('patient_id')
         return Diagnosis.objects.filter(
             patient_id=patient_id,
-            patient__doctor=self.request.user.profile)
+            patient__doctor=self.request.user.profile).select_related('echo_blob')
+
+
+class UploadSessionCreateView(generics.CreateAPIView):
+    """Starts a resumable echo upload for one of the doctor's patients."""
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        profile = self.request.user.profile
+        patient = get_object_or_404(Patient, id=self.kwargs.get('patient_id'), doctor=profile)
+        serializer.save(patient=patient, doctor=profile)
+
+
+class DirectUploadCreateView(UploadSessionCreateView):
+    """
+    Starts an upload that the client sends straight to object storage with
+    the returned presigned request, then completes with the finalize view.
+    The echo bytes never pass through the app.
+    """
+    serializer_class = DirectUploadSerializer
+
+    def create(self, request, *args, **kwargs):
+        if not hasattr(default_storage, 'presigned_put'):
+            return Response({'detail': 'Direct uploads need object storage, use the resumable uploads instead.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        data = {**serializer.data, 'upload': direct_upload_target(serializer.instance)}
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionDetailView(generics.RetrieveDestroyAPIView):
+    """
+    GET reports the offset to resume from, PUT appends a chunk described by a
+    Content-Range header, DELETE abandons the upload.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(doctor=self.request.user.profile)
+
+    def put(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.status != UploadSession.STATUS_ACTIVE:
+            return Response({'detail': 'Upload has already been finalized.'}, status=status.HTTP_409_CONFLICT)
+        if session.mode == UploadSession.MODE_DIRECT:
+            return Response({'detail': 'Direct uploads are sent to storage, not in chunks.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start, length = parse_content_range(request.headers.get('Content-Range'), session)
+            write_chunk(session, start, length, request.stream)
+        except OffsetMismatch as e:
+            return Response({'detail': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except UploadError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance):
+        discard(instance)
+
+
+class UploadSessionFinalizeView(generics.GenericAPIView):
+    """Verifies a fully uploaded echo and creates the diagnosis from it."""
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(doctor=self.request.user.profile).select_related('patient')
+
+    def post(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            diagnosis = finalize(session)
+        except AlreadyFinalized as e:
+            return Response({'detail': str(e), 'diagnosis': e.diagnosis.id if e.diagnosis else None},
+                            status=status.HTTP_409_CONFLICT)
+        except UploadError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = DiagnosisSerializer(diagnosis, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -69,20 +69,25 @@ class TestAPIContracts:
 
         # Schema definition of what we expect
         expected_schema = {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "required": ["id", "full_name", "gender", "date_of_birth"],
-                "properties": {
-                    "id": {"type": "integer"},
-                    "full_name": {"type": "string"},
-                    "date_of_birth": {"type": "string", "format": "date"},
-                    "patient_id": {"type": ["string", "null"]},
-                    "gender": {"type": "string", "enum": ["M", "F"]},
-                    "weight": {"type": ["number", "null"]},
-                    "height": {"type": ["number", "null"]},
-                    "phone_number": {"type": ["string", "null"]},
-                    "address": {"type": ["string", "null"]}
+            "type": "object",
+            "required": ["next", "previous", "results"],
+            "properties": {
+                "next": {"type": ["string", "null"]},
+                "previous": {"type": ["string", "null"]},
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "required": ["id", "full_name", "gender", "date_of_birth"],
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "full_name": {"type": "string"},
+                            "date_of_birth": {"type": "string", "format": "date"},
+                            "patient_id": {"type": ["string", "null"]},
+                            "gender": {"type": "string", "enum": ["M", "F"]},
+                            "created_at": {"type": "string", "format": "date-time"}
+                        }
+                    }
                 }
             }
         }
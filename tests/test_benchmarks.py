@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from benchmarks.fake_inference import FakeInferenceServer
+from benchmarks.load import SCENARIOS, percentile
+from benchmarks.startup import HEAVY_MODULES, profile
+from patients.inference import InferenceClient, InferenceUnavailable
+from patients.models import Patient
+
+
+def echo():
+    return ContentFile(b"echo bytes", name='echo.avi')
+
+
+@pytest.fixture
+def fake_server():
+    with FakeInferenceServer(latency=0.01) as server:
+        yield server
+
+
+class TestFakeInferenceServer:
+    """Tests for the inference stand-in used by the benchmarks"""
+
+    def test_answers_the_inference_client(self, fake_server):
+        client = InferenceClient(fake_server.url, max_retries=0)
+
+        ef = client.predict(echo(), 'a4c', {'age': 40})
+        batch = client.predict_batch([(echo(), 'a4c', {}), (echo(), 'psax', {})])
+
+        assert 20 <= ef <= 75
+        assert len(batch) == 2
+        assert fake_server.predictions == 3
+
+    def test_injected_failures(self):
+        with FakeInferenceServer(latency=0, error_rate=1.0) as server:
+            client = InferenceClient(server.url, max_retries=0)
+            with pytest.raises(InferenceUnavailable, match='503'):
+                client.predict(echo(), 'a4c', {})
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) == 0.0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_command_runs_every_scenario(tmp_path):
+    output = io.StringIO()
+    results_path = tmp_path / 'results.json'
+
+    call_command('benchmark', '--requests', '4', '--concurrency', '1', '--doctors', '2', '--patients', '2',
+                 '--echo-size', '1024', '--inference-latency', '0', '--inference-jitter', '0',
+                 '--worker-concurrency', '1', '--analysis-timeout', '30', '--json', str(results_path),
+                 stdout=output)
+
+    results = json.loads(results_path.read_text())['results']
+    assert [result['scenario'] for result in results] == SCENARIOS + ['analysis']
+    assert all(result['requests'] == 4 and result['errors'] == 0 for result in results)
+    assert 'p99 ms' in output.getvalue()
+    assert not Patient.objects.exists()
+
+
+class TestStartupProfile:
+    """Tests for keeping the ML stack out of processes that do not use it"""
+
+    def test_serving_the_app_imports_no_heavy_modules(self):
+        result = profile('app', settings.SETTINGS_MODULE)
+
+        assert result['heavy'] == []
+        assert result['seconds'] > 0 and result['loaded_modules'] > 0
+
+    def test_analysis_modules_defer_their_heavy_imports(self):
+        """Ensures the job worker and inference modules only import the ML stack when they run it"""
+        code = (
+            'import sys, django; django.setup(); '
+            'import patients.jobs, patients.local_inference, patients.preprocessing, patients.previews, '
+            'patients.async_views, fyp_backend.storage; '
+            f'print([m for m in {HEAVY_MODULES!r} if m in sys.modules])'
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                   cwd=settings.BASE_DIR, env=env)
+
+        assert completed.stdout.strip() == '[]'
+
+    def test_command_reports_each_group(self, tmp_path):
+        output = io.StringIO()
+        results_path = tmp_path / 'startup.json'
+
+        call_command('startup_profile', '--groups', 'app', 'inference-http', '--repeat', '1',
+                     '--json', str(results_path), stdout=output)
+
+        results = json.loads(results_path.read_text())['results']
+        assert [result['group'] for result in results] == ['app', 'inference-http']
+        assert 'httpx' in results[1]['heavy']
+        assert 'import ms' in output.getvalue()
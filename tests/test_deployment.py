@@ -0,0 +1,128 @@
+import os
+import runpy
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+GUNICORN_CONFIG = str(Path(settings.BASE_DIR) / 'gunicorn.conf.py')
+PRODUCTION_SETTINGS = str(Path(settings.BASE_DIR) / 'fyp_backend' / 'settings_production.py')
+
+
+def load_config(monkeypatch, **env):
+    for name in ('SERVER_INTERFACE', 'WEB_CONCURRENCY', 'GUNICORN_MAX_REQUESTS'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 4)
+    return runpy.run_path(GUNICORN_CONFIG)
+
+
+class TestGunicornConfig:
+    """Tests for the production server settings"""
+
+    def test_wsgi_workers_follow_the_cpu_count(self, monkeypatch):
+        config = load_config(monkeypatch)
+
+        assert config['wsgi_app'] == 'fyp_backend.wsgi:application'
+        assert (config['worker_class'], config['workers'], config['threads']) == ('gthread', 9, 4)
+        assert config['preload_app']
+        assert (config['max_requests'], config['max_requests_jitter']) == (1000, 100)
+
+    def test_asgi_uses_uvicorn_workers(self, monkeypatch):
+        config = load_config(monkeypatch, SERVER_INTERFACE='asgi', WEB_CONCURRENCY='3')
+
+        assert config['wsgi_app'] == 'fyp_backend.asgi:application'
+        assert config['worker_class'] == 'uvicorn_worker.UvicornWorker'
+        assert config['workers'] == 3
+
+
+def test_production_settings_disable_debug(monkeypatch):
+    monkeypatch.setenv('ALLOWED_HOSTS', 'api.example.com, 10.0.0.1')
+    monkeypatch.setenv('DJANGO_SECRET_KEY', 'production-secret')
+    production = runpy.run_path(PRODUCTION_SETTINGS)
+
+    assert production['DEBUG'] is False
+    assert production['SECRET_KEY'] == 'production-secret'
+    assert production['CACHES']['responses']['BACKEND'] == 'django.core.cache.backends.db.DatabaseCache'
+    assert settings.CACHES['responses']['BACKEND'] == 'django.core.cache.backends.filebased.FileBasedCache'
+    assert production['ALLOWED_HOSTS'] == ['api.example.com', '10.0.0.1']
+    assert production['INFERENCE_SERVICE'] == settings.INFERENCE_SERVICE
+
+
+def test_production_settings_require_a_secret_key(monkeypatch):
+    monkeypatch.delenv('DJANGO_SECRET_KEY', raising=False)
+
+    with pytest.raises(ImproperlyConfigured, match='DJANGO_SECRET_KEY'):
+        runpy.run_path(PRODUCTION_SETTINGS)
+
+
+def test_production_settings_refuse_a_per_process_response_cache(monkeypatch):
+    monkeypatch.setenv('DJANGO_SECRET_KEY', 'production-secret')
+    monkeypatch.setenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+    with pytest.raises(ImproperlyConfigured, match='RESPONSE_CACHE_BACKEND'):
+        runpy.run_path(PRODUCTION_SETTINGS)
+
+
+CACHED_GET = """
+import django
+django.setup()
+from django.core.management import call_command
+from rest_framework.test import APIClient
+from accounts.admin import User
+from accounts.models import Profile
+
+call_command('migrate', verbosity=0)
+user = User.objects.create_user(email='doctor@test.com', password='testpass123')
+Profile.objects.create(user=user, full_name='Dr. Test Doctor')
+client = APIClient()
+client.force_authenticate(user=user)
+first = client.get('/api/patients/')
+second = client.get('/api/patients/', HTTP_IF_NONE_MATCH=first['ETag'])
+print(first.status_code, second.status_code)
+"""
+
+
+COLLECTED_STATIC = """
+import sys
+from django.conf import settings
+settings.STATIC_ROOT = sys.argv[1]
+import django
+django.setup()
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.test import Client
+
+call_command('collectstatic', interactive=False, verbosity=0)
+response = Client().get(static('admin/css/base.css'))
+print(response.status_code, response['Cache-Control'])
+"""
+
+
+def run_production(script, tmp_path, *args):
+    """Run ``script`` in a new process under the production settings and a fresh database"""
+    env = {name: value for name, value in os.environ.items() if not name.startswith('RESPONSE_CACHE_')}
+    env.update(DJANGO_SETTINGS_MODULE='fyp_backend.settings_production', DJANGO_SECRET_KEY='production-secret',
+               ALLOWED_HOSTS='testserver', DATABASE_URL=f'sqlite:///{tmp_path / "db.sqlite3"}')
+    return subprocess.run([sys.executable, '-c', script, *args], env=env, cwd=settings.BASE_DIR,
+                          capture_output=True, text=True)
+
+
+def test_production_settings_serve_cached_responses_after_migrate(tmp_path):
+    """Ensures the migrations create the database cache table the production settings use"""
+    result = run_production(CACHED_GET, tmp_path)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['200', '304']
+
+
+def test_production_settings_serve_collected_static_files(tmp_path):
+    """Ensures the workers serve the admin assets with DEBUG off, under their hashed names"""
+    result = run_production(COLLECTED_STATIC, tmp_path, str(tmp_path / 'static'))
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['200', 'max-age=315360000,', 'public,', 'immutable']
@@ -0,0 +1,139 @@
+from urllib.parse import urlparse
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+
+from accounts.admin import User
+from accounts.models import Profile
+from patients.models import Diagnosis, Patient
+
+ECHO = bytes(range(256)) * 40
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.MEDIA_OFFLOAD = None
+    return tmp_path
+
+
+def make_doctor(email):
+    user = User.objects.create_user(email=email, password='testpass123')
+    profile = Profile.objects.create(user=user, full_name='Dr. Test', phone_number='+1234567890',
+                                     specialization='Cardiology')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client, profile
+
+
+@pytest.fixture
+def doctor():
+    return make_doctor('doctor@test.com')
+
+
+@pytest.fixture
+def echo(doctor):
+    _, profile = doctor
+    patient = Patient.objects.create(doctor=profile, full_name='John Doe', gender='M')
+    diagnosis = Diagnosis.objects.create(patient=patient, echocardiogram=SimpleUploadedFile("echo.avi", ECHO))
+    return diagnosis.echocardiogram.name
+
+
+def media_url(name):
+    return f'/media/{name}'
+
+
+@pytest.mark.django_db
+class TestMediaView:
+    """Tests for authenticated media serving"""
+
+    def test_owner_gets_the_whole_file(self, doctor, echo):
+        client, _ = doctor
+        response = client.get(media_url(echo))
+
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == ECHO
+        assert response['Accept-Ranges'] == 'bytes'
+        assert response['ETag']
+
+    def test_profile_pictures_are_private(self, doctor, media_root):
+        """Ensures a doctor sees their own picture and the default avatar, not another doctor's picture"""
+        client, profile = doctor
+        other_client, other = make_doctor('other@test.com')
+        other.profile_picture = SimpleUploadedFile("me.jpg", b"picture")
+        other.save()
+        default_storage.save(profile.profile_picture.name, SimpleUploadedFile("default.jpg", b"avatar"))
+
+        assert other_client.get(media_url(other.profile_picture.name)).status_code == 200
+        assert client.get(media_url(other.profile_picture.name)).status_code == 404
+        assert client.get(media_url(profile.profile_picture.name)).status_code == 200
+
+    def test_range_returns_only_the_requested_bytes(self, doctor, echo):
+        """Ensures seeking in a player fetches a slice rather than the whole echo"""
+        client, _ = doctor
+
+        response = client.get(media_url(echo), HTTP_RANGE='bytes=1000-1999')
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes 1000-1999/{len(ECHO)}'
+        assert b''.join(response.streaming_content) == ECHO[1000:2000]
+
+        suffix = client.get(media_url(echo), HTTP_RANGE='bytes=-100')
+        assert b''.join(suffix.streaming_content) == ECHO[-100:]
+
+    def test_unsatisfiable_range(self, doctor, echo):
+        client, _ = doctor
+        response = client.get(media_url(echo), HTTP_RANGE=f'bytes={len(ECHO)}-')
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == f'bytes */{len(ECHO)}'
+
+    def test_stale_if_range_gets_the_whole_file(self, doctor, echo):
+        client, _ = doctor
+        response = client.get(media_url(echo), HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+
+        assert response.status_code == 200
+
+    def test_conditional_get_is_not_modified(self, doctor, echo):
+        client, _ = doctor
+        etag = client.get(media_url(echo))['ETag']
+
+        response = client.get(media_url(echo), HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert not response.content
+
+    def test_other_doctors_cannot_see_the_echo(self, echo):
+        client, _ = make_doctor('other@test.com')
+        assert client.get(media_url(echo)).status_code == 404
+
+    def test_anonymous_requests_need_a_signature(self, echo):
+        assert APIClient().get(media_url(echo)).status_code == 401
+
+    def test_signed_url_works_without_credentials(self, echo):
+        """Ensures URLs from the API can be used directly by <video> tags"""
+        url = default_storage.url(echo)
+        assert urlparse(url).path == media_url(echo)
+        assert APIClient().get(url).status_code == 200
+
+        tampered = url.replace('signature=', 'signature=x')
+        assert APIClient().get(tampered).status_code == 401
+
+    def test_unlisted_prefixes_are_never_served(self, doctor, media_root):
+        client, _ = doctor
+        (media_root / 'tensors').mkdir()
+        (media_root / 'tensors' / 'a.npy').write_bytes(b'tensor')
+
+        assert client.get('/media/tensors/a.npy').status_code == 404
+        assert client.get('/media/echos/../tensors/a.npy').status_code == 404
+
+    def test_offload_to_front_proxy(self, doctor, echo, settings):
+        client, _ = doctor
+        settings.MEDIA_OFFLOAD = 'x-accel-redirect'
+
+        response = client.get(media_url(echo))
+
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == f'/protected-media/{echo}'
+        assert not response.content
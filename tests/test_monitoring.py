@@ -0,0 +1,125 @@
+import logging
+
+import pytest
+from rest_framework.test import APIClient
+
+from accounts.admin import User
+from accounts.models import Profile
+from fyp_backend import metrics
+from fyp_backend.monitoring import inference_timer, request_duration, request_inference_duration, \
+    request_queries, requests_total
+from patients.models import Patient
+from patients.views import PatientListCreateView
+
+
+@pytest.fixture
+def doctor():
+    user = User.objects.create_user(email='doctor@test.com', password='testpass123')
+    profile = Profile.objects.create(user=user, full_name='Dr. Test', phone_number='+1234567890',
+                                     specialization='Cardiology')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client, profile
+
+
+class TestMetricsRegistry:
+    """Tests for histograms and the Prometheus text format"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ['view'], buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, view='a')
+
+        samples = {(name, labels.get('le')): value for name, labels, value in histogram.samples()}
+
+        assert samples[('test_seconds_bucket', '0.1')] == 2
+        assert samples[('test_seconds_bucket', '1')] == 3
+        assert samples[('test_seconds_bucket', '+Inf')] == 4
+        assert samples[('test_seconds_count', None)] == 4
+        assert histogram.sum(view='a') == pytest.approx(3.65)
+
+    def test_exposition_format(self):
+        metrics.counter('test_exposition_total', 'Says "hi"', ['path']).inc(path='a"b')
+
+        text = metrics.exposition()
+
+        assert '# HELP test_exposition_total Says "hi"\n' in text
+        assert '# TYPE test_exposition_total counter\n' in text
+        assert 'test_exposition_total{path="a\\"b"} 1\n' in text
+
+
+@pytest.mark.django_db
+class TestPerformanceMiddleware:
+    """Tests for per-request performance instrumentation"""
+
+    def test_records_latency_and_queries_per_view(self, doctor):
+        client, profile = doctor
+        Patient.objects.create(doctor=profile, full_name='John Doe', gender='M')
+        labels = {'view': 'PatientListCreateView', 'method': 'GET'}
+        requests_before = requests_total.value(status=200, **labels)
+        count_before = request_duration.count(**labels)
+        queries_before = request_queries.sum(**labels)
+
+        assert client.get('/api/patients/').status_code == 200
+
+        assert requests_total.value(status=200, **labels) == requests_before + 1
+        assert request_duration.count(**labels) == count_before + 1
+        assert request_queries.sum(**labels) > queries_before
+
+    def test_unresolved_urls_share_a_label(self, doctor):
+        client, _ = doctor
+        before = requests_total.value(view='unmatched', method='GET', status=404)
+
+        client.get('/api/no-such-endpoint/')
+
+        assert requests_total.value(view='unmatched', method='GET', status=404) == before + 1
+
+    def test_inference_time_is_attributed_to_the_request(self, doctor, monkeypatch):
+        client, _ = doctor
+        get_queryset = PatientListCreateView.get_queryset
+
+        def get_queryset_with_inference(view):
+            with inference_timer('predict'):
+                return get_queryset(view)
+
+        monkeypatch.setattr(PatientListCreateView, 'get_queryset', get_queryset_with_inference)
+        labels = {'view': 'PatientListCreateView', 'method': 'GET'}
+        before = request_inference_duration.count(**labels)
+
+        client.get('/api/patients/')
+
+        assert request_inference_duration.count(**labels) == before + 1
+
+    def test_slow_requests_are_logged_with_sql(self, doctor, settings, caplog):
+        client, _ = doctor
+        settings.PERFORMANCE = {**settings.PERFORMANCE, 'SLOW_REQUEST_SECONDS': 1e-9}
+
+        with caplog.at_level(logging.WARNING, logger='fyp_backend.monitoring'):
+            client.get('/api/patients/')
+
+        message = caplog.records[-1].getMessage()
+        assert 'Slow request GET /api/patients/ (PatientListCreateView)' in message
+        assert 'patients_patient' in message
+
+
+@pytest.mark.django_db
+class TestMetricsEndpoint:
+    """Tests for the Prometheus scrape endpoint"""
+
+    def test_requires_the_token(self, settings):
+        settings.PERFORMANCE = {**settings.PERFORMANCE, 'METRICS_TOKEN': 'secret'}
+
+        assert APIClient().get('/metrics').status_code == 403
+        response = APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert b'# TYPE http_request_duration_seconds histogram' in response.content
+
+    def test_staff_sessions_can_scrape_without_a_token(self, settings):
+        settings.PERFORMANCE = {**settings.PERFORMANCE, 'METRICS_TOKEN': ''}
+        staff = User.objects.create_user(email='ops@test.com', password='testpass123', is_staff=True)
+        client = APIClient()
+        client.force_login(staff)
+
+        assert client.get('/metrics').status_code == 200
+        assert APIClient().get('/metrics').status_code == 403
@@ -0,0 +1,65 @@
+import pytest
+
+from patients.serializers import DiagnosisSerializer
+from patients.views import DiagnosisListCreateView
+
+# Authentication costs two queries: the user from the token, then the profile
+AUTH_QUERIES = 2
+
+
+@pytest.mark.django_db
+class TestEndpointQueryBudgets:
+    """Tests that endpoints run a constant number of queries however much data a doctor has"""
+
+    def test_patient_list(self, seeded_dataset, query_budget):
+        with query_budget(AUTH_QUERIES + 1, seconds=0.5):
+            response = seeded_dataset.client.get('/api/patients/?page_size=200')
+
+        assert len(response.data['results']) == min(seeded_dataset.size, 200)
+
+    def test_patient_detail(self, seeded_dataset, query_budget):
+        with query_budget(AUTH_QUERIES + 1, seconds=0.5):
+            response = seeded_dataset.client.get(f'/api/patients/{seeded_dataset.patient.id}/')
+
+        assert response.status_code == 200
+
+    def test_diagnosis_list(self, seeded_dataset, query_budget):
+        url = f'/api/patients/{seeded_dataset.patient.id}/diagnoses/?page_size=200'
+
+        with query_budget(AUTH_QUERIES + 1, seconds=0.5):
+            response = seeded_dataset.client.get(url)
+
+        assert len(response.data['results']) == min(seeded_dataset.size, 200)
+        assert response.data['results'][0]['poster_url']
+
+    def test_diagnosis_list_later_pages(self, seeded_dataset, query_budget):
+        """Ensures keyset pagination keeps deep pages as cheap as the first"""
+        first = seeded_dataset.client.get(f'/api/patients/{seeded_dataset.patient.id}/diagnoses/?page_size=5')
+
+        with query_budget(AUTH_QUERIES + 1, seconds=0.5):
+            response = seeded_dataset.client.get(first.data['next'])
+
+        assert len(response.data['results']) == 5
+
+    def test_diagnosis_detail_with_interpretations(self, seeded_dataset, query_budget):
+        url = f'/api/patients/{seeded_dataset.patient.id}/diagnoses/{seeded_dataset.diagnosis.id}/'
+
+        with query_budget(AUTH_QUERIES + 2, seconds=0.5):
+            response = seeded_dataset.client.get(url)
+
+        assert len(response.data['interpretations']) == 3
+
+    def test_patient_create(self, seeded_dataset, query_budget):
+        with query_budget(AUTH_QUERIES + 1, seconds=0.5):
+            response = seeded_dataset.client.post('/api/patients/', {'full_name': 'New Patient', 'gender': 'F'})
+
+        assert response.status_code == 201
+
+    @pytest.mark.parametrize('seeded_dataset', [10], indirect=True)
+    def test_budget_catches_n_plus_one(self, seeded_dataset, query_budget, monkeypatch):
+        """Ensures listing with the nested interpretations serializer would fail CI"""
+        monkeypatch.setattr(DiagnosisListCreateView, 'get_serializer_class', lambda view: DiagnosisSerializer)
+
+        with pytest.raises(pytest.fail.Exception, match='queries executed, the budget is 3'):
+            with query_budget(AUTH_QUERIES + 1):
+                seeded_dataset.client.get(f'/api/patients/{seeded_dataset.patient.id}/diagnoses/')
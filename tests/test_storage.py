@@ -0,0 +1,89 @@
+import io
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from fyp_backend.storage import S3Storage, local_copy
+
+
+@pytest.fixture
+def s3(settings):
+    """An S3Storage backed by moto's in-process S3 stand-in"""
+    pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+
+    with moto.mock_aws():
+        storage = S3Storage(
+            BUCKET='test-media', REGION='us-east-1', ENDPOINT_URL=None, ACCESS_KEY='test', SECRET_KEY='test',
+            MULTIPART_THRESHOLD=5 * 1024 ** 2, MULTIPART_CHUNK_SIZE=5 * 1024 ** 2,
+        )
+        storage.client.create_bucket(Bucket='test-media')
+        yield storage
+
+
+class TestS3Storage:
+    """Tests for the S3-compatible media storage"""
+
+    def test_save_open_delete(self, s3):
+        name = s3.save('echos/sha256/ab/abc.avi', ContentFile(b"echo bytes"))
+
+        assert s3.exists(name)
+        assert s3.size(name) == 10
+        with s3.open(name) as f:
+            assert f.read() == b"echo bytes"
+        head = s3.client.head_object(Bucket='test-media', Key='media/' + name)
+        assert head['ContentType'] == 'video/x-msvideo'
+
+        s3.delete(name)
+        assert not s3.exists(name)
+        with pytest.raises(FileNotFoundError):
+            s3.open(name)
+
+    def test_large_files_use_multipart_upload(self, s3):
+        """Ensures echoes above the threshold are sent as several parts"""
+        content = os.urandom(11 * 1024 ** 2)
+        name = s3.save('echos/large.avi', ContentFile(content))
+
+        head = s3.client.head_object(Bucket='test-media', Key='media/' + name)
+        assert head['ETag'].strip('"').endswith('-3')
+        with s3.open(name) as f:
+            assert f.read() == content
+
+    def test_presigned_urls(self, s3):
+        name = s3.save('echos/a.avi', ContentFile(b"x"))
+
+        assert 'X-Amz-Signature=' in s3.url(name)
+        upload = s3.presigned_upload('echos/b.avi', 'video/x-msvideo', max_size=1024)
+        assert upload['fields']['key'] == 'media/echos/b.avi'
+        assert 'policy' in upload['fields'] or 'Policy' in upload['fields']
+
+    def test_client_side_multipart_upload(self, s3):
+        upload_id = s3.start_multipart_upload('echos/c.avi', 'video/x-msvideo')
+        part = s3.client.upload_part(Bucket='test-media', Key='media/echos/c.avi', UploadId=upload_id,
+                                     PartNumber=1, Body=b"only part")
+
+        assert 'uploadId=' in s3.presigned_part_url('echos/c.avi', upload_id, 1)
+        s3.complete_multipart_upload('echos/c.avi', upload_id, [(1, part['ETag'])])
+        with s3.open('echos/c.avi') as f:
+            assert f.read() == b"only part"
+
+    def test_local_copy_downloads_and_cleans_up(self, s3, settings, tmp_path):
+        settings.ECHO_UPLOAD_TEMP_DIR = str(tmp_path)
+        name = s3.save('echos/d.avi', ContentFile(b"frames"))
+
+        with local_copy(name, storage=s3) as path:
+            assert path.endswith('.avi')
+            with open(path, 'rb') as f:
+                assert f.read() == b"frames"
+        assert not os.path.exists(path)
+
+
+def test_local_copy_uses_local_files_in_place(tmp_path):
+    storage = FileSystemStorage(location=str(tmp_path))
+    name = storage.save('echo.avi', io.BytesIO(b"frames"))
+
+    with local_copy(name, storage=storage) as path:
+        assert path == storage.path(name)
+    assert os.path.exists(path)